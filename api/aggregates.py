@@ -0,0 +1,139 @@
+"""
+Running aggregates of offer prices over category subtrees.
+
+Every category keeps the sum and the number of offer prices in its
+subtree (``price_sum``, ``offer_count``) and its ``price`` is their floor
+average. Changes are applied as deltas to the affected ancestor chains
+only, so reading the average of any category never scans its subtree.
+"""
+
+from django.db import connection
+from django.db.models import BigIntegerField, Case, F, IntegerField, Value, When
+from django.db.models.functions import NullIf
+
+from .models import ShopUnitType
+from .tree import path_ids
+from .utils import chunked
+
+
+def average(price_sum: int, offer_count: int):
+    """
+    Returns the floor average price, ``None`` for an empty category.
+    """
+    if not offer_count:
+        return None
+    return price_sum // offer_count
+
+
+def contribution(unit) -> tuple:
+    """
+    Returns what a unit adds to the aggregates of its ancestors.
+
+    Args:
+        unit (ShopUnit): An offer or a category.
+
+    Returns:
+        tuple: The sum of prices and the number of offers. Imports reject
+        offers without a price, one stored before that is not counted.
+    """
+    if unit.type == ShopUnitType.OFFER:
+        return (0, 0) if unit.price is None else (unit.price, 1)
+    return unit.price_sum, unit.offer_count
+
+
+def add_delta(deltas: dict, ids, price_sum: int, offer_count: int) -> None:
+    """
+    Accumulates a change of the aggregates of given units.
+
+    Args:
+        deltas (dict): Mapping of unit id to ``[price_sum, offer_count]``.
+        ids (Iterable[uuid.UUID]): Units to change.
+        price_sum (int): Change of the sum of prices.
+        offer_count (int): Change of the number of offers.
+    """
+    if not price_sum and not offer_count:
+        return
+    for unit_id in ids:
+        delta = deltas.setdefault(unit_id, [0, 0])
+        delta[0] += price_sum
+        delta[1] += offer_count
+
+
+def ancestor_ids(path: str) -> list:
+    """
+    Returns ids of the categories above the unit with given path.
+    """
+    return path_ids(path)[:-1] if path else []
+
+
+def apply_deltas(model, deltas: dict) -> None:
+    """
+    Writes accumulated deltas to the database.
+
+    All units are updated by one statement (one per chunk of units on
+    backends limiting query parameters) picking the delta of every row
+    with ``CASE``, so the number of queries doesn't grow with the number
+    of changed categories. The average is recomputed too.
+
+    Args:
+        model: The ShopUnit model class.
+        deltas (dict): Mapping of unit id to ``[price_sum, offer_count]``.
+    """
+    changed = [
+        (unit_id, price_sum, offer_count)
+        for unit_id, (price_sum, offer_count) in deltas.items()
+        if price_sum or offer_count
+    ]
+    # a unit takes a parameter in the filter and two in each of four CASEs
+    size = (connection.features.max_query_params or 0) // 9 or None
+
+    for chunk in chunked(changed, size):
+        price_sum = Case(
+            *[When(id=unit_id, then=Value(delta)) for unit_id, delta, _ in chunk],
+            output_field=BigIntegerField(),
+        )
+        offer_count = Case(
+            *[When(id=unit_id, then=Value(delta)) for unit_id, _, delta in chunk],
+            output_field=IntegerField(),
+        )
+        model.objects.filter(id__in=[unit_id for unit_id, _, _ in chunk]).update(
+            price_sum=F("price_sum") + price_sum,
+            offer_count=F("offer_count") + offer_count,
+            price=(F("price_sum") + price_sum)
+            / NullIf(F("offer_count") + offer_count, 0),
+        )
+
+
+def rebuild_aggregates(model, batch_size=1000) -> int:
+    """
+    Recomputes the aggregates of every category from scratch.
+
+    Args:
+        model: The ShopUnit model class (the historical one in migrations).
+        batch_size (int): Number of rows per UPDATE.
+
+    Returns:
+        int: The number of updated categories.
+    """
+    deltas = {}
+    offers = model.objects.filter(type=ShopUnitType.OFFER, price__isnull=False)
+    for path, price in offers.values_list("path", "price").iterator():
+        add_delta(deltas, ancestor_ids(path), price, 1)
+
+    categories = []
+    for unit_id in model.objects.filter(type=ShopUnitType.CATEGORY).values_list(
+        "id", flat=True
+    ):
+        price_sum, offer_count = deltas.get(unit_id, (0, 0))
+        categories.append(
+            model(
+                id=unit_id,
+                price_sum=price_sum,
+                offer_count=offer_count,
+                price=average(price_sum, offer_count),
+            )
+        )
+    model.objects.bulk_update(
+        categories, ["price_sum", "offer_count", "price"], batch_size=batch_size
+    )
+    return len(categories)
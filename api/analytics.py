@@ -0,0 +1,248 @@
+"""
+Price analytics of a subtree computed on NumPy arrays.
+
+The statistic rows of all offers of a subtree are loaded with one query
+into columns (offer number, timestamp, price) and every aggregate is
+computed with array operations over groups of rows instead of a Python
+loop over the rows.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+
+from .history import INTERVALS
+from .models import ShopUnit, ShopUnitStatisticUnit, ShopUnitType
+from .tree import subtree_filter
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+# percentiles returned when the request doesn't ask for others
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+def to_microseconds(date) -> int:
+    """
+    Converts an aware date to microseconds since the epoch.
+    """
+    return (date - EPOCH) // MICROSECOND
+
+
+def load_history(path: str, date_start=None, date_end=None) -> tuple:
+    """
+    Loads the price history of all offers of a subtree.
+
+    Of the rows before ``date_start`` only the last one of every offer is
+    loaded, the first row in the window is compared to it. The rows are
+    fetched with a plain cursor, converting millions of ids and dates
+    through the ORM would take longer than the aggregation.
+
+    Args:
+        path (str): Materialized path of the root of the subtree.
+        date_start (datetime, optional): Only rows from this date on, and
+            the row preceding them.
+        date_end (datetime, optional): Only rows before this date.
+
+    Returns:
+        tuple: Arrays of offer numbers, timestamps in microseconds and
+        prices, ordered by offer and date.
+    """
+    offers = ShopUnit.objects.filter(subtree_filter(path), type=ShopUnitType.OFFER)
+    rows = ShopUnitStatisticUnit.objects.filter(
+        id__in=offers.values("id"), type=ShopUnitType.OFFER, price__isnull=False
+    )
+    if date_end is not None:
+        rows = rows.filter(date__lt=date_end)
+    if date_start is not None:
+        # a later row of the offer before the window, served by the
+        # (id, date) index
+        later = ShopUnitStatisticUnit.objects.filter(
+            Q(date__gt=OuterRef("date"))
+            | Q(date=OuterRef("date"), statid__gt=OuterRef("statid")),
+            id=OuterRef("id"),
+            price__isnull=False,
+            date__lt=date_start,
+        )
+        rows = rows.filter(Q(date__gte=date_start) | ~Exists(later))
+    rows = rows.order_by("id", "date", "statid").values_list("id", "date", "price")
+
+    sql, params = rows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return to_columns(cursor.fetchall())
+
+
+def to_columns(rows: list) -> tuple:
+    """
+    Converts ``(id, date, price)`` rows ordered by id into arrays.
+
+    Dates are aware, or naive in UTC where the database driver has no
+    time zones (SQLite).
+    """
+    count = len(rows)
+    ids, dates, prices = zip(*rows) if rows else ((), (), ())
+
+    unit_ids = np.empty(count, dtype=object)
+    unit_ids[:] = ids
+    first = np.ones(count, dtype=bool)
+    first[1:] = unit_ids[1:] != unit_ids[:-1]
+    offers = np.cumsum(first) - 1
+
+    epoch = EPOCH
+    if dates and dates[0].tzinfo is None:
+        epoch = EPOCH.replace(tzinfo=None)
+    times = np.fromiter(
+        ((date - epoch) // MICROSECOND for date in dates), dtype=np.int64, count=count
+    )
+    return offers, times, np.array(prices, dtype=np.int64)
+
+
+def price_changes(offers, prices):
+    """
+    Marks rows whose price differs from the previous row of the same offer.
+
+    The first row of an offer is its creation, not a change.
+    """
+    changed = np.zeros(len(prices), dtype=bool)
+    changed[1:] = (offers[1:] == offers[:-1]) & (prices[1:] != prices[:-1])
+    return changed
+
+
+def aggregate(groups, offers, prices, changed, percentiles) -> dict:
+    """
+    Computes price aggregates of rows grouped by an integer key.
+
+    Percentiles are interpolated linearly between the closest ranks, like
+    ``numpy.percentile`` does.
+
+    Args:
+        groups (ndarray): Group key of every row, non-decreasing within
+            the rows of an offer.
+        offers (ndarray): Offer number of every row, rows are ordered by it.
+        prices (ndarray): Price of every row.
+        changed (ndarray): Whether a row changed the price of its offer.
+        percentiles (Iterable[float]): Percentiles to compute.
+
+    Returns:
+        dict: Arrays with one element per group, ordered by the key.
+    """
+    if not len(groups):
+        return {}
+
+    # the rows of an offer in a group are adjacent, the first one is counted
+    first = np.ones(len(groups), dtype=np.int64)
+    first[1:] = (offers[1:] != offers[:-1]) | (groups[1:] != groups[:-1])
+
+    order = sort_by_group_and_price(groups, prices)
+    groups, prices = groups[order], prices[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    counts = np.diff(np.r_[starts, len(groups)])
+
+    result = {
+        "group": groups[starts],
+        "count": counts,
+        "offers": np.add.reduceat(first[order], starts),
+        "changes": np.add.reduceat(changed[order].astype(np.int64), starts),
+        "min": prices[starts],
+        "max": prices[starts + counts - 1],
+        "mean": np.add.reduceat(prices, starts) / counts,
+    }
+    for percentile in percentiles:
+        position = (counts - 1) * (percentile / 100)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, counts - 1)
+        low = prices[starts + lower]
+        result[percentile_key(percentile)] = low + (
+            prices[starts + upper] - low
+        ) * (position - lower)
+    return result
+
+
+def sort_by_group_and_price(groups, prices):
+    """
+    Returns the indices sorting rows by group and then by price.
+
+    Both keys are packed into one integer when it can't overflow, a single
+    sort of it is several times faster than ``numpy.lexsort``.
+    """
+    groups = groups - groups.min()
+    prices = prices - prices.min()
+    span = int(prices.max()) + 1
+    if (int(groups.max()) + 1) * span < np.iinfo(np.int64).max:
+        return np.argsort(groups * span + prices)
+    return np.lexsort((prices, groups))
+
+
+def percentile_key(percentile: float) -> str:
+    """
+    Names a percentile in the response, e.g. ``p90`` or ``p99.9``.
+    """
+    return "p{:g}".format(percentile)
+
+
+def to_rows(result: dict) -> list:
+    """
+    Turns arrays of aggregates into one dict of Python numbers per group.
+    """
+    keys = list(result)
+    columns = [result[key].tolist() for key in keys]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def empty_summary(percentiles) -> dict:
+    """
+    Aggregates of a subtree without rows in the window.
+    """
+    summary = {"count": 0, "offers": 0, "changes": 0}
+    for key in ["min", "max", "mean"] + [percentile_key(p) for p in percentiles]:
+        summary[key] = None
+    return summary
+
+
+def price_analytics(
+    path: str,
+    date_start=None,
+    date_end=None,
+    interval=None,
+    percentiles=DEFAULT_PERCENTILES,
+) -> dict:
+    """
+    Computes price aggregates of the offers of a subtree.
+
+    Every statistic row of an offer is one price observation. ``changes``
+    counts rows which changed the price of their offer, so the last row
+    before the window is loaded too to compare its first rows.
+
+    Args:
+        path (str): Materialized path of the root of the subtree.
+        date_start (datetime, optional): Only rows from this date on.
+        date_end (datetime, optional): Only rows before this date.
+        interval (str, optional): One of ``INTERVALS``, adds the aggregates
+            of every interval as ``items``.
+        percentiles (Iterable[float]): Percentiles to compute.
+
+    Returns:
+        dict: The aggregates of the window.
+    """
+    offers, times, prices = load_history(path, date_start, date_end)
+    changed = price_changes(offers, prices)
+    if date_start is not None:
+        window = times >= to_microseconds(date_start)
+        offers, times = offers[window], times[window]
+        prices, changed = prices[window], changed[window]
+
+    summary = to_rows(
+        aggregate(np.zeros_like(times), offers, prices, changed, percentiles)
+    )
+    result = summary[0] if summary else empty_summary(percentiles)
+    result.pop("group", None)
+
+    if interval is not None:
+        width = INTERVALS[interval] // MICROSECOND
+        items = to_rows(aggregate(times // width, offers, prices, changed, percentiles))
+        for item in items:
+            item["date"] = EPOCH + item.pop("group") * INTERVALS[interval]
+        result["items"] = items
+    return result
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # connects signal receivers
+        from . import cache, conditional, replica  # noqa: F401
+        from .db import set_sqlite_pragmas
+
+        connection_created.connect(set_sqlite_pragmas)
@@ -0,0 +1,124 @@
+"""
+Asynchronous versions of the read endpoints.
+
+They are routed instead of the DRF views when ``settings.API_ASYNC_READS``
+is set and the project is served under ASGI, where one process keeps many
+requests in flight. Django 4.0 has no async ORM yet, so the queries of a
+request run in its own worker thread through ``sync_to_async`` while the
+event loop goes on with other requests. Responses are rendered by the
+same renderer as the DRF views, so both return identical bytes.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.renderers import JSONRenderer
+
+from . import reads
+from .changes import accepts_events, async_wait_for_changes, event_stream
+from .conditional import async_condition, catalog_etag, catalog_last_modified
+from .metrics import serialization
+from .reads import ReadError
+
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    """
+    Renders data the way DRF's ``Response`` does.
+    """
+    with serialization():
+        content = JSONRenderer().render(data)
+    return HttpResponse(content, status=status, content_type="application/json")
+
+
+def read_only(view):
+    """
+    Answers 405 to requests other than GET and HEAD.
+    """
+
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        return await view(request, *args, **kwargs)
+
+    return inner
+
+
+async def read(function, request, *args) -> HttpResponse:
+    """
+    Runs one of ``api.reads`` in a worker thread and renders its result.
+    """
+    try:
+        data = await sync_to_async(function)(request, *args)
+    except ReadError as e:
+        return json_response({"message": e.message}, status=e.status)
+    return json_response(data)
+
+
+@read_only
+@async_condition(catalog_etag, catalog_last_modified)
+async def all_units(request):
+    if request.GET.get("stream"):
+        # Django 4.0 iterates streaming responses inside the event loop,
+        # where the ORM can't be used, and collecting the lines first would
+        # hold the whole catalog in memory
+        return json_response(
+            {"message": "stream is not available, page with limit and cursor"},
+            status=400,
+        )
+    return await read(reads.all_units, request)
+
+
+@read_only
+@async_condition(catalog_etag, catalog_last_modified)
+async def node(request, pk):
+    return await read(reads.node, request, pk)
+
+
+@read_only
+async def statistics(request, pk):
+    return await read(reads.statistics, request, pk)
+
+
+@read_only
+async def analytics(request, pk):
+    return await read(reads.analytics, request, pk)
+
+
+@read_only
+async def search(request):
+    return await read(reads.search, request)
+
+
+@read_only
+async def sales(request):
+    return await read(reads.sales, request)
+
+
+@read_only
+async def changes(request):
+    try:
+        since, limit, wait = reads.changes_params(request)
+    except ReadError as e:
+        return json_response({"message": e.message}, status=e.status)
+    events = accepts_events(request)
+    if events and wait is None:
+        wait = settings.CHANGES_MAX_WAIT
+    if since is not None and wait:
+        await async_wait_for_changes(since, wait)
+    if not events:
+        return await read(reads.changes, request)
+
+    # the ORM can't be used while streaming (see all_units), so the events
+    # available now are sent at once and the client reconnects
+    try:
+        body = await sync_to_async(
+            lambda: "".join(event_stream(reads.changes(request), limit, 0))
+        )()
+    except ReadError as e:
+        return json_response({"message": e.message}, status=e.status)
+    response = HttpResponse(body, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    return response
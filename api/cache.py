@@ -0,0 +1,119 @@
+"""
+Read-through cache of serialized node payloads.
+
+Payloads of ``/api/nodes/<id>`` and ``/api/all`` are stored in the cache
+named by ``settings.NODE_CACHE_ALIAS`` (a local memory LRU by default).
+A change of a unit evicts the payloads of that unit and its ancestors,
+see ``signals.units_changed``, but only in the writing process. So every
+entry is tagged with the catalog version it was built at and, for a node,
+the sequence number of the last change in its subtree (see
+``changes.subtree_seq()``). While the catalog version read from the
+database for the request is the same, the entry is served as is. After
+any change the subtree is checked once: if nothing in it changed, the
+entry is tagged with the new version, otherwise it is a miss. A process
+thus never serves a payload another process changed, whatever the
+backend, and changes elsewhere in the catalog keep the entry.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import receiver
+
+from .signals import units_changed
+
+ALL_KEY = "all"
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0}
+
+
+def get_cache():
+    """
+    Returns the cache used for node payloads.
+    """
+    return caches[settings.NODE_CACHE_ALIAS]
+
+
+def node_key(unit_id) -> str:
+    """
+    Returns the cache key of the payloads of a unit.
+    """
+    return "node:{}".format(unit_id)
+
+
+def cache_stats() -> dict:
+    """
+    Returns hit and miss counters of this process.
+    """
+    with _lock:
+        hits, misses = _counters["hits"], _counters["misses"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hitRatio": hits / total if total else None,
+    }
+
+
+def get_or_build(key: str, variant, build, version: int, subtree_seq=None):
+    """
+    Returns a payload from the cache, building and storing it on a miss.
+
+    All variants of a resource (e.g. different ``depth`` of a node) are
+    stored under one key, so they are evicted together.
+
+    Args:
+        key (str): Cache key of the resource.
+        variant: Hashable variant of the resource.
+        build (Callable): Builds the payload, ``None`` is not cached.
+        version (int): The catalog version read before building, the
+            payload reflects it or a later one.
+        subtree_seq (Callable, optional): Returns the last change of the
+            data of the resource. Without it an entry of another catalog
+            version is a miss.
+
+    Returns:
+        The payload.
+    """
+    cache = get_cache()
+    entry_version, seq, entry = cache.get(key) or (None, None, {})
+    if entry_version != version:
+        # read before building, the payload reflects it or a later change
+        current = subtree_seq() if subtree_seq is not None else None
+        if current is None or current != seq:
+            entry = {}
+        elif variant in entry:
+            # nothing changed in the subtree since
+            cache.set(key, (version, seq, entry))
+        seq = current
+    if variant in entry:
+        with _lock:
+            _counters["hits"] += 1
+        return entry[variant]
+
+    with _lock:
+        _counters["misses"] += 1
+    payload = build()
+    if payload is not None:
+        entry[variant] = payload
+        cache.set(key, (version, seq, entry))
+    return payload
+
+
+def evict(ids) -> None:
+    """
+    Evicts payloads of given units and the list of all units.
+    """
+    get_cache().delete_many([node_key(unit_id) for unit_id in ids] + [ALL_KEY])
+
+
+@receiver(units_changed)
+def evict_changed_units(sender, ids, **kwargs):
+    # evicted once more after commit, as a concurrent request may have
+    # cached the old state of the units in the meantime
+    ids = list(ids)
+    evict(ids)
+    transaction.on_commit(lambda: evict(ids))
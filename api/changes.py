@@ -0,0 +1,224 @@
+"""
+Change log of the catalog for incremental mirrors.
+
+Every import and delete appends a ``ShopUnitChange`` per changed unit
+(the imported or deleted units and the categories above them, whose
+price and date changed along) in its own transaction. The entries are
+written after ``units_changed`` bumped the catalog version, which locks
+the version row until commit, so sequence numbers are handed out in
+commit order and a reader never sees a change before an earlier one.
+
+``GET /api/changes?since=<seq>`` collapses the entries after ``seq`` per
+unit and returns the current state of the changed units and the ids of
+the deleted ones, with the sequence number to continue from. A mirror
+loads the current sequence number (``/api/changes`` without ``since``),
+then ``/api/all``, and from then on applies the changes since the last
+sequence number it has seen, so it only ever transfers what changed.
+Clients may wait for changes (long polling) or receive them as
+Server-Sent Events.
+"""
+
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max, Subquery
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import CatalogVersion, ShopUnit, ShopUnitChange
+from .serializers import serialize_units
+from .utils import chunked
+
+
+class ChangesPruned(Exception):
+    """
+    Raised when the changes after a sequence number are no longer kept,
+    the client has to load the whole catalog again.
+    """
+
+
+def record_changes(upserted, deleted=()) -> None:
+    """
+    Appends changed units to the log, inside the writing transaction.
+
+    Args:
+        upserted (Iterable[uuid.UUID]): Created or updated units.
+        deleted (Iterable[uuid.UUID]): Deleted units.
+    """
+    date = timezone.now()
+    entries = [ShopUnitChange(unitId=unit_id, date=date) for unit_id in upserted]
+    entries += [
+        ShopUnitChange(unitId=unit_id, deleted=True, date=date) for unit_id in deleted
+    ]
+    ShopUnitChange.objects.bulk_create(entries)
+
+
+def latest_seq() -> int:
+    """
+    Returns the sequence number of the last change, 0 for an empty log.
+    """
+    seq = ShopUnitChange.objects.aggregate(seq=Max("seq"))["seq"]
+    return seq if seq is not None else pruned_seq()
+
+
+def pruned_seq() -> int:
+    """
+    Returns the sequence number up to which the log was pruned.
+    """
+    pruned = CatalogVersion.objects.filter(pk=1).values_list(
+        "changes_pruned", flat=True
+    )
+    return pruned.first() or 0
+
+
+def subtree_seq(unit_id) -> int:
+    """
+    Returns the sequence number of the last change in the subtree of a unit.
+
+    A change is logged for every category above the changed unit too, so
+    this is the last entry of the unit itself. Once it is pruned, the
+    pruned sequence number is returned, which is at least as large.
+    """
+    last = (
+        ShopUnitChange.objects.filter(unitId=unit_id)
+        .order_by("-seq")
+        .values("seq")[:1]
+    )
+    row = (
+        CatalogVersion.objects.filter(pk=1)
+        .annotate(last=Subquery(last))
+        .values_list("changes_pruned", "last")
+        .first()
+    )
+    pruned, seq = row or (0, None)
+    return max(pruned, seq or 0)
+
+
+def changes_since(since: int, limit: int) -> dict:
+    """
+    Collects the changes after a sequence number.
+
+    Args:
+        since (int): The last sequence number seen by the client.
+        limit (int): Maximal number of log entries to collapse.
+
+    Returns:
+        dict: ``items`` with the current state of upserted units in the
+        order of their last change, ``deleted`` ids, ``seq`` to continue
+        from and ``more`` if there are further changes right away.
+
+    Raises:
+        ChangesPruned: If changes after ``since`` were already removed.
+    """
+    if since < pruned_seq():
+        raise ChangesPruned()
+
+    entries = list(
+        ShopUnitChange.objects.filter(seq__gt=since)
+        .order_by("seq")
+        .values_list("seq", "unitId", "deleted")[: limit + 1]
+    )
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    # the last entry of a unit wins
+    latest = {}
+    for _, unit_id, deleted in entries:
+        latest.pop(unit_id, None)
+        latest[unit_id] = deleted
+    upserted = [unit_id for unit_id, deleted in latest.items() if not deleted]
+    order = {str(unit_id): i for i, unit_id in enumerate(upserted)}
+
+    items = []
+    for chunk in chunked(upserted):
+        items += serialize_units(ShopUnit.objects.filter(id__in=chunk))
+    # a unit deleted by a later change is missing, that change follows
+    items.sort(key=lambda item: order[item["id"]])
+
+    return {
+        "items": items,
+        "deleted": [str(unit_id) for unit_id, deleted in latest.items() if deleted],
+        "seq": entries[-1][0] if entries else since,
+        "more": more,
+    }
+
+
+def has_changes(since: int) -> bool:
+    """
+    Returns whether there are changes after a sequence number.
+    """
+    return ShopUnitChange.objects.filter(seq__gt=since).exists()
+
+
+def wait_for_changes(since: int, timeout: float) -> None:
+    """
+    Polls the log until there are changes after ``since`` or the timeout
+    expires.
+    """
+    deadline = time.monotonic() + timeout
+    while not has_changes(since) and time.monotonic() < deadline:
+        time.sleep(min(settings.CHANGES_POLL_INTERVAL, deadline - time.monotonic()))
+
+
+async def async_wait_for_changes(since: int, timeout: float) -> None:
+    """
+    ``wait_for_changes()`` which doesn't block the event loop.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not await sync_to_async(has_changes)(
+        since
+    ):
+        await asyncio.sleep(
+            min(settings.CHANGES_POLL_INTERVAL, deadline - time.monotonic())
+        )
+
+
+def format_event(page: dict) -> str:
+    """
+    Formats a page of changes as a Server-Sent Event; its id is the
+    sequence number a reconnecting client sends back as ``Last-Event-ID``.
+    """
+    data = json.dumps(page, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+    return "id: {}\nevent: changes\ndata: {}\n\n".format(page["seq"], data)
+
+
+def accepts_events(request) -> bool:
+    """
+    Returns whether the client asks for Server-Sent Events.
+    """
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+def event_stream(page: dict, limit: int, timeout: float):
+    """
+    Yields Server-Sent Events with a page and the changes following it
+    until the timeout expires, the client then reconnects.
+
+    The first page is sent even if it is empty, so the client learns the
+    sequence number to reconnect with.
+
+    Args:
+        page (dict): The first page, see ``changes_since()``.
+        limit (int): Maximal number of log entries per event.
+        timeout (float): Seconds to keep the stream open.
+
+    Yields:
+        str: The events.
+    """
+    deadline = time.monotonic() + timeout
+    yield "retry: {}\n\n".format(int(settings.CHANGES_POLL_INTERVAL * 1000))
+    yield format_event(page)
+    while True:
+        if not page["more"]:
+            if time.monotonic() >= deadline:
+                return
+            wait_for_changes(page["seq"], deadline - time.monotonic())
+        try:
+            page = changes_since(page["seq"], limit)
+        except ChangesPruned:
+            return
+        if page["items"] or page["deleted"]:
+            yield format_event(page)
@@ -0,0 +1,102 @@
+"""
+Conditional GET support.
+
+Responses of ``/api/all`` and ``/api/nodes/<id>`` carry an ``ETag`` built
+from the catalog version, which every change of shop units bumps, and the
+date of that bump as ``Last-Modified``. A client sending them back gets
+``304 Not Modified`` before anything is fetched or serialized, at the cost
+of reading the version row.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import CatalogVersion
+from .signals import units_changed
+
+
+@receiver(units_changed)
+def bump_catalog_version(sender, **kwargs):
+    CatalogVersion.bump()
+
+
+def get_catalog_version(request) -> tuple:
+    """
+    Returns the catalog version and the date of its last bump.
+
+    The pair is read once per request, by the primary key of its row. A
+    copy kept in a per-process cache would go stale in every server
+    process but the one which bumped it.
+
+    Returns:
+        tuple: ``(version, updated)``.
+    """
+    if not hasattr(request, "catalog_version"):
+        current = CatalogVersion.current()
+        request.catalog_version = (current.version, current.updated)
+    return request.catalog_version
+
+
+def catalog_etag(request, *args, **kwargs) -> str:
+    """
+    Returns the ETag of any representation of the catalog.
+    """
+    return str(get_catalog_version(request)[0])
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    """
+    Returns the date of the last change of the catalog.
+
+    It is used for single nodes too: the ``date`` of a unit comes from the
+    client and isn't changed by deletes below it, so it can't tell whether
+    a response changed.
+    """
+    return get_catalog_version(request)[1]
+
+
+def async_condition(etag_func, last_modified_func):
+    """
+    ``django.views.decorators.http.condition`` for async views.
+
+    The validators may query the database, so they run in a worker thread.
+
+    Args:
+        etag_func (Callable): Returns the ETag of the requested resource.
+        last_modified_func (Callable): Returns its last modification date.
+    """
+
+    def validators(request, *args, **kwargs):
+        etag = quote_etag(etag_func(request, *args, **kwargs))
+        last_modified = last_modified_func(request, *args, **kwargs)
+        if last_modified is not None and not timezone.is_aware(last_modified):
+            last_modified = timezone.make_aware(last_modified, timezone.utc)
+        return etag, last_modified and int(last_modified.timestamp())
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(
+                request, *args, **kwargs
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = await view(request, *args, **kwargs)
+
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                if not response.has_header("ETag"):
+                    response.headers["ETag"] = etag
+            return response
+
+        return inner
+
+    return decorator
@@ -0,0 +1,19 @@
+from django.conf import settings
+
+
+def set_sqlite_pragmas(sender, connection, **kwargs) -> None:
+    """
+    Tunes a new SQLite connection with ``settings.SQLITE_PRAGMAS``.
+
+    Connected to the ``connection_created`` signal in ApiConfig.ready().
+
+    Args:
+        sender: The database wrapper class.
+        connection: The new database connection.
+        **kwargs: Other signal arguments.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,109 @@
+"""
+Synthetic catalogs for benchmarks and manual testing.
+
+A catalog is a tree of categories ``depth`` levels deep with ``fanout``
+children per category. Offers are spread over the leaf categories with
+skewed weights, as real shops have a few large categories and many small
+ones, and priced around a level of their top category. The history is a
+series of import batches, each repricing a share of the offers and
+moving a few of them to another category.
+
+Everything is drawn from one seeded ``random.Random``, so the same
+arguments always produce the same catalog.
+"""
+
+import random
+import uuid
+
+
+def make_id(rnd: random.Random) -> str:
+    """
+    Draws a UUID from the generator, so ids are reproducible too.
+    """
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def generate_catalog(offers: int, depth: int = 3, fanout: int = 10, seed: int = 0):
+    """
+    Builds a catalog in the ``POST /api/imports`` format.
+
+    Args:
+        offers (int): Number of offers.
+        depth (int): Number of category levels.
+        fanout (int): Number of children of every category, and of top
+            categories.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: Items ordered so that parents come before their children.
+    """
+    rnd = random.Random(seed)
+    items, level = [], [(None, "", None)]
+    for _ in range(depth):
+        children = []
+        for parent_id, prefix, price_level in level:
+            for i in range(1, fanout + 1):
+                name = "{}.{}".format(prefix, i) if prefix else str(i)
+                item = {
+                    "id": make_id(rnd),
+                    "name": "Category " + name,
+                    "parentId": parent_id,
+                    "price": None,
+                    "type": "CATEGORY",
+                }
+                items.append(item)
+                # top categories set the price level of their subtree
+                children.append(
+                    (item["id"], name, price_level or 10 ** rnd.uniform(2, 5))
+                )
+        level = children
+
+    weights = [rnd.expovariate(1) for _ in level]
+    leaves = rnd.choices(level, weights=weights, k=offers)
+    for i, (parent_id, _, price_level) in enumerate(leaves):
+        items.append(
+            {
+                "id": make_id(rnd),
+                "name": "Offer {}".format(i),
+                "parentId": parent_id,
+                "price": max(1, int(price_level * rnd.lognormvariate(0, 0.5))),
+                "type": "OFFER",
+            }
+        )
+    return items
+
+
+def generate_history(
+    items: list, rounds: int, share: float = 0.1, moves: float = 0.01, seed: int = 0
+) -> list:
+    """
+    Builds import batches changing offers of a catalog.
+
+    Args:
+        items (list): The catalog, see ``generate_catalog()``.
+        rounds (int): Number of batches.
+        share (float): Share of the offers repriced by every batch.
+        moves (float): Share of the repriced offers moved to another leaf
+            category.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: Lists of items, one per batch.
+    """
+    rnd = random.Random(seed)
+    offers = {item["id"]: dict(item) for item in items if item["type"] == "OFFER"}
+    ids = list(offers)
+    leaves = sorted({offer["parentId"] for offer in offers.values()})
+    count = min(len(ids), max(1, round(len(ids) * share))) if ids else 0
+
+    batches = []
+    for _ in range(rounds):
+        batch = []
+        for offer_id in rnd.sample(ids, count):
+            offer = offers[offer_id]
+            offer["price"] = max(1, round(offer["price"] * rnd.uniform(0.8, 1.2)))
+            if rnd.random() < moves:
+                offer["parentId"] = rnd.choice(leaves)
+            batch.append(dict(offer))
+        batches.append(batch)
+    return batches
@@ -0,0 +1,106 @@
+"""
+Windowed access to the statistics history of a shop unit.
+"""
+
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# downsampling intervals of /node/<id>/statistic
+INTERVALS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def parse_date_param(params, name: str):
+    """
+    Reads an optional ISO 8601 date from query parameters.
+
+    Args:
+        params (QueryDict): Query parameters of the request.
+        name (str): Name of the parameter.
+
+    Returns:
+        datetime | None: The date, ``None`` if the parameter is missing.
+
+    Raises:
+        ValueError: If the date is malformed.
+    """
+    value = params.get(name)
+    if value is None:
+        return None
+    date = parse_datetime(value)
+    if date is None:
+        raise ValueError("Incorrect data format")
+    return date
+
+
+def bucket_start(date, interval: str):
+    """
+    Truncates a date to the start of its downsampling bucket.
+    """
+    date = date.replace(minute=0, second=0, microsecond=0)
+    if interval == "day":
+        date = date.replace(hour=0)
+    return date
+
+
+def after_row(date, statid) -> Q:
+    """
+    Builds a filter matching rows after the given one in (date, statid) order.
+    """
+    return Q(date__gt=date) | Q(date=date, statid__gt=statid)
+
+
+def downsample(rows, interval: str, limit=None) -> tuple:
+    """
+    Keeps the last row of every interval.
+
+    Args:
+        rows (Iterable[dict]): Rows with a ``date`` key, ordered by date.
+        interval (str): One of ``INTERVALS``.
+        limit (int, optional): Maximal number of returned rows.
+
+    Returns:
+        tuple: The rows and the start of the bucket following the last
+        returned one if there are more rows, otherwise ``None``.
+    """
+    result, last, current = [], None, None
+    for row in rows:
+        bucket = bucket_start(row["date"], interval)
+        if current is not None and bucket != current:
+            result.append(last)
+            if limit is not None and len(result) == limit:
+                return result, bucket
+        current, last = bucket, row
+    if last is not None:
+        result.append(last)
+    return result, None
+
+
+def superseded(rows, interval: str):
+    """
+    Finds rows followed by a later row of the same unit in the same interval.
+
+    Removing them leaves what ``downsample()`` would return for every unit.
+
+    Args:
+        rows (Iterable[dict]): Rows with ``id`` and ``date`` keys, ordered
+            by id and date.
+        interval (str): One of ``INTERVALS``.
+
+    Yields:
+        dict: The superseded rows.
+    """
+    previous = None
+    for row in rows:
+        if (
+            previous is not None
+            and previous["id"] == row["id"]
+            and bucket_start(previous["date"], interval)
+            == bucket_start(row["date"], interval)
+        ):
+            yield previous
+        previous = row
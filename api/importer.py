@@ -0,0 +1,597 @@
+"""
+Set-based import engine for ShopUnit's.
+
+A whole batch from ``POST /api/imports`` is validated in memory against
+a single prefetch of every referenced unit and written with bulk queries
+inside one transaction, so the number of round trips does not depend on
+the number of items.
+"""
+
+import json
+import uuid
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Length
+from django.utils.dateparse import parse_datetime
+
+from .aggregates import add_delta, ancestor_ids, apply_deltas, average, contribution
+from .changes import record_changes
+from .models import CatalogVersion, ShopUnit, ShopUnitType, ShopUnitStatisticUnit
+from .signals import units_changed
+from .tree import (
+    MAX_DEPTH,
+    MAX_PATH_LENGTH,
+    SEGMENT_LENGTH,
+    move_subtree,
+    node_path,
+    path_ids,
+    subtree_filter,
+)
+from .utils import chunked
+
+# largest value of an IntegerField on every supported database
+MAX_PRICE = 2**31 - 1
+
+
+class ImportValidationError(Exception):
+    """
+    Raised when an import batch can't be applied.
+
+    Attributes:
+        message (str): Human readable reason, returned to the client as is.
+    """
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class PartialImportError(ImportValidationError):
+    """
+    Raised when a chunk of a streamed import can't be applied.
+
+    Attributes:
+        applied (int): Number of items imported by the preceding chunks.
+    """
+
+    def __init__(self, message: str, applied: int) -> None:
+        super().__init__(message)
+        self.applied = applied
+
+
+def parse_uuid(value):
+    """
+    Converts an id from the request into a UUID.
+
+    Args:
+        value: The raw id, ``None`` and ``"null"`` mean "no id".
+
+    Returns:
+        uuid.UUID | None: The parsed id.
+
+    Raises:
+        ImportValidationError: If the value is not a valid UUID.
+    """
+    if value is None or value == "null" or value == "":
+        return None
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise ImportValidationError("{} is not a valid UUID".format(value))
+
+
+def parse_date(value):
+    """
+    Converts the date of an import into a datetime.
+
+    Args:
+        value (str | datetime): The raw date.
+
+    Returns:
+        datetime: The parsed date.
+
+    Raises:
+        ImportValidationError: If the value is not a valid date.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        date = parse_datetime(value)
+    except ValueError:
+        # well formed, but out of range, e.g. the 13th month
+        date = None
+    if date is None:
+        raise ImportValidationError("Incorrect data format")
+    return date
+
+
+def parse_price(item: dict) -> int:
+    """
+    Reads the price of an offer, 0 if it is omitted.
+
+    Raises:
+        ImportValidationError: If the price is not a non-negative integer.
+    """
+    price = item.get("price", 0)
+    # JSON true and false are ints in Python
+    if type(price) is not int or not 0 <= price <= MAX_PRICE:
+        raise ImportValidationError("Validation Failed")
+    return price
+
+
+def fetch_units(ids) -> dict:
+    """
+    Loads existing shop units by their ids.
+
+    Args:
+        ids (Iterable[uuid.UUID]): Ids to look up.
+
+    Returns:
+        dict: Mapping of id to ShopUnit for the ids that exist.
+    """
+    units = {}
+    for chunk in chunked(list(ids)):
+        for unit in ShopUnit.objects.filter(id__in=chunk):
+            units[unit.id] = unit
+    return units
+
+
+def parse_items(items) -> dict:
+    """
+    Validates the shape of every item in the batch.
+
+    Args:
+        items (list): Raw items from the request.
+
+    Returns:
+        dict: Mapping of item id to a normalized item dict.
+
+    Raises:
+        ImportValidationError: If any of the items is malformed or an id
+            occurs more than once.
+    """
+    if not isinstance(items, list):
+        raise ImportValidationError("Validation Failed")
+
+    parsed = {}
+    for item in items:
+        if not isinstance(item, dict) or not item.get("name"):
+            raise ImportValidationError("Validation Failed")
+
+        item_type = {
+            ShopUnitType.OFFER: ShopUnitType.OFFER,
+            ShopUnitType.CATEGORY: ShopUnitType.CATEGORY,
+        }.get(item.get("type"))
+        if item_type is None:
+            raise ImportValidationError("No such type")
+
+        item_id = parse_uuid(item.get("id")) or uuid.uuid4()
+        if item_id in parsed:
+            raise ImportValidationError("Duplicate id {}".format(item_id))
+        parsed[item_id] = {
+            "id": item_id,
+            "name": item["name"],
+            "type": item_type,
+            "parentId": parse_uuid(item.get("parentId")),
+            "price": parse_price(item) if item_type == ShopUnitType.OFFER else None,
+        }
+    return parsed
+
+
+def validate_batch(parsed: dict, existing: dict) -> None:
+    """
+    Checks the batch against the stored units.
+
+    Args:
+        parsed (dict): Normalized batch items by id.
+        existing (dict): Prefetched units by id, including every parent
+            which is not a part of the batch.
+
+    Raises:
+        ImportValidationError: If a unit changes its type or its parent
+            doesn't exist or is an offer (as it will be after the import).
+    """
+    for item in parsed.values():
+        unit = existing.get(item["id"])
+        if unit is not None and unit.type != item["type"]:
+            raise ImportValidationError("Forbidden to change type")
+
+        parent_id = item["parentId"]
+        if parent_id is None:
+            continue
+        parent = parsed.get(parent_id) or existing.get(parent_id)
+        if parent is None:
+            raise ImportValidationError("Parent does not exist")
+        parent_type = parent["type"] if isinstance(parent, dict) else parent.type
+        if parent_type == ShopUnitType.OFFER:
+            raise ImportValidationError("Parent must be a category")
+
+
+def path_dependencies(parsed: dict, existing: dict) -> dict:
+    """
+    Finds the batch unit the new path of every batch unit derives from.
+
+    That is the parent if it is a part of the batch, otherwise the nearest
+    batch unit above the stored parent, since a unit outside of the batch
+    keeps its parent and only moves along with its ancestors.
+
+    Returns:
+        dict: Mapping of item id to the id it depends on or ``None``.
+    """
+    dependencies = {}
+    for unit_id, item in parsed.items():
+        parent_id = item["parentId"]
+        dependency = None
+        if parent_id in parsed:
+            dependency = parent_id
+        elif parent_id is not None:
+            for ancestor_id in reversed(path_ids(existing[parent_id].path)):
+                if ancestor_id in parsed:
+                    dependency = ancestor_id
+                    break
+        dependencies[unit_id] = dependency
+    return dependencies
+
+
+def topological_order(dependencies: dict) -> list:
+    """
+    Orders batch units so that every unit follows the one it depends on.
+
+    Args:
+        dependencies (dict): Result of ``path_dependencies()``.
+
+    Returns:
+        list: Ids of the batch units.
+
+    Raises:
+        ImportValidationError: If the batch makes a unit its own ancestor.
+    """
+    dependents = {}
+    for unit_id, dependency in dependencies.items():
+        if dependency is not None:
+            dependents.setdefault(dependency, []).append(unit_id)
+
+    order = [unit_id for unit_id in dependencies if dependencies[unit_id] is None]
+    for unit_id in order:
+        order.extend(dependents.get(unit_id, []))
+    if len(order) != len(dependencies):
+        # units on a cycle never get a resolved dependency
+        raise ImportValidationError("Cycle in parents")
+    return order
+
+
+def resolve_paths(parsed: dict, existing: dict) -> dict:
+    """
+    Computes the tree paths every unit of the batch will have after import.
+
+    Args:
+        parsed (dict): Normalized batch items by id.
+        existing (dict): Prefetched units by id, including every parent
+            which is not a part of the batch.
+
+    Returns:
+        dict: Mapping of item id to its new path, in topological order.
+
+    Raises:
+        ImportValidationError: If the batch makes a unit its own ancestor.
+    """
+    dependencies = path_dependencies(parsed, existing)
+    paths = {}
+    for unit_id in topological_order(dependencies):
+        parent_id = parsed[unit_id]["parentId"]
+        if parent_id is None:
+            parent_path = None
+        elif parent_id in parsed:
+            parent_path = paths[parent_id]
+        else:
+            parent_path = existing[parent_id].path
+            dependency = dependencies[unit_id]
+            if dependency is not None:
+                # replace the part of the path up to the moved batch unit
+                end = 1 + (path_ids(parent_path).index(dependency) + 1) * SEGMENT_LENGTH
+                parent_path = paths[dependency] + parent_path[end:]
+        paths[unit_id] = node_path(parent_path, unit_id)
+    return paths
+
+
+def validate_depth(paths: dict, existing: dict) -> None:
+    """
+    Checks that no path of the batch or of a moved subtree becomes longer
+    than ``ShopUnit.path`` can hold.
+
+    Args:
+        paths (dict): New paths of the batch items.
+        existing (dict): Prefetched units by id.
+
+    Raises:
+        ImportValidationError: If the tree would get deeper than
+            ``MAX_DEPTH`` levels.
+    """
+    for unit_id, path in paths.items():
+        length = len(path)
+        unit = existing.get(unit_id)
+        if (
+            unit is not None
+            and unit.type == ShopUnitType.CATEGORY
+            and length > len(unit.path)
+        ):
+            # the deepest descendant moves down along with the category
+            deepest = ShopUnit.objects.filter(subtree_filter(unit.path)).aggregate(
+                length=Max(Length("path"))
+            )["length"]
+            length += deepest - len(unit.path)
+        if length > MAX_PATH_LENGTH:
+            raise ImportValidationError(
+                "Tree is deeper than {} levels".format(MAX_DEPTH)
+            )
+
+
+def collect_deltas(parsed: dict, existing: dict, paths: dict) -> dict:
+    """
+    Computes how the batch changes the price aggregates of categories.
+
+    Every offer is accounted to its nearest ancestor-or-self from the
+    batch. Such a part of a subtree moves (and, for an offer, gets
+    repriced) as a whole, so it is removed from the old ancestor chain of
+    that batch unit and added to the new one. Nothing else changes.
+
+    Args:
+        parsed (dict): Normalized batch items by id.
+        existing (dict): Prefetched units by id.
+        paths (dict): New paths of the batch items.
+
+    Returns:
+        dict: Mapping of category id to ``[price_sum, offer_count]`` delta.
+    """
+    residuals = {
+        unit_id: list(contribution(existing[unit_id]))
+        for unit_id in parsed
+        if unit_id in existing
+    }
+    for unit_id in residuals:
+        unit = existing[unit_id]
+        price_sum, offer_count = contribution(unit)
+        for ancestor_id in reversed(ancestor_ids(unit.path)):
+            if ancestor_id in residuals:
+                residuals[ancestor_id][0] -= price_sum
+                residuals[ancestor_id][1] -= offer_count
+                break
+
+    deltas = {}
+    for unit_id, item in parsed.items():
+        residual = residuals.get(unit_id, (0, 0))
+        if unit_id in existing:
+            old_path = existing[unit_id].path
+            add_delta(deltas, ancestor_ids(old_path), -residual[0], -residual[1])
+        if item["type"] == ShopUnitType.OFFER:
+            residual = (item["price"], 1)
+        add_delta(deltas, ancestor_ids(paths[unit_id]), *residual)
+    return deltas
+
+
+def recorded_states(unit_ids) -> dict:
+    """
+    Loads the latest statistic row of every given unit.
+
+    Args:
+        unit_ids (list): Ids of the units.
+
+    Returns:
+        dict: Mapping of unit id to ``(name, parentId, price)`` of its
+        latest row, units without statistics are left out.
+    """
+    states = {}
+    for chunk in chunked(unit_ids):
+        rows = ShopUnitStatisticUnit.objects.filter(id__in=chunk).latest_per_unit()
+        for unit_id, *state in rows.values_list("id", "name", "parentId", "price"):
+            states[unit_id] = tuple(state)
+    return states
+
+
+def import_items(items, update_date) -> list:
+    """
+    Creates or updates a batch of shop units.
+
+    Every id and parentId referenced by the batch is prefetched at once,
+    the whole batch is validated in memory (a parent may be defined later
+    in the same batch) and only then written with bulk queries in a single
+    transaction, so a rejected batch leaves the database untouched. The
+    stored units are read under the write lock of the catalog, so imports
+    running at the same time are applied one after another.
+    A statistic row is only written for units whose name, parent or price
+    differ from their latest row (see ``settings.STATISTICS_CHANGES_ONLY``).
+
+    Args:
+        items (list): Items from the request body.
+        update_date (str | datetime): Date of the import.
+
+    Returns:
+        list: The created and updated ShopUnit objects.
+
+    Raises:
+        ImportValidationError: If the batch can't be applied.
+    """
+    date = parse_date(update_date)
+    if date is None:
+        raise ImportValidationError("Incorrect data format")
+
+    parsed = parse_items(items)
+    with transaction.atomic():
+        # taken before reading, or two imports compute their changes of
+        # the aggregates and paths from the same state
+        CatalogVersion.lock()
+        return apply_batch(parsed, date)
+
+
+def apply_batch(parsed: dict, date) -> list:
+    """
+    Validates and writes a parsed batch, inside the locked transaction of
+    ``import_items()``.
+
+    Args:
+        parsed (dict): Normalized batch items by id.
+        date (datetime): Date of the import.
+
+    Returns:
+        list: The created and updated ShopUnit objects.
+
+    Raises:
+        ImportValidationError: If the batch can't be applied.
+    """
+    parent_ids = {item["parentId"] for item in parsed.values()} - {None}
+    existing = fetch_units(parsed.keys() | parent_ids)
+
+    # validate the whole batch before anything is written
+    validate_batch(parsed, existing)
+    paths = resolve_paths(parsed, existing)
+    validate_depth(paths, existing)
+    deltas = collect_deltas(parsed, existing, paths)
+
+    to_create, to_update, relinked, moved = [], [], [], []
+    changed_ids = set()
+    # parents are created before their children
+    for unit_id in paths:
+        item = parsed[unit_id]
+        unit = existing.get(unit_id)
+        if unit is None:
+            unit = ShopUnit(id=unit_id, type=item["type"])
+            to_create.append(unit)
+        else:
+            changed_ids.update(path_ids(unit.path))
+            if unit.parentId != item["parentId"]:
+                relinked.append(unit.id)
+            if unit.type == ShopUnitType.CATEGORY and unit.path != paths[unit.id]:
+                moved.append((unit.path, paths[unit.id]))
+            to_update.append(unit)
+        unit.name = item["name"]
+        unit.date = date
+        unit.parentId = item["parentId"]
+        unit.path = paths[unit.id]
+        changed_ids.update(path_ids(unit.path))
+        if unit.type == ShopUnitType.OFFER:
+            unit.price = item["price"]
+
+    # a subtree nested into another moved one has to be rewritten first
+    moved.sort(key=lambda move: len(move[0]), reverse=True)
+
+    units = to_create + to_update
+    through = ShopUnit.children.through
+    recorded = {}
+    if settings.STATISTICS_CHANGES_ONLY:
+        recorded = recorded_states([unit.id for unit in to_update])
+
+    for old_path, new_path in moved:
+        if old_path:
+            move_subtree(ShopUnit, old_path, new_path)
+    ShopUnit.objects.bulk_create(to_create)
+    # the price of a category is maintained by apply_deltas()
+    for unit_type, fields in (
+        (ShopUnitType.OFFER, ["name", "date", "parentId", "price", "path"]),
+        (ShopUnitType.CATEGORY, ["name", "date", "parentId", "path"]),
+    ):
+        ShopUnit.objects.bulk_update(
+            [unit for unit in to_update if unit.type == unit_type], fields
+        )
+    apply_deltas(ShopUnit, deltas)
+    # a change of a unit is a change of every category above it
+    for chunk in chunked(list(changed_ids - parsed.keys())):
+        ShopUnit.objects.filter(id__in=chunk, date__lt=date).update(date=date)
+
+    for chunk in chunked(relinked):
+        through.objects.filter(to_shopunit_id__in=chunk).delete()
+    relinked = set(relinked) | {unit.id for unit in to_create}
+    through.objects.bulk_create(
+        [
+            through(from_shopunit_id=unit.parentId, to_shopunit_id=unit.id)
+            for unit in units
+            if unit.parentId is not None and unit.id in relinked
+        ]
+    )
+
+    for unit in units:
+        if unit.type == ShopUnitType.CATEGORY:
+            price_sum, offer_count = deltas.get(unit.id, (0, 0))
+            unit.price_sum += price_sum
+            unit.offer_count += offer_count
+            unit.price = average(unit.price_sum, unit.offer_count)
+
+    ShopUnitStatisticUnit.objects.bulk_create(
+        [
+            ShopUnitStatisticUnit(
+                id=unit.id,
+                name=unit.name,
+                parentId=unit.parentId,
+                type=unit.type,
+                date=date,
+                price=unit.price,
+            )
+            for unit in units
+            if recorded.get(unit.id) != (unit.name, unit.parentId, unit.price)
+        ]
+    )
+
+    units_changed.send(sender=ShopUnit, ids=changed_ids)
+    record_changes(changed_ids)
+
+    return units
+
+
+def read_ndjson(lines):
+    """
+    Parses newline delimited JSON lazily, skipping blank lines.
+
+    Raises:
+        ImportValidationError: If a line is not valid JSON.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            raise ImportValidationError("Line {} is not valid JSON".format(number))
+
+
+def import_stream(lines, update_date, chunk_size: int) -> int:
+    """
+    Imports items read one by one, e.g. from a request body.
+
+    Items are applied with ``import_items()`` in chunks of ``chunk_size``,
+    every chunk in its own transaction, so memory usage doesn't depend on
+    the number of items. A parent has to come before its children or in
+    the same chunk.
+
+    Args:
+        lines (Iterable[bytes | str]): Lines with one JSON item each.
+        update_date (str): Date of the import.
+        chunk_size (int): Number of items applied at once.
+
+    Returns:
+        int: The number of imported items.
+
+    Raises:
+        PartialImportError: If a chunk can't be applied, the preceding
+            chunks stay imported.
+    """
+    try:
+        if update_date is None:
+            raise ImportValidationError("Incorrect data format")
+        update_date = parse_date(update_date)
+    except ImportValidationError as e:
+        raise PartialImportError(e.message, 0)
+
+    items, applied = read_ndjson(lines), 0
+    while True:
+        try:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return applied
+            import_items(chunk, update_date)
+        except ImportValidationError as e:
+            raise PartialImportError(e.message, applied)
+        applied += len(chunk)
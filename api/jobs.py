@@ -0,0 +1,222 @@
+"""
+Queue of import jobs kept in the database.
+
+``POST /api/imports?async=1`` stores the batch as a ``ShopUnitImportRequest``
+with its ``ShopUnitImport`` items and returns at once. Jobs are applied one
+at a time in the order they were queued, by a worker thread of the web
+process or by ``python manage.py run_import_worker``, so no broker is
+needed. Several processes may run workers: a job is claimed with a single
+conditional UPDATE which only succeeds while no other job is running. A
+job running longer than ``IMPORT_JOB_TIMEOUT`` is marked failed, never run
+again, as its worker may still be applying it.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists
+from django.utils import timezone
+
+from .importer import ImportValidationError, import_items, parse_date, parse_items
+from .models import ImportStatus, ShopUnitImport, ShopUnitImportRequest
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue(items, update_date) -> ShopUnitImportRequest:
+    """
+    Queues a batch for import.
+
+    The shape of the items and the date are checked right away, everything
+    that depends on the stored units is checked when the job runs.
+
+    Args:
+        items (list): Items from the request body.
+        update_date (str): Date of the import.
+
+    Returns:
+        ShopUnitImportRequest: The queued job.
+
+    Raises:
+        ImportValidationError: If the batch is malformed.
+    """
+    if not isinstance(update_date, str):
+        raise ImportValidationError("Incorrect data format")
+    date = parse_date(update_date)
+    parsed = parse_items(items)
+
+    rows = [
+        ShopUnitImport(
+            unitId=item["id"],
+            name=item["name"],
+            type=item["type"],
+            parentId=item["parentId"],
+            price=item["price"],
+            position=position,
+        )
+        for position, item in enumerate(parsed.values())
+    ]
+    with transaction.atomic():
+        job = ShopUnitImportRequest.objects.create(updateDate=date, size=len(rows))
+        ShopUnitImport.objects.bulk_create(rows)
+        job.items.add(*rows)
+
+    transaction.on_commit(wake_worker)
+    return job
+
+
+def job_items(job: ShopUnitImportRequest) -> list:
+    """
+    Returns the items of a job in the import request format.
+    """
+    return [
+        {
+            "id": row.unitId,
+            "name": row.name,
+            "type": row.type,
+            "parentId": row.parentId,
+            "price": row.price,
+        }
+        for row in job.items.order_by("position")
+    ]
+
+
+def fail_stale() -> int:
+    """
+    Marks jobs running longer than ``IMPORT_JOB_TIMEOUT`` as failed.
+
+    Their workers died or hang, and a job is not requeued: a hanging
+    worker may still apply it, concurrently with the one running it again.
+    The outcome of a job is committed with its import, so a job whose
+    worker died has written nothing, and a worker which finishes it after
+    all overwrites the error with its outcome.
+
+    Returns:
+        int: The number of failed jobs.
+    """
+    now = timezone.now()
+    deadline = now - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT)
+    return ShopUnitImportRequest.objects.filter(
+        status=ImportStatus.RUNNING, started__lt=deadline
+    ).update(
+        status=ImportStatus.FAILED,
+        error="Abandoned after {} seconds".format(settings.IMPORT_JOB_TIMEOUT),
+        finished=now,
+    )
+
+
+def claim_next():
+    """
+    Marks the oldest queued job as running, unless another one is running.
+
+    Returns:
+        ShopUnitImportRequest | None: The claimed job.
+    """
+    job_id = (
+        ShopUnitImportRequest.objects.filter(status=ImportStatus.QUEUED)
+        .order_by("id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if job_id is None:
+        return None
+    running = ShopUnitImportRequest.objects.filter(status=ImportStatus.RUNNING)
+    claimed = (
+        ShopUnitImportRequest.objects.filter(id=job_id, status=ImportStatus.QUEUED)
+        .exclude(Exists(running))
+        .update(status=ImportStatus.RUNNING, started=timezone.now())
+    )
+    if not claimed:
+        return None
+    return ShopUnitImportRequest.objects.get(id=job_id)
+
+
+def run_job(job: ShopUnitImportRequest) -> None:
+    """
+    Applies a claimed job and records its outcome.
+
+    The items are removed afterwards, the job row keeps the status.
+    """
+    try:
+        with transaction.atomic():
+            import_items(job_items(job), job.updateDate)
+            finish_job(job, ImportStatus.DONE)
+    except ImportValidationError as e:
+        finish_job(job, ImportStatus.FAILED, e.message)
+    except Exception as e:
+        logger.exception("Import job %s failed", job.id)
+        finish_job(job, ImportStatus.FAILED, "Internal error: {}".format(e))
+
+
+def finish_job(job: ShopUnitImportRequest, status: str, error: str = "") -> None:
+    """
+    Records the outcome of a job and removes its items.
+    """
+    job.status, job.error, job.finished = status, error, timezone.now()
+    with transaction.atomic():
+        job.save(update_fields=["status", "error", "finished"])
+        ShopUnitImport.objects.filter(shopunitimportrequest=job).delete()
+
+
+def run_pending() -> int:
+    """
+    Applies queued jobs until there are none this process may claim.
+
+    Returns:
+        int: The number of applied jobs.
+    """
+    fail_stale()
+    count = 0
+    while True:
+        job = claim_next()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def work(poll_interval: float) -> None:
+    """
+    Runs queued jobs forever, waking up on new jobs of this process and
+    every ``poll_interval`` seconds for jobs queued by other processes.
+    """
+    while True:
+        _wakeup.wait(poll_interval)
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            run_pending()
+        except Exception:
+            logger.exception("Import worker failed")
+        finally:
+            close_old_connections()
+
+
+def wake_worker() -> None:
+    """
+    Starts the worker thread of this process if needed and wakes it up.
+
+    Called when a job is queued and when the server process starts (see
+    prices/wsgi.py), so jobs left queued by a restart are applied.
+    """
+    global _worker
+
+    if not settings.IMPORT_WORKER_THREAD:
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=work,
+                args=(settings.IMPORT_WORKER_POLL_INTERVAL,),
+                name="import-worker",
+                daemon=True,
+            )
+            _worker.start()
+    _wakeup.set()
@@ -0,0 +1,95 @@
+import json
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.history import INTERVALS, after_row, superseded
+from api.models import ShopUnitStatisticUnit
+from api.serializers import STATISTIC_FIELDS, serialize_statistics
+
+
+class Command(BaseCommand):
+    help = (
+        "Keeps only the last statistic row of every unit per interval among "
+        "rows older than the retention horizon, optionally archiving the "
+        "removed rows as newline delimited JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.STATISTICS_RETENTION_DAYS,
+            help="Rows older than this many days are compacted",
+        )
+        parser.add_argument(
+            "--interval",
+            default=settings.STATISTICS_RETENTION_INTERVAL,
+            help="Interval kept by one row: " + ", ".join(INTERVALS),
+        )
+        parser.add_argument(
+            "--archive", help="Append the removed rows to this NDJSON file"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Number of rows per DELETE"
+        )
+
+    def rows_before(self, horizon, page_size: int):
+        """
+        Yields rows older than the horizon ordered by id and date.
+
+        Rows are read page by page, so rows which were already yielded can
+        be deleted in the meantime.
+        """
+        queryset = (
+            ShopUnitStatisticUnit.objects.filter(date__lt=horizon)
+            .order_by("id", "date", "statid")
+            .values(*STATISTIC_FIELDS, "statid")
+        )
+        page = list(queryset[:page_size])
+        while page:
+            yield from page
+            last = page[-1]
+            after = Q(id__gt=last["id"]) | Q(
+                after_row(last["date"], last["statid"]), id=last["id"]
+            )
+            page = list(queryset.filter(after)[:page_size])
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        if interval not in INTERVALS:
+            raise CommandError("interval must be one of: " + ", ".join(INTERVALS))
+        horizon = timezone.now() - timedelta(days=options["days"])
+
+        rows = self.rows_before(horizon, settings.API_STREAM_CHUNK_SIZE)
+        victims = superseded(rows, interval)
+        archive = open(options["archive"], "a") if options["archive"] else None
+
+        count = 0
+        try:
+            while True:
+                batch = list(islice(victims, options["batch_size"]))
+                if not batch:
+                    break
+                if archive is not None:
+                    for data in serialize_statistics(batch):
+                        archive.write(json.dumps(data, cls=JSONEncoder) + "\n")
+                    archive.flush()
+                with transaction.atomic():
+                    ShopUnitStatisticUnit.objects.filter(
+                        statid__in=[row["statid"] for row in batch]
+                    ).delete()
+                count += len(batch)
+        finally:
+            if archive is not None:
+                archive.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Removed {count} statistic rows older than {horizon}")
+        )
@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from api.generator import generate_catalog, generate_history
+from api.importer import ImportValidationError, import_items
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a synthetic catalog of categories and offers, followed by "
+        "batches of price changes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--offers", type=int, default=1000, help="Number of offers")
+        parser.add_argument(
+            "--depth", type=int, default=3, help="Number of category levels"
+        )
+        parser.add_argument(
+            "--fanout", type=int, default=10, help="Children of every category"
+        )
+        parser.add_argument(
+            "--history", type=int, default=0, help="Number of price change batches"
+        )
+        parser.add_argument(
+            "--changes",
+            type=float,
+            default=0.1,
+            help="Share of the offers repriced by every batch",
+        )
+        parser.add_argument(
+            "--start",
+            default="2022-05-01T00:00:00.000Z",
+            help="Date of the catalog import",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=24, help="Hours between the batches"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.IMPORT_STREAM_CHUNK_SIZE,
+            help="Number of catalog items per import",
+        )
+
+    def handle(self, *args, **options):
+        start = parse_datetime(options["start"])
+        if start is None:
+            raise CommandError("start must be an ISO 8601 date")
+        if options["depth"] < 1 or options["fanout"] < 1:
+            raise CommandError("depth and fanout must be positive")
+
+        items = generate_catalog(
+            options["offers"], options["depth"], options["fanout"], options["seed"]
+        )
+        history = generate_history(
+            items, options["history"], options["changes"], seed=options["seed"]
+        )
+
+        size = options["batch_size"]
+        try:
+            # parents come first, so every chunk only refers to known units
+            for i in range(0, len(items), size):
+                import_items(items[i : i + size], start)
+            for i, batch in enumerate(history, 1):
+                import_items(batch, start + i * timedelta(hours=options["interval"]))
+        except ImportValidationError as e:
+            raise CommandError(e.message)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {len(items) - options['offers']} categories, "
+                f"{options['offers']} offers and {len(history)} batches of changes"
+            )
+        )
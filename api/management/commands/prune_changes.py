@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import CatalogVersion, ShopUnitChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes change log entries older than the retention horizon, mirrors "
+        "which fell further behind have to load the whole catalog again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CHANGES_RETENTION_DAYS,
+            help="Entries older than this many days are removed",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=10000, help="Number of rows per DELETE"
+        )
+
+    def handle(self, *args, **options):
+        horizon = timezone.now() - timedelta(days=options["days"])
+        old = ShopUnitChange.objects.filter(date__lt=horizon)
+        last = old.aggregate(seq=Max("seq"))["seq"]
+
+        count = 0
+        if last is not None:
+            # readers get 410 from now on instead of missing the entries
+            CatalogVersion.current()
+            CatalogVersion.objects.filter(pk=1, changes_pruned__lt=last).update(
+                changes_pruned=last
+            )
+            first = ShopUnitChange.objects.order_by("seq").values_list(
+                "seq", flat=True
+            )[0]
+            for start in range(first, last + 1, options["batch_size"]):
+                end = min(start + options["batch_size"] - 1, last)
+                count += ShopUnitChange.objects.filter(
+                    seq__gte=start, seq__lte=end
+                ).delete()[0]
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Removed {count} change log entries older than {horizon}"
+            )
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.aggregates import rebuild_aggregates
+from api.models import ShopUnit
+from api.tree import rebuild_paths
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the materialized path of every shop unit from parentId "
+        "and the price aggregates of every category"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Number of rows per UPDATE"
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_paths(ShopUnit, batch_size=options["batch_size"])
+            categories = rebuild_aggregates(ShopUnit, batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt paths of {count} units and aggregates of {categories} categories"
+            )
+        )
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_pending, work
+
+
+class Command(BaseCommand):
+    help = "Applies queued imports (POST /api/imports?async=1) in their order"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Apply the queued imports and exit instead of waiting for more",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.IMPORT_WORKER_POLL_INTERVAL,
+            help="Seconds between checks for new imports",
+        )
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            count = run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Applied {count} queued imports"))
+            return
+        work(options["poll_interval"])
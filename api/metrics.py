@@ -0,0 +1,376 @@
+"""
+Per-request instrumentation published in the Prometheus text format.
+
+``MetricsMiddleware`` measures every request: latency, number and time
+of database queries, time spent serializing (the fast-path serializers
+and rendering of the response, without the queries they issue) and the
+size of the response body. They are aggregated per endpoint (the route
+pattern) in this process and served by ``/metrics``. A request slower
+than ``settings.METRICS_SLOW_REQUEST_SECONDS`` is logged with its SQL.
+
+The middleware is async capable, so under ASGI it doesn't push every
+request into a thread of its own. Queries are counted by an execute
+wrapper installed on every database connection, which adds them to the
+request in the current context; ``sync_to_async`` copies the context into
+the thread running the queries of an async view.
+
+Like the cache counters of ``/api/cache``, the numbers belong to the
+serving process; with several gunicorn workers every scrape sees one of
+them, tell them apart by the ``pid`` label.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, StreamingHttpResponse
+
+from . import cache as node_cache
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = tuple(100 * 4**i for i in range(10))
+# statements kept for the slow request log
+SQL_LIMIT = 50
+SQL_LENGTH = 1000
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Measurements of one request.
+
+    Attributes:
+        queries (int): Number of database queries.
+        db_time (float): Seconds spent in database queries.
+        serialization_time (float): Seconds spent serializing, without
+            the queries issued meanwhile.
+        statements (list): ``(seconds, sql)`` of the first queries.
+    """
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.statements = []
+        self.serializing = False
+
+    def execute(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper, see ``connection.execute_wrapper()``.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += elapsed
+            if len(self.statements) < SQL_LIMIT:
+                self.statements.append((elapsed, sql[:SQL_LENGTH]))
+
+
+@contextmanager
+def serialization():
+    """
+    Adds the time of the block to the serialization time of the current
+    request. Nested blocks are counted once.
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    db_time = metrics.db_time
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (metrics.db_time - db_time)
+        metrics.serialization_time += elapsed
+        metrics.serializing = False
+
+
+def timed_serialization(function):
+    """
+    Decorator counting the time of a function as serialization.
+    """
+
+    @wraps(function)
+    def inner(*args, **kwargs):
+        with serialization():
+            return function(*args, **kwargs)
+
+    return inner
+
+
+class Histogram:
+    """
+    Cumulative histogram of observations per label set.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: tuple) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.setdefault(labels, [[0] * len(self.buckets), 0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, names: tuple) -> list:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            bucket = self.name + "_bucket"
+            for bound, cumulative in zip(self.buckets, counts):
+                lines.append(sample(bucket, names, labels, cumulative, le=bound))
+            lines.append(sample(bucket, names, labels, count, le="+Inf"))
+            lines.append(sample(self.name + "_sum", names, labels, total))
+            lines.append(sample(self.name + "_count", names, labels, count))
+        return lines
+
+
+class Counter:
+    """
+    Monotonic sum per label set.
+    """
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.series = {}
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self, names: tuple) -> list:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} counter".format(self.name),
+        ]
+        for labels, value in sorted(self.series.items()):
+            lines.append(sample(self.name, names, labels, value))
+        return lines
+
+
+def escape(value) -> str:
+    """
+    Escapes a label value of the Prometheus text format.
+    """
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def sample(name: str, names: tuple, labels: tuple, value, **extra) -> str:
+    """
+    Formats a sample line, e.g. ``name{endpoint="api/all",pid="7"} 3``.
+    """
+    pairs = list(zip(names, labels)) + list(extra.items()) + [("pid", os.getpid())]
+    text = ",".join('{}="{}"'.format(key, escape(label)) for key, label in pairs)
+    return "{}{{{}}} {}".format(name, text, value)
+
+
+ENDPOINT_LABELS = ("endpoint", "method")
+REQUEST_LABELS = ("endpoint", "method", "status")
+
+_lock = threading.Lock()
+REQUESTS = Counter("api_requests_total", "Requests by endpoint and status.")
+DURATION = Histogram(
+    "api_request_duration_seconds", "Request latency.", DURATION_BUCKETS
+)
+QUERIES = Histogram(
+    "api_request_db_queries", "Database queries per request.", QUERY_BUCKETS
+)
+DB_TIME = Counter("api_db_seconds_total", "Time spent in database queries.")
+SERIALIZATION_TIME = Counter(
+    "api_serialization_seconds_total", "Time spent serializing responses."
+)
+RESPONSE_SIZE = Histogram(
+    "api_response_size_bytes", "Size of response bodies.", SIZE_BUCKETS
+)
+SLOW_REQUESTS = Counter("api_slow_requests_total", "Requests logged as slow.")
+
+
+def record(request, response, metrics: RequestMetrics, duration: float) -> None:
+    """
+    Adds the measurements of a finished request to the metrics.
+    """
+    match = request.resolver_match
+    endpoint = match.route if match is not None else "unmatched"
+    labels = (endpoint, request.method)
+    size = None
+    if not isinstance(response, StreamingHttpResponse):
+        size = len(response.content)
+    slow = duration >= settings.METRICS_SLOW_REQUEST_SECONDS
+
+    with _lock:
+        REQUESTS.inc(labels + (response.status_code,))
+        DURATION.observe(labels, duration)
+        QUERIES.observe(labels, metrics.queries)
+        DB_TIME.inc(labels, metrics.db_time)
+        SERIALIZATION_TIME.inc(labels, metrics.serialization_time)
+        if size is not None:
+            RESPONSE_SIZE.observe(labels, size)
+        if slow:
+            SLOW_REQUESTS.inc(labels)
+
+    if slow:
+        logger.warning(
+            "Slow request %s %s: %d in %.3f s, %d queries in %.3f s, "
+            "serialization %.3f s, %s bytes\n%s",
+            request.method,
+            request.get_full_path(),
+            response.status_code,
+            duration,
+            metrics.queries,
+            metrics.db_time,
+            metrics.serialization_time,
+            size,
+            "\n".join(
+                "  {:.4f} s {}".format(seconds, sql)
+                for seconds, sql in metrics.statements
+            ),
+        )
+
+
+def render_metrics() -> str:
+    """
+    Renders all metrics of this process in the Prometheus text format.
+    """
+    with _lock:
+        lines = REQUESTS.render(REQUEST_LABELS)
+        for metric in (
+            DURATION,
+            QUERIES,
+            DB_TIME,
+            SERIALIZATION_TIME,
+            RESPONSE_SIZE,
+            SLOW_REQUESTS,
+        ):
+            lines += metric.render(ENDPOINT_LABELS)
+
+    stats = node_cache.cache_stats()
+    for name in ("hits", "misses"):
+        metric = "api_node_cache_{}_total".format(name)
+        lines += [
+            "# HELP {} Node cache {}.".format(metric, name),
+            "# TYPE {} counter".format(metric),
+            sample(metric, (), (), stats[name]),
+        ]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Measures every request, see the module docstring.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # marks the instance as a coroutine function, like Django's
+            # MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.API_METRICS:
+            return self.get_response(request)
+
+        # connections opened before this module was imported
+        for connection in connections.all():
+            install_execute_wrapper(connection)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.API_METRICS:
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returned
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+            db_time = metrics.db_time
+
+            def rendered(response):
+                elapsed = time.perf_counter() - start - (metrics.db_time - db_time)
+                metrics.serialization_time += elapsed
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting queries of the current request.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.execute(execute, sql, params, many, context)
+
+
+def install_execute_wrapper(connection) -> None:
+    """
+    Installs ``execute_wrapper()`` on a connection for its whole lifetime.
+    """
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, execute_wrapper)
+
+
+@receiver(connection_created)
+def measure_connection(sender, connection, **kwargs):
+    # every thread has connections of its own, those of the threads
+    # running sync_to_async() are covered as they connect
+    install_execute_wrapper(connection)
+
+
+def metrics_view(request):
+    """
+    Serves the metrics of this process.
+    """
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+from api.tree import rebuild_paths
+
+
+def backfill_paths(apps, schema_editor):
+    rebuild_paths(apps.get_model('api', 'ShopUnit'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_callable_uuid_defaults'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopunit',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=2048),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+from api.aggregates import rebuild_aggregates
+
+
+def backfill_aggregates(apps, schema_editor):
+    rebuild_aggregates(apps.get_model('api', 'ShopUnit'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_shopunit_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopunit',
+            name='offer_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='shopunit',
+            name='price_sum',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_category_aggregates'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ShopUnitStatisticResponse',
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_drop_statistic_responses'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shopunitstatisticunit',
+            index=models.Index(fields=['type', 'date'], name='api_stat_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shopunitstatisticunit',
+            index=models.Index(fields=['id', 'date'], name='api_stat_id_date_idx'),
+        ),
+    ]
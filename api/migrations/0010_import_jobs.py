@@ -0,0 +1,59 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopunitimport',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopunitimport',
+            name='unitId',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='finished',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='size',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='status',
+            field=models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='QUEUED', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='shopunitimportrequest',
+            name='updateDate',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
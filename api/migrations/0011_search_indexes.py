@@ -0,0 +1,25 @@
+# Generated by Django 4.0.6 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_import_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shopunit',
+            index=models.Index(fields=['price', 'id'], name='api_unit_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shopunit',
+            index=models.Index(fields=['type', 'price', 'id'], name='api_unit_type_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shopunit',
+            index=models.Index(fields=['name'], name='api_unit_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-18 12:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopUnitChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('unitId', models.UUIDField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='catalogversion',
+            name='changes_pruned',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_change_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shopunitchange',
+            index=models.Index(fields=['unitId', 'seq'], name='api_change_unit_seq_idx'),
+        ),
+    ]
@@ -1,5 +1,18 @@
 import uuid
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .signals import units_changed
+from .tree import (
+    MAX_DEPTH,
+    MAX_PATH_LENGTH,
+    move_subtree,
+    node_path,
+    path_ids,
+    subtree_filter,
+    subtree_where,
+)
 
 
 class ShopUnitType(models.TextChoices):
@@ -13,7 +26,7 @@ class ShopUnit(models.Model):
     """
 
     # required fields
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4(), editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=225)
     date = models.DateTimeField()
     type = models.CharField(
@@ -25,6 +38,30 @@ class ShopUnit(models.Model):
     price = models.IntegerField(blank=True, null=True)
     children = models.ManyToManyField("self", symmetrical=False, blank=True)
 
+    # tree index, see api/tree.py
+    path = models.CharField(
+        max_length=MAX_PATH_LENGTH, default="", editable=False, db_index=True
+    )
+
+    # offer prices in the subtree of a category, see api/aggregates.py
+    price_sum = models.BigIntegerField(default=0, editable=False)
+    offer_count = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        # range scans of /api/search, see api/search.py
+        indexes = [
+            models.Index(fields=["price", "id"], name="api_unit_price_idx"),
+            models.Index(
+                fields=["type", "price", "id"], name="api_unit_type_price_idx"
+            ),
+            # prefix LIKE on PostgreSQL, ignored by other databases
+            models.Index(
+                fields=["name"],
+                name="api_unit_name_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
+
     def __str__(self) -> str:
         """
         Convert the object to a string representation.
@@ -34,42 +71,166 @@ class ShopUnit(models.Model):
         """
         return f"{self.name} {str(self.id)}"
 
-    def delete_statistics(self) -> None:
+    def save(self, *args, **kwargs) -> None:
         """
-        Deletes the statistics for the shop unit.
+        Saves the unit, keeping the tree index and the aggregates up to date.
+
+        Imports maintain them in bulk, this covers units created or edited
+        one by one (admin, shell, tests). A unit given another parent gets
+        a new path, takes its subtree along and moves its prices from the
+        old ancestors to the new ones.
+
+        Raises:
+            ValueError: If a category is moved into its own subtree or the
+                tree would get deeper than ``MAX_DEPTH`` levels.
+        """
+        from .aggregates import (
+            add_delta,
+            ancestor_ids,
+            apply_deltas,
+            average,
+            contribution,
+        )
+        from .changes import record_changes
+
+        through = ShopUnit.children.through
+
+        with transaction.atomic():
+            # the stored path and aggregates are read under the write lock
+            CatalogVersion.lock()
+            stored = ShopUnit.objects.filter(id=self.id).first()
+            relinked = stored is None or stored.parentId != self.parentId
+            if not self.path or stored is not None and relinked:
+                parent = None
+                if self.parentId is not None:
+                    parent = ShopUnit.objects.filter(id=self.parentId).first()
+                self.path = node_path(parent.path if parent else None, self.id)
+
+            deltas = {}
+            changed_ids = set(path_ids(self.path))
+            if stored is not None:
+                price_sum, offer_count = contribution(stored)
+                add_delta(deltas, ancestor_ids(stored.path), -price_sum, -offer_count)
+                changed_ids.update(path_ids(stored.path))
+                if self.type == ShopUnitType.CATEGORY:
+                    # maintained by imports and deletes, not by the caller
+                    self.price_sum = stored.price_sum
+                    self.offer_count = stored.offer_count
+                    self.price = average(self.price_sum, self.offer_count)
+            add_delta(deltas, ancestor_ids(self.path), *contribution(self))
+
+            length = len(self.path)
+            moved = stored is not None and stored.path and stored.path != self.path
+            if moved and self.type == ShopUnitType.CATEGORY:
+                if self.path.startswith(stored.path):
+                    raise ValueError("A category can't be moved into its own subtree")
+                # the deepest descendant moves down along with the category
+                deepest = stored.get_descendants().aggregate(
+                    length=models.Max(Length("path"))
+                )["length"]
+                length += deepest - len(stored.path)
+            if length > MAX_PATH_LENGTH:
+                raise ValueError("Tree is deeper than {} levels".format(MAX_DEPTH))
+            if moved and self.type == ShopUnitType.CATEGORY:
+                move_subtree(ShopUnit, stored.path, self.path)
+
+            super().save(*args, **kwargs)
+            apply_deltas(ShopUnit, deltas)
+            if relinked:
+                through.objects.filter(to_shopunit_id=self.id).delete()
+                # a unit with a missing parent is saved as a root
+                if self.parentId is not None and ancestor_ids(self.path):
+                    through.objects.create(
+                        from_shopunit_id=self.parentId, to_shopunit_id=self.id
+                    )
+            units_changed.send(sender=ShopUnit, ids=changed_ids)
+            record_changes(changed_ids)
+
+    def get_descendants(self, include_self: bool = True) -> models.QuerySet:
+        """
+        Returns all units in the subtree of the shop unit.
+
+        Args:
+            include_self (bool): Whether the unit itself is included.
 
         Returns:
-            None
+            QuerySet: The units of the subtree.
         """
-        # Retrieve the statistics for the shop unit
-        statistics = ShopUnitStatisticUnit.objects.filter(id=self.id)
+        queryset = ShopUnit.objects.filter(subtree_filter(self.path))
+        if not include_self:
+            queryset = queryset.exclude(id=self.id)
+        return queryset
 
-        # Check if there are any statistics
-        if not statistics.exists():
-            return
+    def get_ancestors(self) -> models.QuerySet:
+        """
+        Returns all categories above the shop unit.
 
-        # Delete each statistic
-        for stat in statistics:
-            stat.delete()
+        Returns:
+            QuerySet: The ancestors of the unit.
+        """
+        return ShopUnit.objects.filter(id__in=path_ids(self.path)[:-1])
 
-    def delete_recursive(self):
+    def delete_statistics(self) -> None:
         """
-        Recursively deletes an item and its subcategories.
+        Deletes the statistics for the shop unit.
+
+        Returns:
+            None
         """
-        if self.type == ShopUnitType.OFFER:
-            self.delete_statistics()
-            self.delete()
-            return
+        ShopUnitStatisticUnit.objects.filter(id=self.id).delete()
 
-        if self.children.count() == 0:
-            self.delete()
-            return
+    def delete_recursive(self):
+        """
+        Deletes an item together with all its descendants and statistics.
 
-        for child in self.children.all():
-            child.delete_recursive()
+        The subtree is selected by its path, so the whole delete is a few
+        bulk statements in one transaction regardless of the subtree size.
+        The prices of the subtree are subtracted from the aggregates of
+        the categories above it.
 
-        self.delete_statistics()
-        self.delete()
+        Raises:
+            ShopUnit.DoesNotExist: If the unit was deleted in the meantime.
+        """
+        from .aggregates import add_delta, ancestor_ids, apply_deltas, contribution
+        from .changes import record_changes
+
+        through = ShopUnit.children.through
+
+        with transaction.atomic():
+            # the path and the aggregates are read under the write lock, an
+            # import may have moved or repriced the subtree in the meantime
+            CatalogVersion.lock()
+            self.refresh_from_db()
+
+            deltas = {}
+            price_sum, offer_count = contribution(self)
+            add_delta(deltas, ancestor_ids(self.path), -price_sum, -offer_count)
+            subtree = self.get_descendants()
+            subtree_ids = subtree.values("id")
+
+            deleted_ids = list(subtree.values_list("id", flat=True))
+            changed_ids = set(path_ids(self.path))
+            changed_ids.update(deleted_ids)
+            units_changed.send(sender=ShopUnit, ids=changed_ids)
+            record_changes(ancestor_ids(self.path), deleted_ids)
+
+            apply_deltas(ShopUnit, deltas)
+            ShopUnitStatisticUnit.objects.filter(id__in=subtree_ids).delete()
+            through.objects.filter(
+                models.Q(from_shopunit_id__in=subtree_ids)
+                | models.Q(to_shopunit_id__in=subtree_ids)
+            ).delete()
+            # links and statistics are gone, but QuerySet.delete() would
+            # still fetch every row of the subtree to cascade to them and
+            # delete the rows in chunks, so one DELETE by the path is issued
+            where, params = subtree_where(self.path)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM {} WHERE {}".format(
+                        connection.ops.quote_name(ShopUnit._meta.db_table), where
+                    ),
+                    params,
+                )
 
 
 class ShopUnitImport(models.Model):
@@ -78,7 +239,7 @@ class ShopUnitImport(models.Model):
     """
 
     # required fields
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4(), editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=225)
     type = models.CharField(
         max_length=10, choices=ShopUnitType.choices, default=ShopUnitType.OFFER
@@ -88,6 +249,11 @@ class ShopUnitImport(models.Model):
     parentId = models.UUIDField(blank=True, null=True)
     price = models.IntegerField(blank=True, null=True)
 
+    # id of the imported unit and order of the item in a queued request,
+    # see api/jobs.py
+    unitId = models.UUIDField(blank=True, null=True)
+    position = models.IntegerField(default=0)
+
     def __str__(self):
         """
         Convert the object to a string representation.
@@ -98,13 +264,55 @@ class ShopUnitImport(models.Model):
         return self.name
 
 
+class ImportStatus(models.TextChoices):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
 class ShopUnitImportRequest(models.Model):
     """
-    Request to import multiple ShopUnitImport's
+    Request to import multiple ShopUnitImport's, queued as an import job
     """
 
     items = models.ManyToManyField(ShopUnitImport)
-    updateDate = models.DateTimeField
+    updateDate = models.DateTimeField(null=True)
+
+    status = models.CharField(
+        max_length=10, choices=ImportStatus.choices, default=ImportStatus.QUEUED
+    )
+    size = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+
+class ShopUnitStatisticQuerySet(models.QuerySet):
+    def latest_per_unit(self, date_end=None) -> models.QuerySet:
+        """
+        Keeps only the latest row of every unit among the filtered rows.
+
+        A row is kept if the unit has no later row up to ``date_end``. The
+        check is a correlated NOT EXISTS served by the (id, date) index, so
+        the whole computation stays in the database.
+
+        Args:
+            date_end (datetime, optional): The upper bound of the filtered
+                dates, ``None`` if they are not bounded.
+
+        Returns:
+            QuerySet: The latest statistic row of every unit.
+        """
+        date, statid = models.OuterRef("date"), models.OuterRef("statid")
+        later = self.model.objects.filter(
+            models.Q(date__gt=date) | models.Q(date=date, statid__gt=statid),
+            id=models.OuterRef("id"),
+        )
+        if date_end is not None:
+            later = later.filter(date__lte=date_end)
+        return self.filter(~models.Exists(later))
 
 
 class ShopUnitStatisticUnit(models.Model):
@@ -112,9 +320,9 @@ class ShopUnitStatisticUnit(models.Model):
     Unit providing statistics for ShopUnit
     """
 
-    statid = models.UUIDField(primary_key=True, default=uuid.uuid4(), editable=False)
+    statid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     # required fields
-    id = models.UUIDField(default=uuid.uuid4(), editable=False)
+    id = models.UUIDField(default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=225)
     type = models.CharField(
         max_length=10, choices=ShopUnitType.choices, default=ShopUnitType.OFFER
@@ -125,6 +333,14 @@ class ShopUnitStatisticUnit(models.Model):
     parentId = models.UUIDField(blank=True, null=True)
     price = models.IntegerField(blank=True, null=True)
 
+    objects = ShopUnitStatisticQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["type", "date"], name="api_stat_type_date_idx"),
+            models.Index(fields=["id", "date"], name="api_stat_id_date_idx"),
+        ]
+
     def __str__(self) -> str:
         """
         Convert the object to a string representation.
@@ -135,10 +351,68 @@ class ShopUnitStatisticUnit(models.Model):
         return f"{self.name} {str(self.date)}"
 
 
-class ShopUnitStatisticResponse(models.Model):
+class CatalogVersion(models.Model):
     """
-    Response for statistics request
+    Version of the whole catalog, bumped by every change of shop units
     """
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4())
-    items = models.ManyToManyField(ShopUnitStatisticUnit)
+    version = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+    # the change log is pruned up to this sequence number, see api/changes.py
+    changes_pruned = models.BigIntegerField(default=0)
+
+    @classmethod
+    def current(cls) -> "CatalogVersion":
+        """
+        Returns the current version of the catalog.
+        """
+        return cls.objects.get_or_create(pk=1)[0]
+
+    @classmethod
+    def lock(cls) -> None:
+        """
+        Takes the write lock of the catalog until the end of the transaction.
+
+        Imports and deletes compute their changes from the stored units, so
+        they take it before reading them and apply one after another. The
+        no-op UPDATE locks the version row on PostgreSQL and takes the write
+        lock of the database on SQLite before anything is read.
+        """
+        if not cls.objects.filter(pk=1).update(version=models.F("version")):
+            cls.objects.get_or_create(pk=1)
+
+    @classmethod
+    def bump(cls) -> None:
+        """
+        Increments the version of the catalog.
+        """
+        if not cls.objects.filter(pk=1).update(
+            version=models.F("version") + 1, updated=timezone.now()
+        ):
+            cls.objects.get_or_create(pk=1, defaults={"version": 1})
+
+
+class ShopUnitChange(models.Model):
+    """
+    Entry of the change log of the catalog, see api/changes.py
+    """
+
+    seq = models.BigAutoField(primary_key=True)
+    unitId = models.UUIDField()
+    deleted = models.BooleanField(default=False)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # the last change of a subtree, see changes.subtree_seq()
+        indexes = [
+            models.Index(fields=["unitId", "seq"], name="api_change_unit_seq_idx"),
+        ]
+
+    def __str__(self) -> str:
+        """
+        Convert the object to a string representation.
+
+        Returns:
+            str: The string representation of the object.
+        """
+        return f"{self.seq} {'-' if self.deleted else '+'}{self.unitId}"
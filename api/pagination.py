@@ -0,0 +1,78 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A cursor encodes the ordering key of the last returned row, so the next
+page is an indexed range scan no matter how deep into the table it is.
+"""
+
+import base64
+import json
+
+from django.conf import settings
+
+
+class CursorError(ValueError):
+    """
+    Raised when pagination parameters of a request are invalid.
+    """
+
+
+def encode_cursor(*values) -> str:
+    """
+    Builds an opaque cursor from the ordering key of a row.
+
+    Args:
+        *values: Parts of the ordering key, converted to strings.
+
+    Returns:
+        str: The cursor.
+    """
+    data = json.dumps([str(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str, size: int = 1) -> list:
+    """
+    Restores the ordering key stored in a cursor.
+
+    Args:
+        cursor (str): The cursor from a request.
+        size (int): Expected number of key parts.
+
+    Returns:
+        list: The parts of the key as strings.
+
+    Raises:
+        CursorError: If the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise CursorError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise CursorError("Invalid cursor")
+    return values
+
+
+def get_page_size(request) -> int:
+    """
+    Reads the ``limit`` query parameter of a request.
+
+    Args:
+        request: The HTTP request object.
+
+    Returns:
+        int: The page size, ``settings.API_PAGE_SIZE`` by default.
+
+    Raises:
+        CursorError: If the limit is not a number between 1 and
+            ``settings.API_MAX_PAGE_SIZE``.
+    """
+    limit = request.GET.get("limit")
+    if limit is None:
+        return settings.API_PAGE_SIZE
+    if not limit.isdigit() or not 0 < int(limit) <= settings.API_MAX_PAGE_SIZE:
+        raise CursorError(
+            "limit must be between 1 and {}".format(settings.API_MAX_PAGE_SIZE)
+        )
+    return int(limit)
@@ -0,0 +1,477 @@
+"""
+Read endpoints independent of the request handling.
+
+Every function takes a request (only its query parameters are used) and
+returns the data to render or raises ``ReadError``. The synchronous DRF
+views in ``api/views.py`` and the asynchronous ones in
+``api/async_views.py`` are thin wrappers around them.
+"""
+
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.functions import Length
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import cache as node_cache
+from .analytics import DEFAULT_PERCENTILES, price_analytics
+from .changes import ChangesPruned, changes_since, latest_seq, subtree_seq
+from .conditional import get_catalog_version
+from .history import INTERVALS, after_row, downsample, parse_date_param
+from .metrics import serialization
+from .models import ShopUnit, ShopUnitStatisticUnit, ShopUnitType
+from .pagination import CursorError, decode_cursor, encode_cursor, get_page_size
+from .replica import current_replica
+from .search import after_key, get_price_index, prefix_filter
+from .serializers import (
+    STATISTIC_FIELDS,
+    format_datetime,
+    serialize_nodes,
+    serialize_statistics,
+    serialize_units,
+)
+from .tree import MAX_DEPTH, SEGMENT_LENGTH, build_subtree, subtree_filter
+
+# the largest integer a query parameter of the database may be
+MAX_BIGINT = 2**63 - 1
+
+
+class ReadError(Exception):
+    """
+    Raised when a read request can't be answered.
+
+    Attributes:
+        message (str): Human readable reason, returned to the client as is.
+        status (int): HTTP status of the response.
+    """
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def is_paginated(request) -> bool:
+    """
+    Returns whether the request asks for a page of a list.
+    """
+    return "limit" in request.GET or "cursor" in request.GET
+
+
+def all_units(request):
+    """
+    Returns every shop unit, or a page ``{"items": [...], "next": cursor}``
+    of them ordered by id if the request is paginated.
+    """
+    if not is_paginated(request):
+        return node_cache.get_or_build(
+            node_cache.ALL_KEY,
+            None,
+            lambda: serialize_units(ShopUnit.objects.all(), complete=True),
+            get_catalog_version(request)[0],
+        )
+
+    try:
+        limit = get_page_size(request)
+        shop_units = ShopUnit.objects.order_by("id")
+        cursor = request.GET.get("cursor")
+        if cursor:
+            shop_units = shop_units.filter(id__gt=decode_cursor(cursor)[0])
+        items = serialize_units(shop_units[: limit + 1])
+    except (CursorError, ValidationError):
+        raise ReadError("Invalid pagination parameters")
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["id"])
+    return {"items": items, "next": next_cursor}
+
+
+def node(request, pk: str) -> dict:
+    """
+    Returns a shop unit with its subtree, see ``ShopUnitGetItemView``.
+    """
+    depth = request.GET.get("depth")
+    if depth is not None:
+        if not depth.isdecimal():
+            raise ReadError("depth must be a non-negative integer")
+        # imports reject deeper levels, and the database takes 64-bit ints
+        depth = min(int(depth), MAX_DEPTH)
+
+    try:
+        unit_id = uuid.UUID(pk)
+    except ValueError:
+        raise ReadError("{} is not a valid UUID".format(pk))
+
+    def build():
+        if settings.CATALOG_REPLICA:
+            with current_replica(get_catalog_version(request)[0]) as replica:
+                if replica is not None:
+                    with serialization():
+                        return replica.subtree(str(unit_id), depth)
+        return node_subtree(unit_id, depth)
+
+    subtree = node_cache.get_or_build(
+        node_cache.node_key(unit_id),
+        depth,
+        build,
+        get_catalog_version(request)[0],
+        lambda: subtree_seq(unit_id),
+    )
+    if subtree is None:
+        raise ReadError("Such item doesn't exist", status=404)
+    return subtree
+
+
+def node_subtree(unit_id, depth):
+    """
+    Serializes a shop unit with its subtree.
+
+    Args:
+        unit_id (uuid.UUID): Id of the shop unit.
+        depth (int | None): Number of nested levels.
+
+    Returns:
+        dict: The serialized subtree, ``None`` if the unit doesn't exist.
+    """
+    paths = ShopUnit.objects.filter(id=unit_id).values_list("path", flat=True)
+    path = paths.first()
+    if path is None:
+        return None
+
+    units = ShopUnit.objects.filter(subtree_filter(path)).order_by("path")
+    if depth is not None:
+        # one more level is fetched to list the children of the last one
+        max_length = len(path) + (depth + 1) * SEGMENT_LENGTH
+        units = units.alias(path_length=Length("path")).filter(
+            path_length__lte=max_length
+        )
+    with serialization():
+        return build_subtree(str(unit_id), serialize_nodes(units), depth)
+
+
+def statistics(request, pk: str):
+    """
+    Returns statistic rows of a shop unit, see ``ShopUnitStatisticsGetView``.
+    """
+    params = request.GET
+
+    try:
+        date_start = parse_date_param(params, "dateStart")
+        date_end = parse_date_param(params, "dateEnd")
+    except ValueError:
+        raise ReadError("Incorrect data format")
+    interval = params.get("interval")
+    if interval is not None and interval not in INTERVALS:
+        raise ReadError("interval must be one of: " + ", ".join(INTERVALS))
+    paginate = is_paginated(request)
+
+    try:
+        queryset = ShopUnitStatisticUnit.objects.filter(id=pk)
+        if date_start is not None:
+            queryset = queryset.filter(date__gte=date_start)
+        if date_end is not None:
+            queryset = queryset.filter(date__lt=date_end)
+        queryset = queryset.order_by("date", "statid").values(
+            *STATISTIC_FIELDS, "statid"
+        )
+
+        limit = next_cursor = None
+        if paginate:
+            limit = get_page_size(request)
+            cursor = params.get("cursor")
+            if cursor and interval:
+                (bucket,) = decode_cursor(cursor)
+                queryset = queryset.filter(date__gte=parse_datetime(bucket))
+            elif cursor:
+                date, statid = decode_cursor(cursor, size=2)
+                queryset = queryset.filter(after_row(parse_datetime(date), statid))
+
+        if interval:
+            rows = queryset.iterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+            items, next_bucket = downsample(rows, interval, limit)
+            if next_bucket is not None:
+                next_cursor = encode_cursor(next_bucket.isoformat())
+        elif paginate:
+            items = list(queryset[: limit + 1])
+            if len(items) > limit:
+                items = items[:limit]
+                last = items[-1]
+                next_cursor = encode_cursor(last["date"].isoformat(), last["statid"])
+        else:
+            items = queryset
+
+        items = serialize_statistics(items)
+        if not items:
+            # an empty window of an existing item is not an error
+            filtered = date_start or date_end or paginate
+            exists = ShopUnitStatisticUnit.objects.filter(id=pk).exists
+            if not filtered or not exists():
+                raise ReadError("Such item doesn't exist", status=404)
+
+    except ValidationError:
+        raise ReadError("{} is not a valid UUID".format(pk))
+    except (ValueError, TypeError):
+        raise ReadError("Invalid pagination parameters")
+
+    if paginate:
+        return {"items": items, "next": next_cursor}
+    return [{"items": items}]
+
+
+def parse_price_param(params, name: str):
+    """
+    Reads an optional non-negative integer price from query parameters.
+
+    A price above any stored one is clamped, the database doesn't take it.
+
+    Raises:
+        ReadError: If the price is malformed.
+    """
+    value = params.get(name)
+    if value is None:
+        return None
+    if not value.isdecimal():
+        raise ReadError("{} must be a non-negative integer".format(name))
+    return min(int(value), MAX_BIGINT)
+
+
+def search(request) -> dict:
+    """
+    Returns a page ``{"items": [...], "next": cursor}`` of shop units
+    matching the filters of the request, see ``ShopUnitSearchView``.
+
+    Units are ordered by price when a price bound is given, otherwise by
+    name when a name prefix is given, otherwise by id.
+    """
+    params = request.GET
+    price_from = parse_price_param(params, "priceFrom")
+    price_to = parse_price_param(params, "priceTo")
+    prefix = params.get("name") or None
+    unit_type = params.get("type")
+    if unit_type is not None and unit_type not in ShopUnitType.values:
+        raise ReadError("type must be one of: " + ", ".join(ShopUnitType.values))
+    parent_id = params.get("parentId")
+    if parent_id is not None:
+        try:
+            parent_id = uuid.UUID(parent_id)
+        except ValueError:
+            raise ReadError("{} is not a valid UUID".format(parent_id))
+
+    if price_from is not None or price_to is not None:
+        order = ("price", "id")
+    elif prefix is not None:
+        order = ("name", "id")
+    else:
+        order = ("id",)
+
+    try:
+        limit = get_page_size(request)
+        after = None
+        cursor = params.get("cursor")
+        if cursor:
+            after = decode_cursor(cursor, size=len(order))
+            after[-1] = uuid.UUID(str(after[-1]))
+            if order[0] == "price":
+                after[0] = int(str(after[0]))
+                if abs(after[0]) > MAX_BIGINT:
+                    raise ValueError(after[0])
+            after = tuple(after)
+    except (CursorError, ValueError):
+        raise ReadError("Invalid pagination parameters")
+
+    if settings.CATALOG_REPLICA and prefix is None:
+        with current_replica(get_catalog_version(request)[0]) as replica:
+            if replica is not None:
+                slots = replica.search(
+                    order, after, limit + 1, price_from, price_to, unit_type, parent_id
+                )
+                if slots is None:
+                    raise ReadError("Such item doesn't exist", status=404)
+                with serialization():
+                    items = replica.serialize_units(slots)
+                return search_page(items, order, limit)
+
+    if order[0] == "price" and settings.SEARCH_PRICE_INDEX and not (
+        prefix or parent_id
+    ):
+        index = get_price_index(get_catalog_version(request)[0])
+        keys = index.page(price_from, price_to, unit_type, after, limit + 1)
+        positions = {unit_id: i for i, (_, unit_id) in enumerate(keys[:limit])}
+        items = serialize_units(ShopUnit.objects.filter(id__in=list(positions)))
+        items.sort(key=lambda item: positions[item["id"]])
+        next_cursor = encode_cursor(*keys[limit - 1]) if len(keys) > limit else None
+        return {"items": items, "next": next_cursor}
+
+    units = ShopUnit.objects.all()
+    if price_from is not None:
+        units = units.filter(price__gte=price_from)
+    if price_to is not None:
+        units = units.filter(price__lte=price_to)
+    if prefix is not None:
+        units = units.filter(prefix_filter(prefix))
+    if unit_type is not None:
+        units = units.filter(type=unit_type)
+    if parent_id is not None:
+        paths = ShopUnit.objects.filter(id=parent_id)
+        path = paths.values_list("path", flat=True).first()
+        if path is None:
+            raise ReadError("Such item doesn't exist", status=404)
+        units = units.filter(subtree_filter(path)).exclude(path=path)
+    if after is not None:
+        units = units.filter(after_key(order, after))
+
+    items = serialize_units(units.order_by(*order)[: limit + 1])
+    return search_page(items, order, limit)
+
+
+def search_page(items: list, order: tuple, limit: int) -> dict:
+    """
+    Builds a page of search results from up to ``limit + 1`` units.
+    """
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(*(items[-1][field] for field in order))
+    return {"items": items, "next": next_cursor}
+
+
+def changes_params(request) -> tuple:
+    """
+    Reads the query parameters of ``/api/changes``.
+
+    ``since`` falls back to the ``Last-Event-ID`` header, which a
+    reconnecting event stream sends instead.
+
+    Returns:
+        tuple: ``(since, limit, wait)``, ``since`` and ``wait`` are ``None``
+        if omitted.
+
+    Raises:
+        ReadError: If a parameter is malformed.
+    """
+    since = request.GET.get("since", request.headers.get("Last-Event-ID"))
+    if since is not None:
+        # no sequence number is above the largest 64-bit integer
+        if not since.isdecimal() or int(since) > MAX_BIGINT:
+            raise ReadError("since must be a sequence number")
+        since = int(since)
+
+    wait = request.GET.get("wait")
+    if wait is not None:
+        try:
+            wait = float(wait)
+        except ValueError:
+            wait = -1
+        if not 0 <= wait <= settings.CHANGES_MAX_WAIT:
+            raise ReadError(
+                "wait must be between 0 and {}".format(settings.CHANGES_MAX_WAIT)
+            )
+
+    try:
+        limit = get_page_size(request)
+    except CursorError as e:
+        raise ReadError(str(e))
+    return since, limit, wait
+
+
+def changes(request) -> dict:
+    """
+    Returns the changes of the catalog after the ``since`` sequence
+    number, see ``api.changes``. Without ``since`` only the current
+    sequence number is returned.
+    """
+    since, limit, _ = changes_params(request)
+    if since is None:
+        return {"items": [], "deleted": [], "seq": latest_seq(), "more": False}
+    try:
+        return changes_since(since, limit)
+    except ChangesPruned:
+        raise ReadError(
+            "Changes since {} are no longer kept, load /api/all again".format(since),
+            status=410,
+        )
+
+
+def parse_percentiles(value):
+    """
+    Reads a comma separated list of percentiles, e.g. ``50,90,99.9``.
+
+    Raises:
+        ValueError: If a percentile is not a number between 0 and 100.
+    """
+    if value is None:
+        return DEFAULT_PERCENTILES
+    percentiles = [float(part) for part in value.split(",")]
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise ValueError("percentile out of range")
+    return percentiles
+
+
+def analytics(request, pk: str) -> dict:
+    """
+    Returns price aggregates of the offers in the subtree of a shop unit,
+    see ``ShopUnitAnalyticsView``.
+    """
+    params = request.GET
+
+    try:
+        date_start = parse_date_param(params, "dateStart")
+        date_end = parse_date_param(params, "dateEnd")
+    except ValueError:
+        raise ReadError("Incorrect data format")
+    # the timestamps are computed in Python, where naive dates can't be
+    # compared; they are in the current time zone, as the ORM takes them
+    date_start, date_end = [
+        timezone.make_aware(date) if date and timezone.is_naive(date) else date
+        for date in (date_start, date_end)
+    ]
+    interval = params.get("interval")
+    if interval is not None and interval not in INTERVALS:
+        raise ReadError("interval must be one of: " + ", ".join(INTERVALS))
+    try:
+        percentiles = parse_percentiles(params.get("percentiles"))
+    except ValueError:
+        raise ReadError("percentiles must be numbers between 0 and 100")
+
+    try:
+        unit_id = uuid.UUID(pk)
+    except ValueError:
+        raise ReadError("{} is not a valid UUID".format(pk))
+    path = ShopUnit.objects.filter(id=unit_id).values_list("path", flat=True).first()
+    if path is None:
+        raise ReadError("Such item doesn't exist", status=404)
+
+    result = price_analytics(path, date_start, date_end, interval, percentiles)
+    for item in result.get("items", ()):
+        item["date"] = format_datetime(item["date"])
+    return dict(id=str(unit_id), **result)
+
+
+def sales(request) -> list:
+    """
+    Returns the latest change of every offer changed during 24 hours
+    before the ``date`` query parameter.
+    """
+    try:
+        date_end = parse_datetime(request.GET.get("date") or "")
+        date_start = date_end - timedelta(hours=24) if date_end else None
+    except (ValueError, OverflowError):
+        # well formed, but out of range
+        date_start = None
+    if date_start is None:
+        raise ReadError("Incorrect data format")
+
+    queryset = (
+        ShopUnitStatisticUnit.objects.filter(
+            date__range=[date_start, date_end], type=ShopUnitType.OFFER
+        )
+        .latest_per_unit(date_end)
+        .order_by("date")
+        .values(*STATISTIC_FIELDS)
+    )
+    return [{"items": serialize_statistics(queryset)}]
@@ -0,0 +1,443 @@
+"""
+In-process replica of the catalog for serving reads without the database.
+
+With ``settings.CATALOG_REPLICA`` every server process keeps all shop
+units in parallel arrays indexed by a slot number: ids, names and dates
+(already serialized) in lists, types, prices and parent slots in NumPy
+arrays, and the child slots of every category. A dict maps ids to slots
+and slots of deleted units are reused. ``/api/nodes/<id>`` (on a node
+cache miss) and ``/api/search`` are answered from it, except name prefix
+searches, which the name index of the database answers faster than a
+scan of all names.
+
+The replica is loaded in a background thread when the process starts
+(see prices/wsgi.py), reads go to the database until it is ready. Like
+``search.PriceIndex`` it is tagged with the catalog version; a read seeing
+another version first applies the change log since the last applied
+sequence number (see api/changes.py), so only changed units are read.
+Imports and deletes of the process apply their changes right after
+commit.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+from .changes import ChangesPruned, changes_since, latest_seq
+from .models import CatalogVersion, ShopUnit
+from .serializers import UNIT_FIELDS, format_row
+from .signals import units_changed
+
+logger = logging.getLogger(__name__)
+
+# codes of the types array
+FREE, OFFER, CATEGORY = -1, 0, 1
+TYPE_CODES = {"OFFER": OFFER, "CATEGORY": CATEGORY}
+TYPE_NAMES = {OFFER: "OFFER", CATEGORY: "CATEGORY"}
+LOW_BITS = (1 << 64) - 1
+
+
+def id_key(unit_id) -> tuple:
+    """
+    Splits an id into two 64-bit numbers ordered like the id.
+    """
+    value = int(str(unit_id).replace("-", ""), 16)
+    return value >> 64, value & LOW_BITS
+
+
+class CatalogReplica:
+    """
+    All shop units of the catalog, see the module docstring.
+
+    Attributes:
+        version (int): Catalog version the replica was last caught up at.
+        seq (int): Sequence number of the last applied change.
+        slots (dict): Slot of every unit id.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.version = None
+        self.seq = 0
+        self.slots = {}
+        self.ids, self.names, self.dates, self.children = [], [], [], []
+        self.free = []
+        # one string per distinct date, units of an import share it
+        self.date_strings = {}
+        self.types = np.full(capacity, FREE, dtype=np.int8)
+        self.prices = np.zeros(capacity, dtype=np.int64)
+        self.priced = np.zeros(capacity, dtype=bool)
+        self.parents = np.full(capacity, -1, dtype=np.int32)
+        # the id as two numbers, for ordering in bulk
+        self.id_high = np.zeros(capacity, dtype=np.uint64)
+        self.id_low = np.zeros(capacity, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @classmethod
+    def load(cls) -> "CatalogReplica":
+        """
+        Loads every unit from the database.
+        """
+        version = CatalogVersion.current().version
+        seq = latest_seq()
+        count = ShopUnit.objects.count()
+        replica = cls(max(1024, count))
+        # parents come before their children in the path order
+        rows = (
+            ShopUnit.objects.order_by("path")
+            .values_list(*UNIT_FIELDS)
+            .iterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+        )
+        replica.add_items(format_row(dict(zip(UNIT_FIELDS, row))) for row in rows)
+        replica.version, replica.seq = version, seq
+        return replica
+
+    def add_items(self, items) -> None:
+        """
+        Stores serialized units, parents before their children.
+        """
+        for item in items:
+            self.link(self.store(item), item["parentId"])
+
+    def allocate(self, unit_id: str) -> int:
+        """
+        Returns a slot for a new unit.
+        """
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.ids)
+            self.ids.append(None)
+            self.names.append(None)
+            self.dates.append(None)
+            self.children.append(None)
+            if slot == len(self.types):
+                self.grow()
+        self.slots[unit_id] = slot
+        self.ids[slot] = unit_id
+        self.id_high[slot], self.id_low[slot] = id_key(unit_id)
+        return slot
+
+    def grow(self) -> None:
+        """
+        Doubles the capacity of the arrays.
+        """
+        size = len(self.types)
+        for name, fill in (
+            ("types", FREE),
+            ("prices", 0),
+            ("priced", False),
+            ("parents", -1),
+            ("id_high", 0),
+            ("id_low", 0),
+        ):
+            array = getattr(self, name)
+            grown = np.full(2 * size, fill, dtype=array.dtype)
+            grown[:size] = array
+            setattr(self, name, grown)
+
+    def store(self, item: dict) -> int:
+        """
+        Creates or updates a unit without linking it to its parent.
+
+        Returns:
+            int: The slot of the unit.
+        """
+        slot = self.slots.get(item["id"])
+        if slot is None:
+            slot = self.allocate(item["id"])
+        self.names[slot] = item["name"]
+        self.dates[slot] = self.date_strings.setdefault(item["date"], item["date"])
+        self.types[slot] = TYPE_CODES[item["type"]]
+        self.priced[slot] = item["price"] is not None
+        self.prices[slot] = item["price"] if item["price"] is not None else 0
+        return slot
+
+    def link(self, slot: int, parent_id) -> None:
+        """
+        Moves a unit under the parent with the given id.
+        """
+        parent = self.slots.get(parent_id, -1) if parent_id is not None else -1
+        old = self.parents[slot]
+        if old == parent:
+            return
+        if old >= 0:
+            self.children[old].remove(slot)
+        if parent >= 0:
+            if self.children[parent] is None:
+                self.children[parent] = []
+            self.children[parent].append(slot)
+        self.parents[slot] = parent
+
+    def remove(self, unit_id: str) -> None:
+        """
+        Deletes a unit, its children are deleted by their own changes.
+        """
+        slot = self.slots.pop(unit_id, None)
+        if slot is None:
+            return
+        self.link(slot, None)
+        for child in self.children[slot] or ():
+            self.parents[child] = -1
+        self.ids[slot] = self.names[slot] = self.dates[slot] = None
+        self.children[slot] = None
+        self.types[slot] = FREE
+        self.free.append(slot)
+
+    def apply(self, page: dict) -> None:
+        """
+        Applies a page of changes, see ``changes.changes_since()``.
+        """
+        for unit_id in page["deleted"]:
+            self.remove(unit_id)
+        # a parent may be created later in the same page
+        slots = [self.store(item) for item in page["items"]]
+        for slot, item in zip(slots, page["items"]):
+            self.link(slot, item["parentId"])
+
+    def catch_up(self) -> None:
+        """
+        Applies the changes after the last applied sequence number.
+
+        Raises:
+            ChangesPruned: If the changes are no longer kept.
+        """
+        version = CatalogVersion.current().version
+        while True:
+            page = changes_since(self.seq, settings.API_MAX_PAGE_SIZE)
+            self.apply(page)
+            self.seq = page["seq"]
+            if not page["more"]:
+                break
+        self.version = version
+
+    def serialize(self, slot: int) -> dict:
+        """
+        Serializes a unit like ``serializers.serialize_nodes()``.
+        """
+        parent = self.parents[slot]
+        return {
+            "id": self.ids[slot],
+            "name": self.names[slot],
+            "date": self.dates[slot],
+            "type": TYPE_NAMES[self.types[slot]],
+            "parentId": self.ids[parent] if parent >= 0 else None,
+            "price": int(self.prices[slot]) if self.priced[slot] else None,
+        }
+
+    def child_slots(self, slot: int) -> list:
+        """
+        Returns the children of a unit ordered by id, like paths order them.
+        """
+        return sorted(self.children[slot] or (), key=self.ids.__getitem__)
+
+    def serialize_units(self, slots) -> list:
+        """
+        Serializes units with the ids of their children, like
+        ``serializers.serialize_units()``.
+        """
+        items = []
+        for slot in slots:
+            data = self.serialize(slot)
+            data["children"] = [self.ids[child] for child in self.child_slots(slot)]
+            items.append(data)
+        return items
+
+    def subtree(self, unit_id: str, depth=None):
+        """
+        Serializes a unit with its subtree, see ``reads.node_subtree()``.
+
+        Returns:
+            dict: The subtree, ``None`` if there is no such unit.
+        """
+        slot = self.slots.get(unit_id)
+        if slot is None:
+            return None
+        root = self.serialize(slot)
+        stack = [(root, slot, 0)]
+        while stack:
+            data, slot, level = stack.pop()
+            children = self.child_slots(slot)
+            if depth is not None and level >= depth:
+                data["children"] = [self.ids[child] for child in children]
+                continue
+            data["children"] = nested = [self.serialize(child) for child in children]
+            stack.extend(
+                (child_data, child, level + 1)
+                for child_data, child in zip(nested, children)
+            )
+        return root
+
+    def descendants(self, slot: int) -> list:
+        """
+        Returns the slots below a unit.
+        """
+        found, stack = [], list(self.children[slot] or ())
+        while stack:
+            slot = stack.pop()
+            found.append(slot)
+            stack.extend(self.children[slot] or ())
+        return found
+
+    def search(self, order, after, limit, price_from, price_to, unit_type, parent_id):
+        """
+        Finds units like ``reads.search()`` does in the database, without
+        a name prefix.
+
+        Args:
+            order (tuple): ``("price", "id")`` or ``("id",)``.
+            after (tuple | None): Values of ``order`` in the last returned
+                unit, the id as a UUID.
+            limit (int): Maximal number of units.
+            price_from, price_to (int | None): Inclusive price bounds.
+            unit_type (str | None): ``OFFER`` or ``CATEGORY``.
+            parent_id (uuid.UUID | None): Only descendants of this unit.
+
+        Returns:
+            list: Slots of the units in order, ``None`` if the parent
+            doesn't exist.
+        """
+        size = len(self.ids)
+        mask = self.types[:size] != FREE
+        prices = self.prices[:size]
+        if price_from is not None:
+            mask &= self.priced[:size] & (prices >= price_from)
+        if price_to is not None:
+            mask &= self.priced[:size] & (prices <= price_to)
+        if unit_type is not None:
+            mask &= self.types[:size] == TYPE_CODES[unit_type]
+        if parent_id is not None:
+            parent = self.slots.get(str(parent_id))
+            if parent is None:
+                return None
+            inside = np.zeros(size, dtype=bool)
+            inside[self.descendants(parent)] = True
+            mask &= inside
+
+        keys = [self.id_high[:size], self.id_low[:size]]
+        if after is not None:
+            after = list(after[:-1]) + list(id_key(after[-1]))
+        if order[0] == "price":
+            keys.insert(0, prices)
+        return first_rows(np.flatnonzero(mask), keys, after, limit).tolist()
+
+
+def first_rows(candidates, keys: list, after, limit: int):
+    """
+    Returns the candidates with the smallest keys after a key.
+
+    Args:
+        candidates (np.ndarray): Slots to choose from.
+        keys (list): Arrays of key columns by slot, compared in order.
+        after (list | None): The key the rows have to follow.
+        limit (int): Maximal number of rows.
+
+    Returns:
+        np.ndarray: Slots ordered by the keys.
+    """
+    columns = [key[candidates] for key in keys]
+    if after is not None:
+        later = columns[-1] > after[-1]
+        for column, value in zip(reversed(columns[:-1]), reversed(after[:-1])):
+            later = (column > value) | ((column == value) & later)
+        candidates = candidates[later]
+        columns = [column[later] for column in columns]
+    if len(candidates) > limit:
+        # only rows up to the limit-th smallest first key can be returned
+        bound = np.partition(columns[0], limit - 1)[limit - 1]
+        near = columns[0] <= bound
+        candidates = candidates[near]
+        columns = [column[near] for column in columns]
+    return candidates[np.lexsort(columns[::-1])[:limit]]
+
+
+_replica = None
+_lock = threading.Lock()
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def load_replica() -> CatalogReplica:
+    """
+    Loads the replica of this process from the database.
+    """
+    global _replica
+
+    replica = CatalogReplica.load()
+    with _lock:
+        _replica = replica
+    return replica
+
+
+def load_in_background() -> None:
+    try:
+        load_replica()
+    except Exception:
+        logger.exception("Loading the catalog replica failed")
+    finally:
+        close_old_connections()
+
+
+def start_loading() -> None:
+    """
+    Loads the replica in a background thread unless it is loaded already
+    or being loaded.
+    """
+    global _loader
+
+    with _loader_lock:
+        if _replica is None and (_loader is None or not _loader.is_alive()):
+            _loader = threading.Thread(
+                target=load_in_background, name="catalog-replica", daemon=True
+            )
+            _loader.start()
+
+
+def catch_up() -> CatalogReplica:
+    """
+    Brings the replica up to date, reloading it if the change log was
+    pruned in the meantime. The caller holds the lock.
+    """
+    global _replica
+
+    try:
+        _replica.catch_up()
+    except ChangesPruned:
+        _replica = CatalogReplica.load()
+    return _replica
+
+
+@contextmanager
+def current_replica(version: int):
+    """
+    Yields the replica of this process caught up with a catalog version,
+    ``None`` while it is being loaded. Other threads wait meanwhile.
+    """
+    if _replica is None:
+        start_loading()
+        yield None
+        return
+    with _lock:
+        replica = _replica
+        if replica.version != version:
+            replica = catch_up()
+        yield replica
+
+
+@receiver(units_changed)
+def catch_up_after_commit(sender, **kwargs):
+    def run():
+        try:
+            with _lock:
+                catch_up()
+        except Exception:
+            logger.exception("Updating the catalog replica failed")
+
+    if settings.CATALOG_REPLICA and _replica is not None:
+        transaction.on_commit(run)
@@ -0,0 +1,245 @@
+"""
+Search of shop units by price range, name prefix, type and subtree.
+
+Every filter is an indexed range scan: prices use the ``(price, id)`` and
+``(type, price, id)`` indexes of ``ShopUnit``, name prefixes its ``name``
+index and subtrees the tree paths. Results are returned in pages ordered
+by the key of the range, so the next page continues the same scan.
+
+With ``settings.SEARCH_PRICE_INDEX``, pure price range searches are
+answered from ``PriceIndex``, sorted arrays of all prices kept in the
+process, and only the rows of the page are read from the database. The
+arrays are tagged with the catalog version, which every import and
+delete bumps. The first search after a change applies the change log
+since the last applied sequence number (see api/changes.py), like the
+replica of api/replica.py does, so only the changed units are read.
+"""
+
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .changes import ChangesPruned, changes_since, latest_seq
+from .models import CatalogVersion, ShopUnit
+
+# the largest code point, nothing sorts after a string ending with it
+MAX_CHAR = chr(0x10FFFF)
+# code points reserved for UTF-16 surrogates, not valid in UTF-8
+SURROGATES_START, SURROGATES_END = 0xD800, 0xE000
+
+
+def prefix_filter(prefix: str) -> Q:
+    """
+    Builds a case sensitive filter of names starting with a prefix.
+
+    SQLite's LIKE ignores case and can't use the index, so the prefix is
+    turned into a range of names there.
+    """
+    if connection.vendor != "sqlite":
+        return Q(name__startswith=prefix)
+    # the smallest string greater than all strings with the prefix
+    upper = prefix.rstrip(MAX_CHAR)
+    if not upper:
+        return Q(name__gte=prefix)
+    following = ord(upper[-1]) + 1
+    if following == SURROGATES_START:
+        # surrogates can't be encoded, nothing between sorts after the prefix
+        following = SURROGATES_END
+    upper = upper[:-1] + chr(following)
+    return Q(name__gte=prefix, name__lt=upper)
+
+
+def after_key(order: tuple, key: tuple) -> Q:
+    """
+    Builds a filter matching rows after the given key of ``order``.
+
+    Args:
+        order (tuple): Names of the ordering fields, the last one is ``id``.
+        key (tuple): Values of the fields in the last returned row.
+    """
+    *fields, _ = order
+    *values, unit_id = key
+    after = Q(id__gt=unit_id, **dict(zip(fields, values)))
+    for i in reversed(range(len(fields))):
+        earlier = dict(zip(fields[:i], values[:i]))
+        after |= Q(**{fields[i] + "__gt": values[i]}, **earlier)
+    return after
+
+
+class PriceIndex:
+    """
+    Ids of the shop units with a price, sorted by price and id.
+
+    Attributes:
+        version (int): Catalog version the index is caught up with.
+        seq (int): Sequence number of the last applied change.
+        arrays (dict): Sorted price array and the id strings in the same
+            order per unit type, ``None`` for all. Replaced as a whole, so
+            a search reads the arrays of one state.
+        keys (dict): Type and price of every indexed id.
+    """
+
+    def __init__(self, version: int, seq: int, rows: list) -> None:
+        self.version, self.seq = version, seq
+        self.keys = {str(row[2]): (row[0], row[1]) for row in rows}
+        self.arrays = {}
+        for unit_type in (None,) + tuple({row[0] for row in rows}):
+            selected = [row for row in rows if unit_type in (None, row[0])]
+            ids = np.empty(len(selected), dtype=object)
+            ids[:] = [str(row[2]) for row in selected]
+            prices = np.array([row[1] for row in selected], dtype=np.int64)
+            self.arrays[unit_type] = (prices, ids)
+
+    @classmethod
+    def build(cls, version: int) -> "PriceIndex":
+        """
+        Loads all prices from the database.
+        """
+        # changes after it may be in the rows already, applying them again
+        # doesn't change the index
+        seq = latest_seq()
+        rows = (
+            ShopUnit.objects.filter(price__isnull=False)
+            .order_by("price", "id")
+            .values_list("type", "price", "id")
+        )
+        return cls(version, seq, list(rows))
+
+    def catch_up(self, version: int) -> None:
+        """
+        Applies the changes after the last applied sequence number.
+
+        Raises:
+            ChangesPruned: If the changes are no longer kept.
+        """
+        while True:
+            page = changes_since(self.seq, settings.API_MAX_PAGE_SIZE)
+            self.apply(page)
+            self.seq = page["seq"]
+            if not page["more"]:
+                break
+        self.version = version
+
+    def apply(self, page: dict) -> None:
+        """
+        Applies a page of changes, see ``changes.changes_since()``.
+
+        Old entries of the changed units are removed and their current
+        prices inserted at their positions, so the arrays are copied once
+        per page instead of loading all prices again.
+        """
+        arrays = dict(self.arrays)
+        removed = {}
+        for unit_id in page["deleted"] + [item["id"] for item in page["items"]]:
+            key = self.keys.pop(unit_id, None)
+            if key is None:
+                continue
+            unit_type, price = key
+            for selected in (None, unit_type):
+                position = find(arrays[selected], price, unit_id, "left")
+                removed.setdefault(selected, []).append(position)
+        for selected, positions in removed.items():
+            prices, ids = arrays[selected]
+            arrays[selected] = (np.delete(prices, positions), np.delete(ids, positions))
+
+        added = {}
+        for item in page["items"]:
+            if item["price"] is None:
+                continue
+            self.keys[item["id"]] = (item["type"], item["price"])
+            for selected in (None, item["type"]):
+                added.setdefault(selected, []).append((item["price"], item["id"]))
+        for selected, entries in added.items():
+            entries.sort()
+            prices, ids = arrays.get(selected, EMPTY)
+            positions = [find((prices, ids), *entry, "left") for entry in entries]
+            new_ids = np.empty(len(entries), dtype=object)
+            new_ids[:] = [unit_id for _, unit_id in entries]
+            arrays[selected] = (
+                np.insert(prices, positions, [price for price, _ in entries]),
+                np.insert(ids, positions, new_ids),
+            )
+        self.arrays = arrays
+
+    def page(self, price_from, price_to, unit_type, after, limit: int) -> list:
+        """
+        Returns ids of units in the price range, ordered by price and id.
+
+        Args:
+            price_from (int | None): The lowest price.
+            price_to (int | None): The highest price.
+            unit_type (str | None): Only units of this type.
+            after (tuple | None): ``(price, id)`` of the last returned unit.
+            limit (int): Maximal number of ids.
+
+        Returns:
+            list: Pairs ``(price, id)``.
+        """
+        prices, ids = self.arrays.get(unit_type, EMPTY)
+
+        start, end = 0, len(prices)
+        if price_from is not None:
+            start = np.searchsorted(prices, price_from, "left")
+        if price_to is not None:
+            end = np.searchsorted(prices, price_to, "right")
+        if after is not None:
+            start = max(start, find((prices, ids), after[0], str(after[1]), "right"))
+
+        end = min(end, start + limit)
+        return list(zip(prices[start:end].tolist(), ids[start:end].tolist()))
+
+
+# arrays of a unit type without prices
+EMPTY = (np.empty(0, dtype=np.int64), np.empty(0, dtype=object))
+
+
+def find(arrays: tuple, price, unit_id: str, side: str) -> int:
+    """
+    Returns the position of a ``(price, id)`` key in sorted arrays, like
+    ``numpy.searchsorted`` does.
+    """
+    prices, ids = arrays
+    first = np.searchsorted(prices, price, "left")
+    last = np.searchsorted(prices, price, "right")
+    # ids are sorted among equal prices
+    return int(first + np.searchsorted(ids[first:last], unit_id, side))
+
+
+_price_index = None
+_price_index_lock = threading.Lock()
+
+
+def load_price_index() -> PriceIndex:
+    """
+    Loads the price index of this process from the database.
+    """
+    global _price_index
+
+    index = PriceIndex.build(CatalogVersion.current().version)
+    with _price_index_lock:
+        _price_index = index
+    return index
+
+
+def get_price_index(version: int) -> PriceIndex:
+    """
+    Returns the price index of this process, caught up with the change
+    log if the catalog changed since, or loaded again if it was pruned.
+    """
+    global _price_index
+
+    index = _price_index
+    if index is not None and index.version == version:
+        return index
+    with _price_index_lock:
+        if _price_index is None:
+            _price_index = PriceIndex.build(version)
+        elif _price_index.version != version:
+            try:
+                _price_index.catch_up(version)
+            except ChangesPruned:
+                _price_index = PriceIndex.build(version)
+        return _price_index
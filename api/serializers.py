@@ -1,11 +1,18 @@
+import json
+from itertools import islice
+
+from django.utils import timezone
 from rest_framework import serializers
-from .models import ShopUnit, ShopUnitImport, ShopUnitImportRequest, \
-    ShopUnitStatisticUnit, ShopUnitStatisticResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import timed_serialization
+from .models import ImportStatus, ShopUnit, ShopUnitImport, ShopUnitImportRequest, \
+    ShopUnitStatisticUnit
 
 class ShopUnitSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShopUnit
-        fields = ('__all__')
+        fields = ['id', 'name', 'date', 'type', 'parentId', 'price', 'children']
 
 
 class ShopUnitImportSerializer(serializers.ModelSerializer):
@@ -20,15 +27,156 @@ class ShopUnitImportRequestSerializer(serializers.ModelSerializer):
         fields = ('__all__')
 
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    # status of a queued import, see api/jobs.py
+    ahead = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShopUnitImportRequest
+        fields = ['id', 'status', 'size', 'updateDate', 'created', 'started',
+                  'finished', 'error', 'ahead']
+
+    def get_ahead(self, job) -> int:
+        # number of jobs to be applied before a queued one
+        if job.status != ImportStatus.QUEUED:
+            return 0
+        return ShopUnitImportRequest.objects.filter(
+            id__lt=job.id, status__in=[ImportStatus.QUEUED, ImportStatus.RUNNING]
+        ).count()
+
+
 class ShopUnitStatisticUnitSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShopUnitStatisticUnit
         fields = ['id', 'name', 'date', 'parentId', 'price', 'type']
 
 
-class ShopUnitStatisticResponseSerializer(serializers.ModelSerializer):
-    items = ShopUnitStatisticUnitSerializer(many=True)
-    class Meta:
-        model = ShopUnitStatisticResponse
-        fields = ['items']
+# Fast path for the read endpoints: rows are read with values_list() and
+# turned into the same dicts the serializers above produce, without
+# per-field introspection and model instances.
+
+UNIT_FIELDS = ("id", "name", "date", "type", "parentId", "price")
+STATISTIC_FIELDS = ("id", "name", "date", "parentId", "price", "type")
+
+
+def format_datetime(value, tz=None) -> str:
+    """
+    Formats a date exactly like ``serializers.DateTimeField`` does.
+
+    Args:
+        value (datetime): The date.
+        tz (tzinfo, optional): The current time zone, looked up if omitted.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(tz or timezone.get_current_timezone())
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def format_row(data: dict, tz=None) -> dict:
+    """
+    Converts a row of ``values()`` into a serialized dict in place.
+    """
+    data["id"] = str(data["id"])
+    data["date"] = format_datetime(data["date"], tz)
+    if data["parentId"] is not None:
+        data["parentId"] = str(data["parentId"])
+    return data
+
+
+@timed_serialization
+def serialize_nodes(queryset) -> list:
+    """
+    Serializes shop units without children, see ``api.tree.build_subtree``.
+    """
+    tz = timezone.get_current_timezone()
+    rows = queryset.values_list(*UNIT_FIELDS)
+    return [format_row(dict(zip(UNIT_FIELDS, row)), tz) for row in rows]
+
+
+@timed_serialization
+def serialize_units(queryset, complete: bool = False) -> list:
+    """
+    Serializes shop units with the ids of their children, see
+    ``ShopUnitSerializer``, with two queries.
+
+    Args:
+        queryset (QuerySet): Shop units to serialize.
+        complete (bool): Whether the queryset holds every unit, the links
+            to children are then read without filtering them by id.
+    """
+    nodes = serialize_nodes(queryset)
+    children = children_ids(None if complete else [node["id"] for node in nodes])
+    for node in nodes:
+        node["children"] = children.get(node["id"], [])
+    return nodes
+
+
+@timed_serialization
+def serialize_statistics(rows) -> list:
+    """
+    Serializes statistic rows, see ``ShopUnitStatisticUnitSerializer``.
+
+    Args:
+        rows (Iterable[dict]): Rows of ``values()`` with at least
+            ``STATISTIC_FIELDS``.
+    """
+    tz = timezone.get_current_timezone()
+    return [
+        format_row({field: row[field] for field in STATISTIC_FIELDS}, tz)
+        for row in rows
+    ]
+
+
+def children_ids(unit_ids) -> dict:
+    """
+    Loads ids of the children of given units with one query.
+
+    Args:
+        unit_ids (list | None): Ids of the parent units, ``None`` for all.
+
+    Returns:
+        dict: Mapping of unit id to the list of its children ids, both as
+        strings.
+    """
+    children = {}
+    links = ShopUnit.children.through.objects.all()
+    if unit_ids is not None:
+        links = links.filter(from_shopunit_id__in=unit_ids)
+    for parent_id, child_id in links.values_list("from_shopunit_id", "to_shopunit_id"):
+        children.setdefault(str(parent_id), []).append(str(child_id))
+    return children
+
+
+def ndjson_lines(queryset, chunk_size: int):
+    """
+    Serializes shop units as newline delimited JSON without loading
+    the whole queryset.
+
+    Rows are read with a server-side iterator and the children of every
+    chunk are loaded with one extra query.
+
+    Args:
+        queryset (QuerySet): Shop units to serialize.
+        chunk_size (int): Number of rows fetched at once.
 
+    Yields:
+        str: One JSON document with a trailing newline per unit.
+    """
+    tz = timezone.get_current_timezone()
+    rows = queryset.values_list(*UNIT_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = [
+            format_row(dict(zip(UNIT_FIELDS, row)), tz)
+            for row in islice(rows, chunk_size)
+        ]
+        if not chunk:
+            return
+        children = children_ids([data["id"] for data in chunk])
+        for data in chunk:
+            data["children"] = children.get(data["id"], [])
+            yield json.dumps(
+                data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")
+            ) + "\n"
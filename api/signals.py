@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent by the code which creates, updates or deletes shop units, inside
+# the writing transaction. ``ids`` holds the ids of the changed units and
+# of all their ancestors, whose subtrees changed along with them.
+# Receivers which need the committed state should use on_commit().
+units_changed = Signal()
@@ -1,6 +1,70 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from unittest import mock
 
-from .models import ShopUnit, ShopUnitType
+import numpy
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from . import async_views
+from .analytics import aggregate, load_history
+from .generator import generate_catalog, generate_history
+from .pagination import encode_cursor
+from .replica import load_replica
+from .search import PriceIndex, get_price_index, load_price_index
+from .cache import get_cache, node_key
+from .changes import record_changes
+from .models import (
+    CatalogVersion,
+    ImportStatus,
+    ShopUnit,
+    ShopUnitImport,
+    ShopUnitImportRequest,
+    ShopUnitType,
+    ShopUnitStatisticUnit,
+)
+from .serializers import (
+    STATISTIC_FIELDS,
+    ShopUnitSerializer,
+    ShopUnitStatisticUnitSerializer,
+    serialize_statistics,
+    serialize_units,
+)
+from .tree import MAX_DEPTH, MAX_PATH_LENGTH, node_path, path_ids
+
+
+CATEGORY_ID = "3fa85f64-5717-4562-b3fc-2c963f66a111"
+OTHER_CATEGORY_ID = "3fa85f64-5717-4562-b3fc-2c963f66a333"
+OFFER_ID = "3fa85f64-5717-4562-b3fc-2c963f66a222"
+OTHER_OFFER_ID = "3fa85f64-5717-4562-b3fc-2c963f66a444"
+DATE = "2022-05-20T23:12:01.000Z"
+
+
+def at_hour(hour):
+    # the date of an import on the day of DATE
+    return "2022-05-20T{:02}:00:00.000Z".format(hour)
+
+
+class ImportMixin:
+    # posts import batches, to the queue if import_url says so
+
+    import_url = '/api/imports'
+
+    def post(self, items, date=DATE):
+        return self.client.post(self.import_url,
+                                json.dumps({"items": items, "updateDate": date}),
+                                content_type='application/json')
 
 
 class GetSalesTestCase(TestCase):
@@ -22,6 +86,13 @@ class GetSalesTestCase(TestCase):
 
         self.assertEqual(response.status_code, 400)
 
+    def testOutOfRangeDate(self):
+        # well formed, but there is no 13th month or day before the first one
+        for date in ('2022-13-45T12:00:00.000Z', '0001-01-01T00:00:00.000Z'):
+            response = self.client.get('/api/sales?date=' + date)
+
+            self.assertEqual(response.status_code, 400)
+
 
 class getNodesTestCase(TestCase):
     # TESTING /nodes/{id} api
@@ -52,3 +123,1531 @@ class getNodesTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class PostImportsTestCase(ImportMixin, TestCase):
+    # TESTING /imports api
+
+    def testCreateTree(self):
+        # parent is defined later in the same batch
+        response = self.post([
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 234, "type": "OFFER"},
+            {"id": CATEGORY_ID, "name": "Category 1", "parentId": "null",
+             "type": "CATEGORY"},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        category = ShopUnit.objects.get(id=CATEGORY_ID)
+        self.assertEqual(category.parentId, None)
+        self.assertEqual([str(c.id) for c in category.children.all()], [OFFER_ID])
+        self.assertEqual(ShopUnitStatisticUnit.objects.filter(id=OFFER_ID).count(), 1)
+
+    def testUpdateMovesItem(self):
+        # updating parentId relinks the item
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 234, "type": "OFFER"},
+        ])
+        response = self.post([
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 300, "type": "OFFER"},
+        ], date="2022-05-21T23:12:01.000Z")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(ShopUnit.objects.get(id=CATEGORY_ID).children.exists())
+        self.assertEqual(ShopUnit.objects.get(id=OTHER_CATEGORY_ID).children.count(), 1)
+        self.assertEqual(ShopUnit.objects.get(id=OFFER_ID).price, 300)
+        self.assertEqual(ShopUnitStatisticUnit.objects.filter(id=OFFER_ID).count(), 2)
+
+    def testInvalidBatchWritesNothing(self):
+        # one bad item rejects the whole batch
+        response = self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 234, "type": "OFFER"},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShopUnit.objects.exists())
+        self.assertFalse(ShopUnitStatisticUnit.objects.exists())
+
+    def testChangeType(self):
+        # type of an existing item can't be changed
+        self.post([{"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"}])
+        response = self.post([{"id": CATEGORY_ID, "name": "Category 1", "type": "OFFER"}])
+
+        self.assertEqual(response.status_code, 400)
+
+    def testOfferParent(self):
+        # only categories can have children
+        response = self.post([
+            {"id": OFFER_ID, "name": "Offer 1", "price": 1, "type": "OFFER"},
+            {"id": CATEGORY_ID, "name": "Category 1", "parentId": OFFER_ID,
+             "type": "CATEGORY"},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+
+    def testInvalidPrice(self):
+        # the price of an offer is a non-negative integer
+        for price in ["abc", None, -1, 1.5, True, 2**31]:
+            response = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": price,
+                                   "type": "OFFER"}])
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"message": "Validation Failed"})
+        self.assertFalse(ShopUnit.objects.exists())
+
+    def testInvalidDate(self):
+        # a well formed date out of range
+        response = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 1,
+                               "type": "OFFER"}], date="2022-13-45T12:00:00.000Z")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TreeIndexTestCase(ImportMixin, TestCase):
+    # TESTING materialized paths of the tree
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 234, "type": "OFFER"},
+        ])
+
+    def testSubtreeAndAncestors(self):
+        # the whole subtree and the ancestor chain come from the path
+        category = ShopUnit.objects.get(id=CATEGORY_ID)
+        offer = ShopUnit.objects.get(id=OFFER_ID)
+
+        self.assertEqual({str(u.id) for u in category.get_descendants()},
+                         {CATEGORY_ID, OTHER_CATEGORY_ID, OFFER_ID})
+        self.assertEqual({str(u.id) for u in offer.get_ancestors()},
+                         {CATEGORY_ID, OTHER_CATEGORY_ID})
+
+    def testMoveSubtree(self):
+        # descendants follow a moved category
+        response = self.post([{"id": OTHER_CATEGORY_ID, "name": "Category 2",
+                               "type": "CATEGORY"}])
+
+        self.assertEqual(response.status_code, 201)
+        offer = ShopUnit.objects.get(id=OFFER_ID)
+        self.assertEqual({str(u.id) for u in offer.get_ancestors()}, {OTHER_CATEGORY_ID})
+        self.assertEqual(ShopUnit.objects.get(id=CATEGORY_ID).get_descendants().count(), 1)
+
+    def testCycle(self):
+        # a category can't be moved into its own subtree
+        response = self.post([{"id": CATEGORY_ID, "name": "Category 1",
+                               "parentId": OTHER_CATEGORY_ID, "type": "CATEGORY"}])
+
+        self.assertEqual(response.status_code, 400)
+
+    def testSaveMovesSubtree(self):
+        # a unit saved with another parent takes its subtree and prices along
+        category = ShopUnit.objects.get(id=OTHER_CATEGORY_ID)
+        category.parentId = None
+        category.save()
+
+        offer = ShopUnit.objects.get(id=OFFER_ID)
+        self.assertEqual({str(u.id) for u in offer.get_ancestors()}, {OTHER_CATEGORY_ID})
+        response = self.client.get('/api/nodes/' + CATEGORY_ID)
+        self.assertEqual(response.json()["children"], [])
+        self.assertIsNone(response.json()["price"])
+        response = self.client.get('/api/nodes/' + OTHER_CATEGORY_ID)
+        self.assertEqual(response.json()["price"], 234)
+        self.assertEqual(response.json()["children"][0]["id"], OFFER_ID)
+
+    def testSaveCycle(self):
+        # save() can't move a category into its own subtree either
+        category = ShopUnit.objects.get(id=CATEGORY_ID)
+        category.parentId = uuid.UUID(OTHER_CATEGORY_ID)
+
+        with self.assertRaises(ValueError):
+            category.save()
+        self.assertIsNone(ShopUnit.objects.get(id=CATEGORY_ID).parentId)
+
+    def testRebuildCommand(self):
+        # the management command restores paths from parentId
+        expected = dict(ShopUnit.objects.values_list("id", "path"))
+        ShopUnit.objects.update(path="")
+
+        call_command("rebuild_tree_index", stdout=io.StringIO())
+
+        self.assertEqual(dict(ShopUnit.objects.values_list("id", "path")), expected)
+
+
+class CategoryPriceTestCase(ImportMixin, TestCase):
+    # TESTING average prices of categories
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+             "price": 201, "type": "OFFER"},
+        ])
+
+    def price(self, unit_id):
+        return self.client.get('/api/nodes/' + unit_id).json()["price"]
+
+    def testAverage(self):
+        # price of a category is the floor average of offers in its subtree
+        self.assertEqual(self.price(CATEGORY_ID), 150)
+        self.assertEqual(self.price(OTHER_CATEGORY_ID), 100)
+
+    def testRepriceAndMove(self):
+        # only the old and the new ancestor chains change
+        self.post([{"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": OTHER_CATEGORY_ID,
+                    "price": 300, "type": "OFFER"}])
+
+        self.assertEqual(self.price(CATEGORY_ID), 200)
+        self.assertEqual(self.price(OTHER_CATEGORY_ID), 200)
+
+        self.post([{"id": OTHER_CATEGORY_ID, "name": "Category 2", "type": "CATEGORY"}])
+
+        self.assertEqual(self.price(CATEGORY_ID), None)
+        self.assertEqual(self.price(OTHER_CATEGORY_ID), 200)
+
+    def testDelete(self):
+        # deleted offers leave the aggregates of their ancestors
+        self.client.delete('/api/delete/' + OTHER_CATEGORY_ID)
+
+        self.assertEqual(self.price(CATEGORY_ID), 201)
+
+    def testConcurrentImports(self):
+        # another import commits while this one waits for the write lock,
+        # this one has to read the stored units only after that
+        lock, competing = CatalogVersion.lock, {}
+
+        def wait_for_lock():
+            if not competing:
+                competing["waiting"] = True
+                competing["response"] = self.post([
+                    {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+                     "price": 200, "type": "OFFER"}])
+            lock()
+
+        with mock.patch.object(CatalogVersion, "lock", side_effect=wait_for_lock):
+            self.post([{"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+                        "price": 150, "type": "OFFER"}], "2022-05-21T23:12:01.000Z")
+
+        self.assertEqual(competing["response"].status_code, 201)
+        offer = ShopUnit.objects.get(id=OFFER_ID)
+        category = ShopUnit.objects.get(id=OTHER_CATEGORY_ID)
+        self.assertEqual(offer.path, node_path(category.path, offer.id))
+        self.assertEqual((category.price_sum, category.offer_count, category.price),
+                         (150, 1, 150))
+        self.assertEqual(self.price(CATEGORY_ID), 175)
+
+
+class SubtreeTestCase(ImportMixin, TestCase):
+    # TESTING nested /nodes/{id} responses
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+        ])
+
+    def testFullSubtree(self):
+        # the whole subtree is nested
+        response = self.client.get('/api/nodes/' + CATEGORY_ID)
+
+        self.assertEqual(response.status_code, 200)
+        category = response.json()
+        self.assertEqual(category["children"][0]["id"], OTHER_CATEGORY_ID)
+        offer = category["children"][0]["children"][0]
+        self.assertEqual((offer["id"], offer["price"], offer["children"]),
+                         (OFFER_ID, 100, []))
+
+    def testDepth(self):
+        # units on the last level list ids of their children
+        response = self.client.get('/api/nodes/' + CATEGORY_ID + '?depth=1')
+
+        self.assertEqual(response.json()["children"][0]["children"], [OFFER_ID])
+
+        response = self.client.get('/api/nodes/' + CATEGORY_ID + '?depth=0')
+
+        self.assertEqual(response.json()["children"], [OTHER_CATEGORY_ID])
+
+    def testInvalidDepth(self):
+        # depth must be a number
+        response = self.client.get('/api/nodes/' + CATEGORY_ID + '?depth=x')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/nodes/' + CATEGORY_ID + '?depth=²')
+                         .status_code, 400)
+
+    def testHugeDepth(self):
+        # a depth beyond any path is the whole subtree
+        response = self.client.get('/api/nodes/' + CATEGORY_ID + '?depth=' + '9' * 30)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), self.client.get('/api/nodes/' + CATEGORY_ID).json())
+
+    def testDeepestChain(self):
+        # the clamped depth still reaches the deepest level imports allow
+        ids = [str(uuid.UUID(int=i)) for i in range(1, MAX_DEPTH + 1)]
+        self.post([{"id": unit_id, "name": "Category", "parentId": parent_id,
+                    "type": "CATEGORY"} for unit_id, parent_id in zip(ids, [None] + ids)])
+
+        response = self.client.get('/api/nodes/{}?depth=100'.format(ids[0]))
+
+        self.assertEqual(response.json(), self.client.get('/api/nodes/' + ids[0]).json())
+
+    def testQueryCount(self):
+        # the subtree is fetched at once, after the catalog version and the
+        # last change of the subtree
+        with self.assertNumQueries(4):
+            self.client.get('/api/nodes/' + CATEGORY_ID)
+
+
+class GetAllTestCase(ImportMixin, TestCase):
+    # TESTING /all api
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+             "price": 200, "type": "OFFER"},
+        ])
+
+    def testList(self):
+        # without parameters every unit is returned in one list
+        response = self.client.get('/api/all')
+
+        self.assertEqual(len(response.json()), 3)
+
+    def testPages(self):
+        # cursors walk through every unit once
+        ids = []
+        response = self.client.get('/api/all?limit=2').json()
+        ids += [unit["id"] for unit in response["items"]]
+        response = self.client.get('/api/all?limit=2&cursor=' + response["next"]).json()
+        ids += [unit["id"] for unit in response["items"]]
+
+        self.assertEqual(ids, sorted([CATEGORY_ID, OFFER_ID, OTHER_OFFER_ID]))
+        self.assertIsNone(response["next"])
+
+    def testInvalidPagination(self):
+        # limit and cursor are validated
+        self.assertEqual(self.client.get('/api/all?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/all?cursor=abc').status_code, 400)
+
+    def testStream(self):
+        # stream=1 returns a unit per line
+        response = self.client.get('/api/all?stream=1')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        units = {unit["id"]: unit for unit in map(json.loads, lines)}
+        self.assertEqual(sorted(units[CATEGORY_ID]["children"]),
+                         sorted([OFFER_ID, OTHER_OFFER_ID]))
+
+
+class StatisticsTestCase(ImportMixin, TestCase):
+    # TESTING /node/{id}/statistic and /sales apis
+
+    def setUp(self):
+        for date, price in (("2022-05-20T12:00:00.000Z", 100),
+                            ("2022-05-21T12:00:00.000Z", 200)):
+            self.post([
+                {"id": OFFER_ID, "name": "Offer 1", "price": price, "type": "OFFER"},
+            ], date)
+
+    def testHistory(self):
+        # every import of the item is listed
+        response = self.client.get('/api/node/' + OFFER_ID + '/statistic')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["price"] for item in response.json()[0]["items"]],
+                         [100, 200])
+
+    def testUnknownItem(self):
+        # item without statistics
+        response = self.client.get('/api/node/' + CATEGORY_ID + '/statistic')
+
+        self.assertEqual(response.status_code, 404)
+
+    def testSales(self):
+        # only changes during 24 hours before the date are returned
+        response = self.client.get('/api/sales?date=2022-05-21T13:00:00.000Z')
+
+        self.assertEqual([item["price"] for item in response.json()[0]["items"]], [200])
+
+    def testSalesLatestChange(self):
+        # an offer changed twice in the window is listed once
+        response = self.client.get('/api/sales?date=2022-05-21T12:00:00.000Z')
+
+        self.assertEqual([item["price"] for item in response.json()[0]["items"]], [200])
+
+    def testReadsDontWrite(self):
+        # reading statistics only selects
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/node/' + OFFER_ID + '/statistic')
+            self.client.get('/api/sales?date=2022-05-21T13:00:00.000Z')
+
+        self.assertTrue(all(q["sql"].startswith("SELECT") for q in queries))
+
+
+class StatisticsWindowTestCase(ImportMixin, TestCase):
+    # TESTING /node/{id}/statistic parameters
+
+    def setUp(self):
+        for date, price in (("2022-05-20T10:00:00.000Z", 100),
+                            ("2022-05-20T10:30:00.000Z", 150),
+                            ("2022-05-20T12:00:00.000Z", 200),
+                            ("2022-05-21T12:00:00.000Z", 300)):
+            self.post([
+                {"id": OFFER_ID, "name": "Offer 1", "price": price, "type": "OFFER"},
+            ], date)
+
+    def prices(self, query):
+        response = self.client.get('/api/node/' + OFFER_ID + '/statistic?' + query)
+        data = response.json()
+        items = data["items"] if isinstance(data, dict) else data[0]["items"]
+        return [item["price"] for item in items], data
+
+    def testDateRange(self):
+        # dateStart is inclusive, dateEnd is exclusive
+        prices, _ = self.prices('dateStart=2022-05-20T10:30:00.000Z'
+                                '&dateEnd=2022-05-21T12:00:00.000Z')
+
+        self.assertEqual(prices, [150, 200])
+
+    def testEmptyRange(self):
+        # existing item without changes in the range
+        prices, _ = self.prices('dateStart=2023-01-01T00:00:00.000Z')
+
+        self.assertEqual(prices, [])
+
+    def testDownsampling(self):
+        # the last value of every interval is kept
+        self.assertEqual(self.prices('interval=hour')[0], [150, 200, 300])
+        self.assertEqual(self.prices('interval=day')[0], [200, 300])
+
+    def testPages(self):
+        # cursors walk through the history with and without downsampling
+        for query, expected in (('limit=3', [100, 150, 200, 300]),
+                                ('limit=2&interval=hour', [150, 200, 300])):
+            prices, data = self.prices(query)
+            while data["next"]:
+                page, data = self.prices(query + '&cursor=' + data["next"])
+                prices += page
+
+            self.assertEqual(prices, expected)
+
+    def testInvalidParameters(self):
+        # malformed parameters are rejected
+        for query in ('dateStart=yesterday', 'interval=week', 'cursor=abc', 'limit=-1'):
+            response = self.client.get('/api/node/' + OFFER_ID + '/statistic?' + query)
+
+            self.assertEqual(response.status_code, 400)
+
+
+class DeleteTestCase(ImportMixin, TestCase):
+    # TESTING /delete/{id} api
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+             "price": 200, "type": "OFFER"},
+        ])
+
+    def testDeleteSubtree(self):
+        # the item, its descendants, links and statistics are removed
+        response = self.client.delete('/api/delete/' + OTHER_CATEGORY_ID)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(map(str, ShopUnit.objects.values_list("id", flat=True))),
+                         {CATEGORY_ID, OTHER_OFFER_ID})
+        self.assertEqual(ShopUnit.children.through.objects.count(), 1)
+        self.assertEqual(set(map(str, ShopUnitStatisticUnit.objects.values_list(
+            "id", flat=True))), {CATEGORY_ID, OTHER_OFFER_ID})
+        self.assertEqual(ShopUnit.objects.get(id=CATEGORY_ID).price, 200)
+
+    def testDeleteUnexistingItem(self):
+        # item with such id doesnt exist
+        response = self.client.delete('/api/delete/' + OTHER_OFFER_ID[:-1] + '0')
+
+        self.assertEqual(response.status_code, 404)
+
+    def testQueryCount(self):
+        # the number of queries doesn't depend on the size of the subtree,
+        # including the write lock and the entries of the change log
+        with CaptureQueriesContext(connection) as queries:
+            self.client.delete('/api/delete/' + CATEGORY_ID)
+
+        self.assertFalse(ShopUnit.objects.exists())
+        self.assertLessEqual(len(queries), 11)
+
+
+class NodeCacheTestCase(ImportMixin, TestCase):
+    # TESTING the node cache
+
+    def setUp(self):
+        get_cache().clear()
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+        ])
+
+    def testHit(self):
+        # a repeated read only reads the catalog version
+        self.client.get('/api/nodes/' + CATEGORY_ID)
+        hits = self.client.get('/api/cache').json()["hits"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/nodes/' + CATEGORY_ID)
+
+        self.assertEqual(response.json()["price"], 100)
+        self.assertEqual(self.client.get('/api/cache').json()["hits"], hits + 1)
+
+    def testImportEvictsAncestors(self):
+        # a changed offer evicts its own and its ancestors' payloads only
+        for unit_id in (CATEGORY_ID, OTHER_CATEGORY_ID, OFFER_ID):
+            self.client.get('/api/nodes/' + unit_id)
+
+        self.post([{"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+                    "price": 300, "type": "OFFER"}])
+
+        self.assertIsNone(get_cache().get(node_key(CATEGORY_ID)))
+        self.assertIsNone(get_cache().get(node_key(OFFER_ID)))
+        self.assertIsNotNone(get_cache().get(node_key(OTHER_CATEGORY_ID)))
+        self.assertEqual(self.client.get('/api/nodes/' + CATEGORY_ID).json()["price"], 300)
+
+        # the subtree of the other category is checked once and kept
+        hits = self.client.get('/api/cache').json()["hits"]
+        with self.assertNumQueries(2):
+            self.client.get('/api/nodes/' + OTHER_CATEGORY_ID)
+        with self.assertNumQueries(1):
+            self.client.get('/api/nodes/' + OTHER_CATEGORY_ID)
+        self.assertEqual(self.client.get('/api/cache').json()["hits"], hits + 2)
+
+    def testChangedByOtherProcess(self):
+        # a change made by another process, which evicted nothing here, is
+        # found in the database by the catalog version and the change log
+        self.client.get('/api/nodes/' + OFFER_ID)
+        self.client.get('/api/all')
+
+        offer = ShopUnit.objects.get(id=OFFER_ID)
+        ShopUnit.objects.filter(id=OFFER_ID).update(price=200)
+        CatalogVersion.bump()
+        record_changes(path_ids(offer.path))
+
+        self.assertEqual(self.client.get('/api/nodes/' + OFFER_ID).json()["price"], 200)
+        prices = {unit["id"]: unit["price"] for unit in self.client.get('/api/all').json()}
+        self.assertEqual(prices[OFFER_ID], 200)
+
+    def testDeleteEvictsSubtree(self):
+        # deleted units are not served from the cache
+        self.client.get('/api/nodes/' + OFFER_ID)
+        self.client.get('/api/all')
+
+        self.client.delete('/api/delete/' + CATEGORY_ID)
+
+        self.assertEqual(self.client.get('/api/nodes/' + OFFER_ID).status_code, 404)
+        self.assertEqual(len(self.client.get('/api/all').json()), 1)
+
+
+class ConditionalGetTestCase(ImportMixin, TestCase):
+    # TESTING ETag and Last-Modified of read endpoints
+
+    def setUp(self):
+        get_cache().clear()
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+        ], "2022-05-20T23:12:01.000Z")
+
+    def testNotModified(self):
+        # a matching ETag is answered with 304 after reading the version only
+        etag = self.client.get('/api/nodes/' + CATEGORY_ID)["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/nodes/' + CATEGORY_ID,
+                                       HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def testImportChangesETag(self):
+        # any import makes the old ETag stale
+        etag = self.client.get('/api/all')["ETag"]
+
+        self.post([{"id": OTHER_OFFER_ID, "name": "Offer 2", "type": "OFFER",
+                    "price": 50}], "2022-05-21T23:12:01.000Z")
+        response = self.client.get('/api/all', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def testDeleteChangesETag(self):
+        # a delete makes the old ETag stale as well
+        etag = self.client.get('/api/nodes/' + CATEGORY_ID)["ETag"]
+
+        self.client.delete('/api/delete/' + OFFER_ID)
+        response = self.client.get('/api/nodes/' + CATEGORY_ID,
+                                   HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["children"], [])
+
+    def testLastModified(self):
+        # a node is modified by every change of the catalog, deletes of its
+        # children included
+        CatalogVersion.objects.update(updated=datetime(2022, 5, 21, tzinfo=timezone.utc))
+        response = self.client.get('/api/nodes/' + CATEGORY_ID)
+        self.assertEqual(response["Last-Modified"], "Sat, 21 May 2022 00:00:00 GMT")
+
+        response = self.client.get('/api/nodes/' + CATEGORY_ID,
+                                   HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        self.client.delete('/api/delete/' + OFFER_ID)
+
+        response = self.client.get('/api/nodes/' + CATEGORY_ID,
+                                   HTTP_IF_MODIFIED_SINCE="Sat, 21 May 2022 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["price"], response.json()["children"]),
+                         (None, []))
+
+
+class FastSerializationTestCase(ImportMixin, TestCase):
+    # TESTING the values() based serialization against DRF serializers
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Категория", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+             "price": 0, "type": "OFFER"},
+        ], "2022-05-20T23:12:01.123456+03:00")
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def testUnits(self):
+        # units with children render to the same bytes
+        units = ShopUnit.objects.all()
+        self.assertEqual(
+            self.render(serialize_units(units, complete=True)),
+            self.render(ShopUnitSerializer(units.prefetch_related("children"),
+                                           many=True).data))
+
+    def testStatistics(self):
+        # statistic rows render to the same bytes
+        rows = ShopUnitStatisticUnit.objects.order_by("date", "statid")
+        self.assertEqual(
+            self.render(serialize_statistics(rows.values(*STATISTIC_FIELDS))),
+            self.render(ShopUnitStatisticUnitSerializer(rows, many=True).data))
+
+
+class AsyncReadsTestCase(ImportMixin, TestCase):
+    # TESTING async versions of the read endpoints
+
+    def setUp(self):
+        get_cache().clear()
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+        ])
+        self.factory = AsyncRequestFactory()
+
+    async def testSameResponses(self):
+        # async views answer with the same status and bytes as DRF views
+        cases = [
+            ('/api/all', async_views.all_units, {}),
+            ('/api/all?limit=1', async_views.all_units, {}),
+            ('/api/nodes/' + OFFER_ID, async_views.node, {"pk": OFFER_ID}),
+            ('/api/nodes/x', async_views.node, {"pk": "x"}),
+            ('/api/node/' + OFFER_ID + '/statistic', async_views.statistics,
+             {"pk": OFFER_ID}),
+            ('/api/sales?date=2022-05-21T00:00:00.000Z', async_views.sales, {}),
+            ('/api/sales', async_views.sales, {}),
+            ('/api/changes?since=0', async_views.changes, {}),
+            ('/api/changes?since=x', async_views.changes, {}),
+        ]
+        for url, view, kwargs in cases:
+            expected = await sync_to_async(self.client.get)(url)
+            response = await view(self.factory.get(url), **kwargs)
+
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+
+    async def testNotModified(self):
+        # conditional requests are answered before the view runs
+        response = await async_views.node(
+            self.factory.get('/api/nodes/' + CATEGORY_ID), pk=CATEGORY_ID)
+        # extra arguments of AsyncRequestFactory are raw header names
+        request = self.factory.get('/api/nodes/' + CATEGORY_ID,
+                                   **{"if-none-match": response["ETag"]})
+
+        response = await async_views.node(request, pk=CATEGORY_ID)
+
+        self.assertEqual(response.status_code, 304)
+
+    async def testNoStream(self):
+        # the whole catalog isn't collected in memory to stream it
+        response = await async_views.all_units(self.factory.get('/api/all?stream=1'))
+
+        self.assertEqual(response.status_code, 400)
+
+    async def testReadOnly(self):
+        # only GET and HEAD are allowed
+        response = await async_views.sales(self.factory.post('/api/sales'))
+
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(IMPORT_WORKER_THREAD=False)
+class ImportJobTestCase(ImportMixin, TestCase):
+    # TESTING queued imports
+
+    import_url = '/api/imports?async=1'
+
+    def run_worker(self):
+        call_command('run_import_worker', '--once', stdout=io.StringIO())
+
+    def testQueued(self):
+        # the batch is applied by the worker, not by the request
+        response = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 100,
+                               "type": "OFFER"}])
+
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job["status"], job["size"]), ("QUEUED", 1))
+        self.assertFalse(ShopUnit.objects.exists())
+
+        self.run_worker()
+
+        job = self.client.get('/api/imports/{}'.format(job["id"])).json()
+        self.assertEqual((job["status"], job["error"]), ("DONE", ""))
+        self.assertEqual(ShopUnit.objects.get(id=OFFER_ID).price, 100)
+        self.assertFalse(ShopUnitImport.objects.exists())
+
+    def testOrder(self):
+        # jobs are applied in the order they were queued
+        first = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 100,
+                            "type": "OFFER"}]).json()
+        second = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 200,
+                             "type": "OFFER"}], "2022-05-21T23:12:01.000Z").json()
+        self.assertEqual(self.client.get('/api/imports/{}'.format(second["id"])).json()["ahead"], 1)
+
+        self.run_worker()
+
+        self.assertEqual(ShopUnit.objects.get(id=OFFER_ID).price, 200)
+        self.assertEqual(self.client.get('/api/imports/{}'.format(first["id"])).json()["status"], "DONE")
+
+    def testFailed(self):
+        # a rejected job records the reason and doesn't stop the queue
+        failed = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 100,
+                             "parentId": CATEGORY_ID, "type": "OFFER"}]).json()
+        self.post([{"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"}])
+
+        self.run_worker()
+
+        job = self.client.get('/api/imports/{}'.format(failed["id"])).json()
+        self.assertEqual((job["status"], job["error"]), ("FAILED", "Parent does not exist"))
+        self.assertEqual(list(ShopUnit.objects.values_list("name", flat=True)), ["Category 1"])
+
+    def testMalformed(self):
+        # malformed batches are rejected right away
+        response = self.post([{"id": OFFER_ID, "type": "OFFER"}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post([], "yesterday").status_code, 400)
+        self.assertEqual(self.post([], "2022-13-45T12:00:00.000Z").status_code, 400)
+
+    @override_settings(IMPORT_JOB_TIMEOUT=60)
+    def testAbandoned(self):
+        # a job running for too long fails instead of running twice, and the
+        # queue goes on
+        stale = self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 100,
+                            "type": "OFFER"}]).json()
+        ShopUnitImportRequest.objects.filter(id=stale["id"]).update(
+            status=ImportStatus.RUNNING, started=datetime(2022, 5, 20, tzinfo=timezone.utc)
+        )
+        self.post([{"id": OTHER_OFFER_ID, "name": "Offer 2", "price": 200,
+                    "type": "OFFER"}])
+
+        self.run_worker()
+
+        job = self.client.get('/api/imports/{}'.format(stale["id"])).json()
+        self.assertEqual((job["status"], job["error"]),
+                         ("FAILED", "Abandoned after 60 seconds"))
+        self.assertEqual(list(ShopUnit.objects.values_list("name", flat=True)), ["Offer 2"])
+
+    def testUnknownJob(self):
+        # status of a job that doesn't exist
+        self.assertEqual(self.client.get('/api/imports/1').status_code, 404)
+        self.assertEqual(self.client.get('/api/imports/' + '9' * 23).status_code, 404)
+
+
+class StreamImportTestCase(TestCase):
+    # TESTING /imports/stream api
+
+    def post(self, lines, date=DATE):
+        body = "\n".join(json.dumps(line) for line in lines)
+        return self.client.post('/api/imports/stream?updateDate=' + date, body,
+                                content_type='application/x-ndjson')
+
+    @override_settings(IMPORT_STREAM_CHUNK_SIZE=2)
+    def testChunks(self):
+        # items are applied in chunks, a parent comes before its children
+        response = self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": OTHER_CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+             "price": 200, "type": "OFFER"},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"applied": 4})
+        self.assertEqual(self.client.get('/api/nodes/' + CATEGORY_ID).json()["price"], 150)
+
+    @override_settings(IMPORT_STREAM_CHUNK_SIZE=2)
+    def testRejectedChunk(self):
+        # chunks before a rejected one stay imported
+        response = self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": OFFER_ID,
+             "price": 200, "type": "OFFER"},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"message": "Parent must be a category",
+                                           "applied": 2})
+        self.assertEqual(ShopUnit.objects.count(), 2)
+
+    def testInvalidInput(self):
+        # broken lines and dates are rejected
+        response = self.client.post('/api/imports/stream?updateDate=2022-05-20T23:12:01.000Z',
+                                    '{"id": 1}\n{', content_type='application/x-ndjson')
+        self.assertEqual(response.json()["message"], "Line 2 is not valid JSON")
+
+        response = self.post([{"name": "Offer 1", "type": "OFFER"}], "yesterday")
+        self.assertEqual(response.status_code, 400)
+        response = self.post([{"name": "Offer 1", "type": "OFFER"}],
+                             "2022-13-45T12:00:00.000Z")
+        self.assertEqual(response.json(), {"message": "Incorrect data format",
+                                           "applied": 0})
+        self.assertFalse(ShopUnit.objects.exists())
+
+
+class ImportValidationTestCase(ImportMixin, TestCase):
+    # TESTING validation of whole import batches
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+        ])
+
+    def assertRejected(self, items, message):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(items)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], message)
+        # besides taking the write lock (a no-op UPDATE) and rolling it back
+        writes = [query["sql"] for query in queries.captured_queries
+                  if not query["sql"].startswith(("SELECT", "SAVEPOINT", "ROLLBACK",
+                                                  "RELEASE"))
+                  and "api_catalogversion" not in query["sql"]]
+        self.assertEqual(writes, [])
+
+    def testChildrenFirst(self):
+        # a chain listed from the bottom up is ordered by the importer
+        ids = ["3fa85f64-5717-4562-b3fc-2c963f66a{}".format(i) for i in range(300, 305)]
+        items = [{"id": ids[i], "name": "Category", "parentId": ids[i + 1],
+                  "type": "CATEGORY"} for i in range(4)]
+        items.append({"id": ids[4], "name": "Category", "parentId": CATEGORY_ID,
+                      "type": "CATEGORY"})
+
+        self.assertEqual(self.post(items).status_code, 201)
+        self.assertEqual(ShopUnit.objects.get(id=ids[0]).get_ancestors().count(), 5)
+
+    def testDuplicateId(self):
+        # an id may occur only once in a batch
+        self.assertRejected([
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "price": 1, "type": "OFFER"},
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "price": 2, "type": "OFFER"},
+        ], "Duplicate id " + OTHER_OFFER_ID)
+
+    def testCycle(self):
+        # categories of a batch can't be each other's ancestors
+        self.assertRejected([
+            {"id": CATEGORY_ID, "name": "Category 1", "parentId": OTHER_CATEGORY_ID,
+             "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Category 2", "parentId": CATEGORY_ID,
+             "type": "CATEGORY"},
+        ], "Cycle in parents")
+
+    def testDepth(self):
+        # a path must fit into ShopUnit.path, moved subtrees included
+        ids = [str(uuid.UUID(int=i)) for i in range(1, MAX_DEPTH + 2)]
+        chain = [{"id": unit_id, "name": "Category", "parentId": parent_id,
+                  "type": "CATEGORY"}
+                 for unit_id, parent_id in zip(ids, [None] + ids)]
+
+        self.assertRejected(chain, "Tree is deeper than {} levels".format(MAX_DEPTH))
+        self.assertEqual(self.post(chain[:-2]).status_code, 201)
+        self.assertRejected([{"id": CATEGORY_ID, "name": "Category 1",
+                              "parentId": ids[-3], "type": "CATEGORY"}],
+                            "Tree is deeper than {} levels".format(MAX_DEPTH))
+        self.assertEqual(self.post([{"id": CATEGORY_ID, "name": "Category 1",
+                                     "parentId": ids[-4], "type": "CATEGORY"}]).status_code,
+                         201)
+        self.assertEqual(len(ShopUnit.objects.get(id=OFFER_ID).path), MAX_PATH_LENGTH - 1)
+
+    def testTypes(self):
+        # types are checked against the batch and the stored units
+        self.assertRejected([
+            {"id": OFFER_ID, "name": "Offer 1", "type": "CATEGORY"},
+        ], "Forbidden to change type")
+        self.assertRejected([
+            {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": OFFER_ID,
+             "price": 1, "type": "OFFER"},
+        ], "Parent must be a category")
+
+
+class StatisticsRetentionTestCase(ImportMixin, TestCase):
+    # TESTING change-only statistics and compact_statistics
+
+    def setUp(self):
+        for date, price in (("2022-05-20T10:00:00.000Z", 100),
+                            ("2022-05-20T12:00:00.000Z", 100),
+                            ("2022-05-20T14:00:00.000Z", 150),
+                            ("2022-05-20T16:00:00.000Z", 200),
+                            ("2022-05-21T12:00:00.000Z", 300)):
+            self.post([
+                {"id": OFFER_ID, "name": "Offer 1", "price": price, "type": "OFFER"},
+            ], date)
+
+    def prices(self):
+        rows = ShopUnitStatisticUnit.objects.filter(id=OFFER_ID).order_by("date")
+        return list(rows.values_list("price", flat=True))
+
+    def testChangesOnly(self):
+        # an unchanged re-import writes no row, a renamed unit does
+        self.assertEqual(self.prices(), [100, 150, 200, 300])
+
+        self.post([{"id": OFFER_ID, "name": "Offer 2", "price": 300, "type": "OFFER"}],
+                  "2022-05-22T12:00:00.000Z")
+
+        self.assertEqual(self.prices(), [100, 150, 200, 300, 300])
+
+    @override_settings(STATISTICS_CHANGES_ONLY=False)
+    def testEveryImport(self):
+        # every import is recorded when the setting is off
+        self.post([{"id": OFFER_ID, "name": "Offer 1", "price": 300, "type": "OFFER"}],
+                  "2022-05-22T12:00:00.000Z")
+
+        self.assertEqual(self.prices(), [100, 150, 200, 300, 300])
+
+    def testCompact(self):
+        # old rows keep the last value of every day, the removed ones are archived
+        with tempfile.TemporaryDirectory() as directory:
+            archive = os.path.join(directory, "archive.ndjson")
+            call_command('compact_statistics', '--interval', 'day', '--archive',
+                         archive, '--batch-size', '1', stdout=io.StringIO())
+
+            with open(archive) as f:
+                archived = [json.loads(line)["price"] for line in f]
+
+        self.assertEqual(self.prices(), [200, 300])
+        self.assertEqual(archived, [100, 150])
+
+    def testCompactHorizon(self):
+        # rows newer than the horizon are left alone
+        call_command('compact_statistics', '--days', '100000', stdout=io.StringIO())
+
+        self.assertEqual(self.prices(), [100, 150, 200, 300])
+
+    def testInvalidInterval(self):
+        # the interval must be a supported one
+        with self.assertRaises(CommandError):
+            call_command('compact_statistics', '--interval', 'week')
+
+
+class AnalyticsTestCase(ImportMixin, TestCase):
+    # TESTING /node/{id}/analytics api
+
+    def setUp(self):
+        for date, items in (
+            ("2022-05-20T10:00:00.000Z", [
+                {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+                {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+                 "price": 100, "type": "OFFER"},
+                {"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+                 "price": 300, "type": "OFFER"},
+            ]),
+            ("2022-05-20T12:00:00.000Z", [
+                {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+                 "price": 200, "type": "OFFER"},
+            ]),
+            ("2022-05-21T12:00:00.000Z", [
+                {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+                 "price": 400, "type": "OFFER"},
+                {"id": OTHER_OFFER_ID, "name": "Offer 2b", "parentId": CATEGORY_ID,
+                 "price": 300, "type": "OFFER"},
+            ]),
+        ):
+            self.post(items, date)
+
+    def get(self, pk, query=''):
+        return self.client.get('/api/node/' + pk + '/analytics?' + query)
+
+    def testSummary(self):
+        # every recorded price of the offers below the category is aggregated
+        data = self.get(CATEGORY_ID).json()
+
+        self.assertEqual(data, {
+            "id": CATEGORY_ID, "count": 5, "offers": 2, "changes": 2, "min": 100,
+            "max": 400, "mean": 260.0, "p50": 300.0, "p90": 360.0, "p99": 396.0,
+        })
+
+    def testIntervals(self):
+        # changes are counted against the history before the window
+        data = self.get(CATEGORY_ID, 'interval=day&percentiles=50'
+                                     '&dateStart=2022-05-20T11:00:00.000Z').json()
+
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(data["items"], [
+            {"date": "2022-05-20T00:00:00Z", "count": 1, "offers": 1, "changes": 1,
+             "min": 200, "max": 200, "mean": 200.0, "p50": 200.0},
+            {"date": "2022-05-21T00:00:00Z", "count": 2, "offers": 2, "changes": 1,
+             "min": 300, "max": 400, "mean": 350.0, "p50": 350.0},
+        ])
+
+    def testHistoryBeforeWindow(self):
+        # of the rows before the window only the last one of every offer is
+        # loaded
+        path = ShopUnit.objects.get(id=CATEGORY_ID).path
+        offers, times, prices = load_history(
+            path, date_start=datetime(2022, 5, 21, tzinfo=timezone.utc))
+
+        self.assertEqual(sorted(prices.tolist()), [200, 300, 300, 400])
+        self.assertEqual(len(set(offers.tolist())), 2)
+
+    def testNaiveDates(self):
+        # dates without a time zone are in the current one, UTC
+        data = self.get(CATEGORY_ID, 'dateStart=2022-05-20T11:00:00'
+                                     '&dateEnd=2022-05-21T00:00:00').json()
+
+        self.assertEqual((data["count"], data["min"]), (1, 200))
+
+    def testEmptyWindow(self):
+        # an offer without rows in the window has no prices
+        data = self.get(OFFER_ID, 'dateEnd=2022-05-01T00:00:00.000Z').json()
+
+        self.assertEqual((data["count"], data["mean"], data["p50"]), (0, None, None))
+
+    def testPercentiles(self):
+        # grouped percentiles match numpy.percentile
+        rnd = numpy.random.default_rng(0)
+        groups = rnd.integers(0, 20, 1000)
+        prices = rnd.integers(1, 10000, 1000)
+        offers = numpy.arange(1000)
+
+        result = aggregate(groups, offers, prices, offers < 0, (10, 50, 99.9))
+
+        for i, group in enumerate(result["group"]):
+            expected = numpy.percentile(prices[groups == group], [10, 50, 99.9])
+            self.assertTrue(numpy.allclose(
+                [result["p10"][i], result["p50"][i], result["p99.9"][i]], expected))
+
+    def testInvalidParameters(self):
+        # malformed parameters and unknown items are rejected
+        for pk, query in ((CATEGORY_ID, 'interval=week'), (CATEGORY_ID, 'percentiles=101'),
+                          (CATEGORY_ID, 'percentiles=a'), ('abc', '')):
+            self.assertEqual(self.get(pk, query).status_code, 400)
+        self.assertEqual(self.get(OTHER_CATEGORY_ID).status_code, 404)
+
+
+class SearchTestCase(ImportMixin, TestCase):
+    # TESTING /search api
+
+    def setUp(self):
+        self.offers = {
+            "3fa85f64-5717-4562-b3fc-2c963f66a501": ("Apple", 100),
+            "3fa85f64-5717-4562-b3fc-2c963f66a502": ("apple juice", 200),
+            "3fa85f64-5717-4562-b3fc-2c963f66a503": ("Apricot", 200),
+            "3fa85f64-5717-4562-b3fc-2c963f66a504": ("Banana", 200),
+            "3fa85f64-5717-4562-b3fc-2c963f66a505": ("Cherry", 300),
+        }
+        items = [
+            {"id": CATEGORY_ID, "name": "Fruits", "type": "CATEGORY"},
+            {"id": OTHER_CATEGORY_ID, "name": "Other", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Apple pie", "parentId": OTHER_CATEGORY_ID,
+             "price": 500, "type": "OFFER"},
+        ] + [
+            {"id": unit_id, "name": name, "parentId": CATEGORY_ID, "price": price,
+             "type": "OFFER"}
+            for unit_id, (name, price) in self.offers.items()
+        ]
+        self.post(items)
+        load_price_index()
+
+    def search(self, query):
+        # all pages of a search
+        names, cursor = [], ''
+        while True:
+            response = self.client.get('/api/search?limit=2&' + query + cursor)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            names += [item["name"] for item in data["items"]]
+            if data["next"] is None:
+                return names
+            cursor = '&cursor=' + data["next"]
+
+    def testPriceRange(self):
+        # units in the range are ordered by price and id
+        for enabled in (False, True):
+            with self.settings(SEARCH_PRICE_INDEX=enabled):
+                self.assertEqual(self.search('priceFrom=150&priceTo=300'),
+                                 ["Fruits", "apple juice", "Apricot", "Banana", "Cherry"])
+                self.assertEqual(self.search('priceFrom=300&type=OFFER'),
+                                 ["Cherry", "Apple pie"])
+                self.assertEqual(self.search('priceTo=200&type=CATEGORY'), ["Fruits"])
+
+    def testNamePrefix(self):
+        # name prefixes are case sensitive
+        self.assertEqual(self.search('name=Ap'), ["Apple", "Apple pie", "Apricot"])
+        self.assertEqual(self.search('name=Apple&parentId=' + CATEGORY_ID), ["Apple"])
+
+    def testPrefixBeforeSurrogates(self):
+        # the range of a prefix ending with U+D7FF skips the surrogates
+        name = "Fig \ud7ff"
+        self.post([{"id": OTHER_OFFER_ID, "name": name + " ", "price": 10,
+                    "type": "OFFER"}])
+
+        response = self.client.get('/api/search', {"name": name})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["name"] for item in response.json()["items"]],
+                         [name + " "])
+
+    def testSubtree(self):
+        # only descendants of the category are listed
+        self.assertEqual(len(self.search('parentId=' + CATEGORY_ID)), 5)
+        self.assertEqual(self.search('parentId=' + OTHER_CATEGORY_ID + '&priceFrom=0'),
+                         ["Apple pie"])
+
+    @override_settings(SEARCH_PRICE_INDEX=True)
+    def testIndexFollowsChanges(self):
+        # the price index applies imports and deletes from the change log
+        self.assertEqual(self.search('priceFrom=400&type=OFFER'), ["Apple pie"])
+
+        self.post([
+            {"id": OTHER_OFFER_ID, "name": "Durian", "price": 450, "type": "OFFER"},
+            {"id": "3fa85f64-5717-4562-b3fc-2c963f66a503", "name": "Apricot",
+             "parentId": CATEGORY_ID, "price": 250, "type": "OFFER"},
+        ])
+        self.client.delete('/api/delete/' + OFFER_ID)
+
+        self.assertEqual(self.search('priceFrom=400&type=OFFER'), ["Durian"])
+        self.assertEqual(self.search('priceFrom=200&priceTo=250'),
+                         ["apple juice", "Banana", "Fruits", "Apricot"])
+        version = CatalogVersion.current().version
+        index, built = get_price_index(version), PriceIndex.build(version)
+        self.assertEqual(index.keys, built.keys)
+        for unit_type, (prices, ids) in built.arrays.items():
+            self.assertEqual(index.arrays[unit_type][0].tolist(), prices.tolist())
+            self.assertEqual(index.arrays[unit_type][1].tolist(), ids.tolist())
+
+    def testHugePrice(self):
+        # prices beyond any stored one are clamped instead of overflowing
+        for enabled in (False, True):
+            with self.settings(SEARCH_PRICE_INDEX=enabled):
+                self.assertEqual(self.search('priceFrom=99999999999999999999'), [])
+                self.assertEqual(len(self.search('priceTo=99999999999999999999')), 8)
+
+    def testInvalidParameters(self):
+        # malformed filters are rejected
+        for query in ('priceFrom=-1', 'priceTo=abc', 'priceFrom=²', 'type=PRODUCT',
+                      'parentId=abc', 'cursor=abc', 'limit=0',
+                      'priceFrom=0&cursor=' + encode_cursor(10 ** 20, OFFER_ID)):
+            response = self.client.get('/api/search?' + query)
+
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/search?parentId=' + OTHER_OFFER_ID)
+
+        self.assertEqual(response.status_code, 404)
+
+
+class MetricsTestCase(ImportMixin, TestCase):
+    # TESTING request metrics and /metrics
+
+    def setUp(self):
+        self.post([
+            {"id": OFFER_ID, "name": "Offer 1", "price": 100, "type": "OFFER"},
+        ], "2022-05-20T12:00:00.000Z")
+
+    def sample(self, prefix):
+        # value of the first sample starting with the prefix
+        response = self.client.get('/metrics')
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        for line in response.content.decode().splitlines():
+            if line.startswith(prefix):
+                return float(line.rsplit(" ", 1)[1])
+        return 0.0
+
+    def testRequestMetrics(self):
+        # requests are counted per route with their queries
+        requests = 'api_requests_total{endpoint="api/nodes/<str:pk>",method="GET",status="200"'
+        queries = 'api_request_db_queries_sum{endpoint="api/imports",method="POST"'
+        count, imported = self.sample(requests), self.sample(queries)
+
+        self.client.get('/api/nodes/' + OFFER_ID)
+        self.post([
+            {"id": OFFER_ID, "name": "Offer 1", "price": 200, "type": "OFFER"},
+        ], "2022-05-21T12:00:00.000Z")
+
+        self.assertEqual(self.sample(requests), count + 1)
+        self.assertGreater(self.sample(queries), imported)
+        self.assertGreater(self.sample(
+            'api_response_size_bytes_count{endpoint="api/nodes/<str:pk>"'), 0)
+
+    def testSerializationTime(self):
+        # rendering and fast-path serializers are timed
+        prefix = 'api_serialization_seconds_total{endpoint="api/all",method="GET"'
+        before = self.sample(prefix)
+
+        self.client.get('/api/all?limit=10')
+
+        self.assertGreater(self.sample(prefix), before)
+
+    @override_settings(DEBUG=True)
+    async def testAsyncRequest(self):
+        # under ASGI the middleware isn't adapted to run in a thread, and the
+        # queries of the threads running the view are counted
+        queries = 'api_request_db_queries_sum{endpoint="api/nodes/<str:pk>",method="GET"'
+        before = await sync_to_async(self.sample)(queries)
+
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            response = await self.async_client.get('/api/nodes/' + OFFER_ID)
+            logging.getLogger('django.request').debug("done")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([line for line in logs.output if "MetricsMiddleware" in line])
+        self.assertGreater(await sync_to_async(self.sample)(queries), before)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+    def testSlowRequestLog(self):
+        # slow requests are logged with their SQL
+        with self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.client.get('/api/node/' + OFFER_ID + '/statistic')
+
+        self.assertIn("Slow request GET /api/node/", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+
+class GenerateCatalogTestCase(TestCase):
+    # TESTING api.generator and generate_catalog
+
+    def testReproducible(self):
+        # the same seed builds the same catalog, parents first
+        items = generate_catalog(50, depth=2, fanout=3, seed=1)
+
+        self.assertEqual(items, generate_catalog(50, depth=2, fanout=3, seed=1))
+        self.assertEqual(len(items), 3 + 9 + 50)
+        seen = set()
+        for item in items:
+            self.assertTrue(item["parentId"] is None or item["parentId"] in seen)
+            seen.add(item["id"])
+
+    def testCommand(self):
+        # the catalog and its history are imported
+        call_command('generate_catalog', '--offers', '40', '--depth', '2', '--fanout',
+                     '2', '--history', '3', '--changes', '0.5', stdout=io.StringIO())
+
+        self.assertEqual(ShopUnit.objects.filter(type=ShopUnitType.OFFER).count(), 40)
+        self.assertEqual(ShopUnit.objects.filter(type=ShopUnitType.CATEGORY).count(), 6)
+        dates = ShopUnitStatisticUnit.objects.values_list("date", flat=True)
+        self.assertEqual(len(set(dates)), 4)
+
+
+@override_settings(CACHES=dict(settings.CACHES, nodes={
+    "BACKEND": "django.core.cache.backends.dummy.DummyCache"}))
+class QueryScalingTestCase(ImportMixin, TestCase):
+    # TESTING that the number of queries of every endpoint doesn't grow with
+    # the number of items, nodes and history rows
+
+    # (offers, batches of changes) of the compared catalogs
+    SIZES = ((10, 1), (60, 4))
+
+    def catalog(self, offers, rounds, imported=True):
+        # a fresh catalog with its history, batches an hour apart
+        ShopUnitStatisticUnit.objects.all().delete()
+        ShopUnit.children.through.objects.all().delete()
+        ShopUnit.objects.all().delete()
+        items = generate_catalog(offers, depth=2, fanout=3, seed=offers)
+        history = generate_history(items, rounds, share=0.5, moves=0.2, seed=offers)
+        if imported:
+            self.post(items, at_hour(0))
+            for hour, batch in enumerate(history, 1):
+                self.post(batch, at_hour(hour))
+        return items, history
+
+    def assertConstantQueries(self, request, imported=True):
+        # runs request(items, history) on every catalog size and compares
+        counts = []
+        for offers, rounds in self.SIZES:
+            items, history = self.catalog(offers, rounds, imported)
+            with CaptureQueriesContext(connection) as queries:
+                response = request(items, history)
+            self.assertLess(response.status_code, 300)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+
+    def top(self, items):
+        return next(item["id"] for item in items if item["parentId"] is None)
+
+    def testImportNew(self):
+        # a new catalog is inserted in bulk
+        self.assertConstantQueries(lambda items, history: self.post(items, at_hour(0)),
+                                   imported=False)
+
+    def testImportChanges(self):
+        # repriced and moved offers are updated in bulk
+        self.assertConstantQueries(lambda items, history: self.post(
+            [dict(item, price=item["price"] + 1) for item in history[-1]], at_hour(20)))
+
+    def testDelete(self):
+        # a subtree is deleted with a few bulk statements
+        self.assertConstantQueries(lambda items, history: self.client.delete(
+            '/api/delete/' + self.top(items)))
+
+    def testNode(self):
+        # the subtree and its children links are fetched at once
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/nodes/' + self.top(items)))
+
+    def testAll(self):
+        # the whole catalog, at once and as a page
+        self.assertConstantQueries(lambda items, history: self.client.get('/api/all'))
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/all?limit=1000'))
+
+    def testStatistic(self):
+        # the history of a category and of an offer
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/node/{}/statistic'.format(self.top(items))))
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/node/{}/statistic'.format(history[-1][0]["id"])))
+
+    def testAnalytics(self):
+        # price analytics of a subtree
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/node/{}/analytics?interval=hour'.format(self.top(items))))
+
+    def testSales(self):
+        # every offer changed during the day
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/sales?date=2022-05-20T23:00:00.000Z'))
+
+    def testChanges(self):
+        # the change log since before the catalog
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/changes?since=0'))
+
+    def testSearch(self):
+        # price range, name prefix and subtree searches
+        for query in ('priceFrom=0', 'name=Offer', 'type=OFFER&priceTo=100000'):
+            self.assertConstantQueries(lambda items, history: self.client.get(
+                '/api/search?limit=1000&' + query))
+        self.assertConstantQueries(lambda items, history: self.client.get(
+            '/api/search?limit=1000&parentId=' + self.top(items)))
+
+
+class ChangesTestCase(ImportMixin, TestCase):
+    # TESTING the change log and /api/changes
+
+    def setUp(self):
+        self.post([
+            {"id": CATEGORY_ID, "name": "Category 1", "type": "CATEGORY"},
+            {"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+             "price": 100, "type": "OFFER"},
+        ])
+        self.seq = self.client.get('/api/changes').json()["seq"]
+
+    def testCurrentSeq(self):
+        # without since only the sequence number to continue from is returned
+        response = self.client.get('/api/changes')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {"items": [], "deleted": [], "seq": self.seq, "more": False})
+
+    def testUpserts(self):
+        # changed units and the categories above them are returned once
+        self.post([{"id": OTHER_OFFER_ID, "name": "Offer 2", "parentId": CATEGORY_ID,
+                    "price": 300, "type": "OFFER"}])
+
+        data = self.client.get('/api/changes?since={}'.format(self.seq)).json()
+
+        self.assertEqual({item["id"]: item["price"] for item in data["items"]},
+                         {CATEGORY_ID: 200, OTHER_OFFER_ID: 300})
+        self.assertEqual(data["deleted"], [])
+        self.assertGreater(data["seq"], self.seq)
+        self.assertEqual(
+            self.client.get('/api/changes?since={}'.format(data["seq"])).json()["items"],
+            [])
+
+    def testDelete(self):
+        # deleted units are listed by id, a unit changed several times once
+        self.post([{"id": OFFER_ID, "name": "Offer 1", "parentId": CATEGORY_ID,
+                    "price": 200, "type": "OFFER"}])
+        self.client.delete('/api/delete/' + OFFER_ID)
+
+        data = self.client.get('/api/changes?since=0').json()
+
+        self.assertEqual(data["deleted"], [OFFER_ID])
+        self.assertEqual([item["id"] for item in data["items"]], [CATEGORY_ID])
+        self.assertIsNone(data["items"][0]["price"])
+        self.assertFalse(data["more"])
+
+    def testPages(self):
+        # a page collapses at most limit log entries
+        data = self.client.get('/api/changes?since=0&limit=1').json()
+
+        self.assertTrue(data["more"])
+        self.assertEqual(len(data["items"]), 1)
+        data = self.client.get('/api/changes?since={}'.format(data["seq"])).json()
+        self.assertFalse(data["more"])
+        self.assertEqual(data["seq"], self.seq)
+
+    def testPruned(self):
+        # clients behind the pruned entries have to load everything again
+        call_command('prune_changes', '--days', '0', stdout=io.StringIO())
+
+        self.assertEqual(self.client.get('/api/changes?since=0').status_code, 410)
+        response = self.client.get('/api/changes?since={}'.format(self.seq))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/changes').json()["seq"], self.seq)
+
+    def testInvalidParameters(self):
+        # since and wait must be numbers in range
+        for query in ('since=x', 'since=-1', 'since=²', 'since=' + '9' * 20,
+                      'since=0&wait=x', 'since=0&wait=3600'):
+            response = self.client.get('/api/changes?' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    @override_settings(CHANGES_POLL_INTERVAL=0.01)
+    def testLongPoll(self):
+        # a client waits at most wait seconds for a change
+        response = self.client.get('/api/changes?since={}&wait=0.05'.format(self.seq))
+
+        self.assertEqual(response.json()["seq"], self.seq)
+
+    def testEventStream(self):
+        # changes are sent as events, the id is the sequence number
+        response = self.client.get('/api/changes?since=0&wait=0',
+                                   HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(response["Content-Type"], 'text/event-stream')
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn("id: {}\nevent: changes\n".format(self.seq), body)
+        self.assertIn(OFFER_ID, body)
+
+
+@override_settings(CACHES=dict(settings.CACHES, nodes={
+    "BACKEND": "django.core.cache.backends.dummy.DummyCache"}))
+class ReplicaTestCase(ImportMixin, TestCase):
+    # TESTING reads served by the in-process catalog replica
+
+    def setUp(self):
+        self.items = generate_catalog(60, depth=2, fanout=3, seed=2)
+        self.post(self.items, at_hour(0))
+        for hour, batch in enumerate(generate_history(self.items, 3, 0.5, 0.2, 2), 1):
+            self.post(batch, at_hour(hour))
+        self.replica = load_replica()
+
+    def pages(self, query):
+        # every page of a search, children in a stable order
+        pages, cursor = [], ""
+        while cursor is not None:
+            data = self.client.get('/api/search?limit=7&{}&cursor={}'.format(
+                query, cursor)).json()
+            for item in data["items"]:
+                item["children"].sort()
+            pages.append(data)
+            cursor = data["next"]
+        return pages
+
+    def assertSameAsDatabase(self):
+        top = [item["id"] for item in self.items if item["parentId"] is None]
+        urls = ['/api/nodes/' + top[0], '/api/nodes/{}?depth=1'.format(top[1]),
+                '/api/nodes/' + self.items[-1]["id"]]
+        queries = ['priceFrom=0', 'priceFrom=1000&priceTo=50000&type=OFFER', 'name=Offer 1',
+                   'name=Category', 'type=CATEGORY', 'parentId=' + top[-1],
+                   'priceTo=100000&parentId=' + top[0]]
+        with override_settings(CATALOG_REPLICA=True):
+            replica = [self.client.get(url).json() for url in urls]
+            replica += [self.pages(query) for query in queries]
+        database = [self.client.get(url).json() for url in urls]
+        database += [self.pages(query) for query in queries]
+
+        self.assertEqual(replica, database)
+
+    def testSameAsDatabase(self):
+        # nodes and searches are answered like from the database
+        self.assertSameAsDatabase()
+
+    def testCatchUp(self):
+        # imports and deletes are applied from the change log
+        top = [item for item in self.items if item["parentId"] is None]
+        offers = [item for item in self.items if item["type"] == "OFFER"]
+        self.post([dict(offers[0], price=1, parentId=top[1]["id"]),
+                   {"id": OTHER_CATEGORY_ID, "name": "Category new",
+                    "parentId": top[0]["id"], "type": "CATEGORY"},
+                   {"id": OFFER_ID, "name": "Offer new", "parentId": OTHER_CATEGORY_ID,
+                    "price": 5, "type": "OFFER"}], at_hour(10))
+        self.client.delete('/api/delete/' + top[2]["id"])
+        self.items = [item for item in self.items if item["id"] != top[2]["id"]]
+
+        self.assertSameAsDatabase()
+        self.assertEqual(self.replica.seq, self.client.get('/api/changes').json()["seq"])
+
+    @override_settings(CATALOG_REPLICA=True)
+    def testQueryCount(self):
+        # only the catalog version is read
+        self.client.get('/api/search')
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/search?priceFrom=0&parentId=' + self.items[0]["id"])
+        # and the last change of the subtree for the node cache
+        with self.assertNumQueries(2):
+            self.client.get('/api/nodes/' + self.items[0]["id"])
@@ -0,0 +1,177 @@
+"""
+Materialized path index of the ShopUnit tree.
+
+Every unit stores the ids of all its ancestors and its own id in
+``ShopUnit.path``, e.g. ``/<root hex>/<category hex>/<offer hex>/``, so
+a whole subtree or ancestor chain is fetched with one indexed query.
+"""
+
+import uuid
+
+from django.db import connection
+from django.db.models import CharField, Q, Value
+from django.db.models.functions import Concat, Substr
+
+SEPARATOR = "/"
+# length of one "<hex>/" segment of a path
+SEGMENT_LENGTH = 33
+# longest ShopUnit.path, imports deeper than that are rejected
+MAX_PATH_LENGTH = 2048
+# deepest level of the tree
+MAX_DEPTH = (MAX_PATH_LENGTH - len("/")) // SEGMENT_LENGTH
+
+
+def node_path(parent_path, unit_id) -> str:
+    """
+    Builds the path of a unit.
+
+    Args:
+        parent_path (str | None): Path of the parent, ``None`` for a root.
+        unit_id (uuid.UUID | str): Id of the unit.
+
+    Returns:
+        str: The path of the unit.
+    """
+    if not isinstance(unit_id, uuid.UUID):
+        unit_id = uuid.UUID(unit_id)
+    return (parent_path or SEPARATOR) + unit_id.hex + SEPARATOR
+
+
+def path_ids(path: str) -> list:
+    """
+    Lists the ids stored in a path, from the root down to the unit itself.
+
+    Args:
+        path (str): The path.
+
+    Returns:
+        list: UUIDs of the units on the path.
+    """
+    return [uuid.UUID(part) for part in path.split(SEPARATOR) if part]
+
+
+def path_depth(path: str) -> int:
+    """
+    Returns the depth of a path, roots have depth 1.
+    """
+    return (len(path) - 1) // SEGMENT_LENGTH
+
+
+def subtree_filter(path: str) -> Q:
+    """
+    Builds a filter matching a unit with given path and all its descendants.
+
+    Args:
+        path (str): Path of the subtree root.
+
+    Returns:
+        Q: The filter.
+    """
+    if connection.vendor == "sqlite":
+        # SQLite only uses an index for LIKE on NOCASE columns, but the
+        # same rows form a range of the BINARY collated path: "/" is
+        # followed by "0" in ASCII.
+        return Q(path__gte=path, path__lt=path[:-1] + "0")
+    return Q(path__startswith=path)
+
+
+def subtree_where(path: str) -> tuple:
+    """
+    Builds the condition of ``subtree_filter()`` for raw SQL statements.
+
+    Args:
+        path (str): Path of the subtree root.
+
+    Returns:
+        tuple: The SQL condition on the ``path`` column and its parameters.
+    """
+    column = connection.ops.quote_name("path")
+    if connection.vendor == "sqlite":
+        return "{0} >= %s AND {0} < %s".format(column), [path, path[:-1] + "0"]
+    # a path consists of hex digits and "/", there is nothing to escape
+    return "{} LIKE %s".format(column), [path + "%"]
+
+
+def rebuild_paths(model, batch_size=1000) -> int:
+    """
+    Recomputes the path of every unit from its parentId.
+
+    Units whose parent doesn't exist are treated as roots, units caught
+    in a parent cycle are left unchanged.
+
+    Args:
+        model: The ShopUnit model class (the historical one in migrations).
+        batch_size (int): Number of rows per UPDATE.
+
+    Returns:
+        int: The number of updated units.
+    """
+    parents = dict(model.objects.values_list("id", "parentId"))
+    children = {}
+    for unit_id, parent_id in parents.items():
+        if parent_id not in parents:
+            parent_id = None
+        children.setdefault(parent_id, []).append(unit_id)
+
+    paths = {}
+    stack = [(None, unit_id) for unit_id in children.get(None, [])]
+    while stack:
+        parent_id, unit_id = stack.pop()
+        paths[unit_id] = node_path(paths.get(parent_id), unit_id)
+        stack.extend((unit_id, child) for child in children.get(unit_id, []))
+
+    units = [model(id=unit_id, path=path) for unit_id, path in paths.items()]
+    model.objects.bulk_update(units, ["path"], batch_size=batch_size)
+    return len(units)
+
+
+def move_subtree(model, old_path: str, new_path: str) -> int:
+    """
+    Rewrites the paths of a subtree after its root got a new parent.
+
+    Args:
+        model: The ShopUnit model class.
+        old_path (str): Path of the subtree root before the move.
+        new_path (str): Path of the subtree root after the move.
+
+    Returns:
+        int: The number of updated units.
+    """
+    return model.objects.filter(subtree_filter(old_path)).update(
+        path=Concat(
+            Value(new_path),
+            Substr("path", len(old_path) + 1),
+            output_field=CharField(),
+        )
+    )
+
+
+def build_subtree(root_id, nodes: list, depth=None) -> dict:
+    """
+    Nests flat serialized units of a subtree into a tree.
+
+    Args:
+        root_id (str): Id of the subtree root.
+        nodes (list): Serialized units of the subtree (dicts with ``id``
+            and ``parentId`` keys), ordered by path.
+        depth (int, optional): Number of levels below the root to nest.
+            Nodes on the last level list the ids of their children instead.
+
+    Returns:
+        dict: The serialized root with nested ``children``.
+    """
+    children = {}
+    for node in nodes:
+        children.setdefault(node["parentId"], []).append(node)
+
+    root = next(node for node in nodes if node["id"] == root_id)
+    stack = [(root, 0)]
+    while stack:
+        node, level = stack.pop()
+        nested = children.get(node["id"], [])
+        if depth is not None and level >= depth:
+            node["children"] = [child["id"] for child in nested]
+            continue
+        node["children"] = nested
+        stack.extend((child, level + 1) for child in nested)
+    return root
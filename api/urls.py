@@ -1,13 +1,37 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
+from . import async_views
 from .views import ShopUnitGetAllView, ShopUnitCreateView, ShopUnitGetItemView, \
-    ShopUnitStatisticsGetView, ShopUnitSalesView, ShopUnitDeleteView
+    ShopUnitStatisticsGetView, ShopUnitSalesView, ShopUnitDeleteView, NodeCacheStatsView, \
+    ImportJobView, ShopUnitStreamImportView, ShopUnitAnalyticsView, \
+    ShopUnitSearchView, ShopUnitChangesView
 
-urlpatterns = [
-    path('all', ShopUnitGetAllView.as_view()),
+if settings.API_ASYNC_READS:
+    read_urlpatterns = [
+        path('all', async_views.all_units),
+        path('nodes/<str:pk>', async_views.node),
+        path('node/<str:pk>/statistic', async_views.statistics),
+        path('node/<str:pk>/analytics', async_views.analytics),
+        path('sales', async_views.sales),
+        path('search', async_views.search),
+        path('changes', async_views.changes),
+    ]
+else:
+    read_urlpatterns = [
+        path('all', ShopUnitGetAllView.as_view()),
+        path('nodes/<str:pk>', ShopUnitGetItemView.as_view()),
+        path('node/<str:pk>/statistic', ShopUnitStatisticsGetView.as_view()),
+        path('node/<str:pk>/analytics', ShopUnitAnalyticsView.as_view()),
+        path('sales', ShopUnitSalesView.as_view()),
+        path('search', ShopUnitSearchView.as_view()),
+        path('changes', ShopUnitChangesView.as_view()),
+    ]
+
+urlpatterns = read_urlpatterns + [
     path('imports', ShopUnitCreateView.as_view()),
-    path('nodes/<str:pk>', ShopUnitGetItemView.as_view()),
-    path('node/<str:pk>/statistic', ShopUnitStatisticsGetView.as_view()),
-    path('sales', ShopUnitSalesView.as_view()),
-    path('delete/<str:pk>', ShopUnitDeleteView.as_view())
+    path('imports/<int:job>', ImportJobView.as_view()),
+    path('imports/stream', ShopUnitStreamImportView.as_view()),
+    path('delete/<str:pk>', ShopUnitDeleteView.as_view()),
+    path('cache', NodeCacheStatsView.as_view()),
 ]
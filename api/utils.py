@@ -0,0 +1,18 @@
+from django.db import connection
+
+
+def chunked(values: list, size=None):
+    """
+    Splits a list into chunks which fit into a single query.
+
+    Args:
+        values (list): The values to split.
+        size (int, optional): Chunk size. Defaults to the backend limit
+            of query parameters (the whole list if there is no limit).
+
+    Yields:
+        list: Consecutive slices of ``values``.
+    """
+    size = size or connection.features.max_query_params or len(values) or 1
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
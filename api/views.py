@@ -1,21 +1,27 @@
-from datetime import timedelta
-from django.utils.dateparse import parse_datetime
-import uuid
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.forms import ValidationError
 from rest_framework import views, generics, mixins
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import (
-    ShopUnit,
-    ShopUnitType,
-    ShopUnitStatisticUnit,
-    ShopUnitStatisticResponse,
+from . import cache as node_cache, jobs, reads
+from .changes import accepts_events, event_stream, wait_for_changes
+from .conditional import catalog_etag, catalog_last_modified
+from .importer import (
+    ImportValidationError,
+    PartialImportError,
+    import_items,
+    import_stream,
 )
+from .models import ShopUnit, ShopUnitImportRequest
+from .reads import ReadError
 from .serializers import (
-    ShopUnitSerializer,
+    ImportJobSerializer,
     ShopUnitImportRequestSerializer,
-    ShopUnitStatisticResponseSerializer,
+    ndjson_lines,
 )
 
 
@@ -24,10 +30,18 @@ class ShopUnitGetAllView(views.APIView):
     A view for retrieving all shop units.
     """
 
+    @method_decorator(
+        condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+    )
     def get(self, request, *args, **kwargs):
         """
         Handles GET requests to retrieve all shop units.
 
+        By default every unit is returned in one list. With ``limit``
+        and/or ``cursor`` query parameters units are returned page by page
+        ordered by id, and ``stream=1`` streams every unit as a line of
+        newline delimited JSON. Both keep memory usage flat.
+
         Parameters:
         - request: The HTTP request object.
         - args: Additional positional arguments.
@@ -36,10 +50,18 @@ class ShopUnitGetAllView(views.APIView):
         Returns:
         - A Response object containing serialized shop unit data.
         """
-        shop_units = ShopUnit.objects.all()
-        serializer = ShopUnitSerializer(shop_units, many=True)
+        if request.GET.get("stream"):
+            return StreamingHttpResponse(
+                ndjson_lines(
+                    ShopUnit.objects.order_by("id"), settings.API_STREAM_CHUNK_SIZE
+                ),
+                content_type="application/x-ndjson",
+            )
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        try:
+            return Response(reads.all_units(request), status=status.HTTP_200_OK)
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
 
 
 class ShopUnitGetItemView(views.APIView):
@@ -47,9 +69,18 @@ class ShopUnitGetItemView(views.APIView):
     View class for retrieving a shop unit by its ID.
     """
 
+    @method_decorator(
+        condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+    )
     def get(self, request, *args, **kwargs):
         """
-        Retrieves a shop unit by its ID and returns the serialized data.
+        Retrieves a shop unit by its ID together with its whole subtree.
+
+        The subtree is fetched with one query by the tree path and nested
+        in memory. An optional ``depth`` query parameter limits the number
+        of nested levels, units on the last level list the ids of their
+        children (``depth=0`` returns the unit alone). Payloads are served
+        from the node cache when possible.
 
         Args:
             request: The HTTP request object.
@@ -57,27 +88,16 @@ class ShopUnitGetItemView(views.APIView):
             kwargs: Additional keyword arguments, containing the 'pk' parameter.
 
         Returns:
-            A Response object with the serialized data of the shop unit if it exists,
-            or a 404 response if the item doesn't exist.
-
-        Raises:
-            ValidationError: If the 'pk' parameter is not a valid UUID.
+            A Response object with the serialized subtree if the unit exists,
+            a 404 response if the item doesn't exist or a 400 response if the
+            'pk' parameter is not a valid UUID.
         """
-        pk = kwargs.get("pk")
         try:
-            shop_unit = ShopUnit.objects.get(id=pk)
-            serializer = ShopUnitSerializer(shop_unit)
-
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except ShopUnit.DoesNotExist:
             return Response(
-                {"message": "Such item doesn't exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        except ValidationError:
-            return Response(
-                {"message": "{} is not a valid UUID".format(pk)},
-                status=status.HTTP_400_BAD_REQUEST,
+                reads.node(request, kwargs.get("pk")), status=status.HTTP_200_OK
             )
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
 
 
 class ShopUnitCreateView(generics.CreateAPIView):
@@ -87,130 +107,91 @@ class ShopUnitCreateView(generics.CreateAPIView):
 
     serializer_class = ShopUnitImportRequestSerializer
 
-    def updateItem(shop_unit, item, date):
+    def post(self, request, *args, **kwargs):
         """
-        Updates an item in a shop unit if it exists.
+        Handles a POST request to create multiple items.
 
-        Parameters:
-            shopUnit (ShopUnit): The shop unit to update the item in.
-            item (dict): The item to update.
-            date (datetime): The date to set for the shop unit.
+        The whole batch is applied at once by the import engine, so either
+        every item is saved or none of them is. With ``async=1`` the batch
+        is only queued and 202 is returned with the job, see api/jobs.py.
 
-        Returns:
-            None: If the update is successful.
+        Args:
+            request (Request): The request object.
+            *args: Variable length argument list.
+            **kwargs: Arbitrary keyword arguments.
 
-        Raises:
-            Response: If the item type is different from the shop unit type.
+        Returns:
+            Response: The HTTP response indicating the result of the request.
         """
+        queue = request.GET.get("async") == "1"
+        try:
+            if queue:
+                job = jobs.enqueue(request.data["items"], request.data["updateDate"])
+            else:
+                import_items(request.data["items"], request.data["updateDate"])
+        except (KeyError, TypeError):
+            return Response(
+                {"message": "Validation Failed"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        except ImportValidationError as e:
+            return Response({"message": e.message}, status=status.HTTP_400_BAD_REQUEST)
 
-        if item["type"] != shop_unit.type:
+        if queue:
             return Response(
-                {"message": "Forbidden to change type"},
-                status=status.HTTP_400_BAD_REQUEST,
+                ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED
             )
+        return Response(status=status.HTTP_201_CREATED)
 
-        # Update shop unit properties
-        shop_unit.name = item["name"]
-        shop_unit.date = date
-        shop_unit.parent_id = item.get("parentId")
-        if shop_unit.type == ShopUnitType.OFFER:
-            shop_unit.price = item.get("price", 0)
-        else:
-            shop_unit.price = None
-
-        # Save the changes to shop unit
-        shop_unit.save()
-
-        # Create record in statistics table
-        shop_unit_statistic_unit = ShopUnitStatisticUnit(
-            id=shop_unit.id,
-            stat_id=uuid.uuid4(),
-            name=shop_unit.name,
-            parent_id=shop_unit.parent_id,
-            type=shop_unit.type,
-            date=date,
-            price=shop_unit.price,
-        )
-        shop_unit_statistic_unit.save()
+
+class ShopUnitStreamImportView(views.APIView):
+    """
+    A view importing newline delimited JSON items without reading the
+    whole body into memory.
+    """
 
     def post(self, request, *args, **kwargs):
         """
-        Handles a POST request to create multiple items.
+        Imports one item per line of the request body.
+
+        The body is read line by line and applied in chunks of
+        ``settings.IMPORT_STREAM_CHUNK_SIZE`` items, each in its own
+        transaction. The date of the import is the ``updateDate`` query
+        parameter.
 
         Args:
             request (Request): The request object.
-            *args: Variable length argument list.
-            **kwargs: Arbitrary keyword arguments.
 
         Returns:
-            Response: The HTTP response indicating the result of the request.
+            Response: 201 with the number of imported items, or 400 with
+            the number of items imported before the rejected chunk.
         """
-        items = request.data["items"]
-        date = request.data["updateDate"]
-
-        for item in items:
-            item_id = item.get("id") or uuid.uuid4()
-
-            shop_unit = ShopUnit.objects.filter(id=item_id).first()
-            if shop_unit:
-                resp = ShopUnitCreateView.updateItem(shop_unit, item, date)
-                if resp is not None:
-                    return resp
-                continue
-
-            item_name = item["name"]
-            parent_id = item.get("parentId")
-            parent = None
-
-            if parent_id != "null":
-                parent = ShopUnit.objects.filter(id=parent_id)
-                if not parent:
-                    return Response(
-                        {"message": "Parent does not exist"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-                if parent[0].type == ShopUnitType.OFFER:
-                    return Response(
-                        {"message": "Parent must be a category"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-
-            item_type = {
-                ShopUnitType.OFFER: ShopUnitType.OFFER,
-                ShopUnitType.CATEGORY: ShopUnitType.CATEGORY,
-            }.get(item["type"])
-
-            if item_type is None:
-                return Response(
-                    {"message": "No such type"}, status=status.HTTP_400_BAD_REQUEST
-                )
-
-            shop_unit = ShopUnit(id=item_id, name=item_name, date=date, type=item_type)
-            if item_type == ShopUnitType.OFFER:
-                shop_unit.price = item.get("price", 0)
-            else:
-                shop_unit.price = None
-
-            if parent_id is not None:
-                shop_unit.parentId = parent_id
+        try:
+            count = import_stream(
+                request.stream or [],
+                request.GET.get("updateDate"),
+                settings.IMPORT_STREAM_CHUNK_SIZE,
+            )
+        except PartialImportError as e:
+            return Response(
+                {"message": e.message, "applied": e.applied},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"applied": count}, status=status.HTTP_201_CREATED)
 
-            shop_unit.save()
 
-            if parent_id is not None:
-                parent = parent[0]
-                parent.children.add(shop_unit)
+class ImportJobView(views.APIView):
+    # view showing the status of a queued import
 
-            statistic_unit = ShopUnitStatisticUnit(
-                statid=uuid.uuid4(),
-                name=item_name,
-                parentId=shop_unit.parentId,
-                type=item_type,
-                date=date,
-                price=shop_unit.price,
+    def get(self, request, *args, **kwargs):
+        job = None
+        # no id is above the largest 64-bit integer, the database takes no more
+        if kwargs["job"] <= reads.MAX_BIGINT:
+            job = ShopUnitImportRequest.objects.filter(id=kwargs["job"]).first()
+        if job is None:
+            return Response(
+                {"message": "Such job doesn't exist"}, status=status.HTTP_404_NOT_FOUND
             )
-            statistic_unit.save()
-
-        return Response(status=status.HTTP_201_CREATED)
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_200_OK)
 
 
 class ShopUnitStatisticsGetView(views.APIView):
@@ -220,73 +201,145 @@ class ShopUnitStatisticsGetView(views.APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Retrieves a specific ShopUnitStatisticUnit object by its ID and returns the corresponding ShopUnitStatisticResponse object.
+        Retrieves ShopUnitStatisticUnit objects of a shop unit by its ID.
+
+        Optional query parameters:
+            dateStart, dateEnd: Only rows with ``dateStart <= date < dateEnd``.
+            interval: ``hour`` or ``day``, keeps the last row of every interval.
+            limit, cursor: Return a page ``{"items": [...], "next": cursor}``.
 
         Args:
             request (HttpRequest): The HTTP request object.
             **kwargs: Arbitrary keyword arguments containing pk.
 
         Returns:
-            Response: The serialized ShopUnitStatisticResponse object or an error response.
-
-        Raises:
-            ValidationError: If the ID is not a valid UUID.
+            Response: The serialized statistics or an error response.
         """
-        pk = kwargs.get("pk")
-
         try:
-            queryset = ShopUnitStatisticUnit.objects.filter(id=pk)
-
-            if queryset:
-                # create statistic_response object
-                response = ShopUnitStatisticResponse()
-                response.save()
-                response.items.add(queryset)
-                # return it
-                serializer = ShopUnitStatisticResponseSerializer(
-                    [response], many=True
-                )
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            # if statistic is not found
             return Response(
-                {"message": "Such item doesn't exist"}, status=status.HTTP_404_NOT_FOUND
+                reads.statistics(request, kwargs.get("pk")), status=status.HTTP_200_OK
             )
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
 
-        except ValidationError:
+
+class ShopUnitAnalyticsView(views.APIView):
+    """
+    A view that shows price analytics of the offers in a subtree.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Aggregates the price history of all offers below a shop unit.
+
+        Optional query parameters:
+            dateStart, dateEnd: Only rows with ``dateStart <= date < dateEnd``.
+            interval: ``hour`` or ``day``, adds the aggregates of every
+                interval as ``items``.
+            percentiles: Comma separated percentiles, ``50,90,99`` by default.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            **kwargs: Arbitrary keyword arguments containing pk.
+
+        Returns:
+            Response: The aggregates or an error response.
+        """
+        try:
             return Response(
-                {"message": "{} is not a valid UUID".format(pk)},
-                status=status.HTTP_400_BAD_REQUEST,
+                reads.analytics(request, kwargs.get("pk")), status=status.HTTP_200_OK
             )
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
+
+
+class ShopUnitSearchView(views.APIView):
+    """
+    A view that searches shop units by price, name, type and subtree.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns a page ``{"items": [...], "next": cursor}`` of shop units.
+
+        Optional query parameters:
+            priceFrom, priceTo: Only units with ``priceFrom <= price <= priceTo``.
+            name: Only units whose name starts with it (case sensitive).
+            type: ``OFFER`` or ``CATEGORY``.
+            parentId: Only descendants of this category.
+            limit, cursor: Size of the page and the position of the next one.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            Response: The page or an error response.
+        """
+        try:
+            return Response(reads.search(request), status=status.HTTP_200_OK)
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
 
 
 class ShopUnitSalesView(views.APIView):
-    # view showing statistics about units with sales during 24h from date in request
+    # view showing the latest change of every offer changed during 24h
+    # before the date in request
 
     def get(self, request, *args, **kwargs):
-        date = request.GET.get("date")
+        try:
+            return Response(reads.sales(request), status=status.HTTP_200_OK)
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
 
-        date_end = parse_datetime(date)
 
-        if date_end is None:
-            return Response(
-                {"message": "Incorrect data format"}, status=status.HTTP_400_BAD_REQUEST
-            )
+class ShopUnitChangesView(views.APIView):
+    """
+    A view that returns the changes of the catalog for incremental mirrors.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns ``{"items": [...], "deleted": [...], "seq": n, "more": bool}``
+        with the current state of the units changed after ``since`` and the
+        ids of the deleted ones, see api/changes.py.
+
+        Optional query parameters:
+            since: The last sequence number seen, only the current one is
+                returned without it.
+            wait: Seconds to wait for a change if there is none yet.
+            limit: Maximal number of log entries collapsed into the response.
+
+        With ``Accept: text/event-stream`` the changes are streamed as
+        Server-Sent Events for ``wait`` seconds
+        (``settings.CHANGES_MAX_WAIT`` by default).
+
+        Args:
+            request (HttpRequest): The HTTP request object.
 
-        date_start = date_end - timedelta(hours=24)
-        queryset = ShopUnitStatisticUnit.objects.filter(
-            date__range=[date_start, date_end], type=ShopUnitType.OFFER
-        )
+        Returns:
+            Response: The changes, an event stream or an error response,
+            410 if the changes since ``since`` were pruned.
+        """
+        try:
+            since, limit, wait = reads.changes_params(request)
+            if accepts_events(request):
+                if wait is None:
+                    wait = settings.CHANGES_MAX_WAIT
+                response = StreamingHttpResponse(
+                    event_stream(reads.changes(request), limit, wait),
+                    content_type="text/event-stream",
+                )
+                response["Cache-Control"] = "no-cache"
+                return response
+            if since is not None and wait:
+                wait_for_changes(since, wait)
+            return Response(reads.changes(request), status=status.HTTP_200_OK)
+        except ReadError as e:
+            return Response({"message": e.message}, status=e.status)
 
-        # create statistic_response object
-        shopUnitStatisticResponse = ShopUnitStatisticResponse(id=uuid.uuid4())
-        shopUnitStatisticResponse.save()
-        for stat in queryset.all():
-            shopUnitStatisticResponse.items.add(stat)
-        # return it
-        serializer = ShopUnitStatisticResponseSerializer(
-            [shopUnitStatisticResponse], many=True
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def perform_content_negotiation(self, request, force=False):
+        # event streams are rendered by the view, everything else as JSON
+        return super().perform_content_negotiation(request, force=True)
 
 
 class ShopUnitDeleteView(generics.GenericAPIView):
@@ -305,8 +358,20 @@ class ShopUnitDeleteView(generics.GenericAPIView):
             return Response(
                 {"message": "such item doesnt exist"}, status=status.HTTP_404_NOT_FOUND
             )
+        except ShopUnit.DoesNotExist:
+            # deleted by a concurrent request
+            return Response(
+                {"message": "such item doesnt exist"}, status=status.HTTP_404_NOT_FOUND
+            )
         except ValidationError:
             return Response(
                 {"message": "{} is not a valid uuid".format(pk)},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+
+
+class NodeCacheStatsView(views.APIView):
+    # view showing hit/miss counters of the node cache in this process
+
+    def get(self, request, *args, **kwargs):
+        return Response(node_cache.cache_stats(), status=status.HTTP_200_OK)
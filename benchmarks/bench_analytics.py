@@ -0,0 +1,235 @@
+"""
+Compares the NumPy aggregation of ``api.analytics`` with a per-row Python
+loop computing the same aggregates.
+
+``--rows`` synthetic price rows of ``--offers`` offers spread over a year
+are aggregated per day and for the whole year, by both implementations
+from the same columns, and the results are checked to be equal. With
+``--db-rows``, that many rows are also stored in a test database and
+``/api/node/<id>/analytics`` is timed end to end, loading included.
+
+Usage:
+    python -m benchmarks.bench_analytics --rows 3000000 --db-rows 200000
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from .utils import setup_django
+
+PERCENTILES = (50, 90, 99)
+DAY = 24 * 3600 * 10**6
+YEAR_START = 1640995200 * 10**6  # 2022-01-01
+
+
+def make_columns(rows: int, offers: int, seed: int = 0) -> tuple:
+    """
+    Builds random (offer, timestamp, price) columns ordered by offer and
+    timestamp, as ``api.analytics.load_history`` returns them.
+    """
+    rnd = np.random.default_rng(seed)
+    offer = np.sort(rnd.integers(0, offers, rows))
+    times = YEAR_START + rnd.integers(0, 365 * DAY, rows)
+    times = times[np.lexsort((times, offer))]
+    # a row changes the price of its offer with a probability of 0.3,
+    # otherwise it repeats the price of the last change
+    changed = rnd.random(rows) < 0.3
+    changed[0] = True
+    changed[1:] |= offer[1:] != offer[:-1]
+    last_change = np.maximum.accumulate(np.where(changed, np.arange(rows), 0))
+    prices = rnd.integers(100, 10000, rows)[last_change]
+    return offer, times, prices
+
+
+def percentile(ordered: list, q: float) -> float:
+    """
+    Linear interpolation between the closest ranks of a sorted list.
+    """
+    position = (len(ordered) - 1) * (q / 100)
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def python_aggregate(offers: list, times: list, prices: list, width: int) -> dict:
+    """
+    Computes the aggregates of ``aggregate()`` row by row.
+    """
+    groups = {}
+    previous_offer = previous_price = None
+    for offer, timestamp, price in zip(offers, times, prices):
+        group = groups.setdefault(
+            timestamp // width, {"prices": [], "offers": set(), "changes": 0}
+        )
+        group["prices"].append(price)
+        group["offers"].add(offer)
+        if offer == previous_offer and price != previous_price:
+            group["changes"] += 1
+        previous_offer, previous_price = offer, price
+
+    result = {}
+    for key in sorted(groups):
+        group = groups[key]
+        ordered = sorted(group["prices"])
+        row = {
+            "count": len(ordered),
+            "offers": len(group["offers"]),
+            "changes": group["changes"],
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": sum(ordered) / len(ordered),
+        }
+        for q in PERCENTILES:
+            row["p{:g}".format(q)] = percentile(ordered, q)
+        result[key] = row
+    return result
+
+
+def numpy_aggregate(offers, times, prices, width: int) -> dict:
+    from api.analytics import aggregate, price_changes, to_rows
+
+    changed = price_changes(offers, prices)
+    rows = to_rows(aggregate(times // width, offers, prices, changed, PERCENTILES))
+    return {row.pop("group"): row for row in rows}
+
+
+def same(expected: dict, actual: dict) -> bool:
+    """
+    Compares two results, allowing for rounding of the means.
+    """
+    return expected.keys() == actual.keys() and all(
+        math.isclose(expected[key][name], actual[key][name])
+        for key in expected
+        for name in expected[key]
+    )
+
+
+def measure(run, repeat: int) -> tuple:
+    """
+    Returns the result and the best wall time of ``run`` in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def bench_database(rows: int, offers: int) -> None:
+    """
+    Times the analytics endpoint and the same aggregation looping over
+    the queryset.
+    """
+    import uuid
+    from datetime import datetime, timedelta, timezone
+
+    from django.db import connection, transaction
+    from django.test import Client
+
+    from api.models import ShopUnit, ShopUnitStatisticUnit, ShopUnitType
+    from api.tree import node_path
+
+    root_id = uuid.uuid4()
+    root_path = node_path(None, root_id)
+    ids = [uuid.uuid4() for _ in range(offers)]
+    ShopUnit.objects.create(
+        id=root_id, name="Root", type=ShopUnitType.CATEGORY, path=root_path,
+        date=datetime(2022, 1, 1, tzinfo=timezone.utc),
+    )
+    ShopUnit.objects.bulk_create(
+        [
+            ShopUnit(
+                id=unit_id, name="Offer", type=ShopUnitType.OFFER, price=1,
+                parentId=root_id, path=node_path(root_path, unit_id),
+                date=datetime(2022, 1, 1, tzinfo=timezone.utc),
+            )
+            for unit_id in ids
+        ],
+        batch_size=1000,
+    )
+    offer, times, prices = make_columns(rows, offers, seed=1)
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    table = ShopUnitStatisticUnit._meta.db_table
+    sql = (
+        "INSERT INTO {} (statid, id, name, type, date, parentId, price) "
+        "VALUES (%s, %s, 'Offer', 'OFFER', %s, %s, %s)".format(table)
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            sql,
+            [
+                (
+                    uuid.uuid4().hex,
+                    ids[o].hex,
+                    (epoch + timedelta(microseconds=int(t))).strftime(
+                        "%Y-%m-%d %H:%M:%S.%f"
+                    ),
+                    root_id.hex,
+                    int(p),
+                )
+                for o, t, p in zip(offer, times, prices)
+            ],
+        )
+
+    client = Client()
+    url = "/api/node/{}/analytics?interval=day".format(root_id)
+
+    def python_endpoint():
+        queryset = ShopUnitStatisticUnit.objects.filter(
+            id__in=ShopUnit.objects.filter(path__startswith=root_path).values("id"),
+            type=ShopUnitType.OFFER,
+        ).order_by("id", "date", "statid")
+        numbers, stamps, values = [], [], []
+        for stat in queryset:
+            numbers.append(stat.id)
+            stamps.append((stat.date - epoch) // timedelta(microseconds=1))
+            values.append(stat.price)
+        return python_aggregate(numbers, stamps, values, DAY)
+
+    _, python_time = measure(python_endpoint, 1)
+    response, numpy_time = measure(lambda: client.get(url), 1)
+    assert response.status_code == 200
+    print("{} statistic rows in the database, aggregated per day".format(rows))
+    print("{:>22}: {:8.3f} s".format("per-row loop, ORM", python_time))
+    print("{:>22}: {:8.3f} s".format("/analytics", numpy_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=3000000)
+    parser.add_argument("--offers", type=int, default=100000)
+    parser.add_argument("--db-rows", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+
+    offers, times, prices = make_columns(args.rows, args.offers)
+    lists = offers.tolist(), times.tolist(), prices.tolist()
+    print("{} rows of {} offers".format(args.rows, args.offers))
+    for name, width in (("per day", DAY), ("whole year", 400 * DAY)):
+        expected, python_time = measure(
+            lambda: python_aggregate(*lists, width), args.repeat
+        )
+        actual, numpy_time = measure(
+            lambda: numpy_aggregate(offers, times, prices, width), args.repeat
+        )
+        assert same(expected, actual), "results differ"
+        print(
+            "{:>10}: per-row loop {:7.3f} s, numpy {:7.3f} s, {:5.1f}x".format(
+                name, python_time, numpy_time, python_time / numpy_time
+            )
+        )
+
+    if args.db_rows:
+        bench_database(args.db_rows, min(args.offers, args.db_rows))
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Read-heavy workload against /api/nodes/<id> and /api/all with and
+without the node cache.
+
+Every ``--write-every`` reads one offer is re-imported, which evicts the
+offer and its ancestors. Reads pick nodes with a skewed distribution,
+as storefront traffic does.
+
+Usage:
+    python -m benchmarks.bench_cache --offers 2000 --reads 20000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from .utils import make_catalog, setup_django
+
+DATE = "2022-05-20T23:12:01.000Z"
+
+
+def run(client, items, reads: int, write_every: int) -> float:
+    """
+    Runs the workload and returns the number of requests per second.
+    """
+    rnd = random.Random(0)
+    offers = [item for item in items if item["type"] == "OFFER"]
+    ids = [item["id"] for item in items]
+    start = time.perf_counter()
+    for i in range(1, reads + 1):
+        if i % write_every == 0:
+            offer = dict(rnd.choice(offers), price=rnd.randrange(100, 1000))
+            client.post(
+                "/api/imports",
+                json.dumps({"items": [offer], "updateDate": DATE}),
+                content_type="application/json",
+            )
+        elif i % 100 == 0:
+            client.get("/api/all")
+        else:
+            # a few hot nodes get most of the traffic
+            client.get("/api/nodes/" + ids[int(rnd.paretovariate(1.2)) % len(ids)])
+    return reads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offers", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--write-every", type=int, default=50)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+
+    from django.conf import settings
+    from django.test import Client, override_settings
+    from api.cache import cache_stats
+
+    client = Client()
+    items = make_catalog(args.offers)
+    client.post(
+        "/api/imports",
+        json.dumps({"items": items, "updateDate": DATE}),
+        content_type="application/json",
+    )
+
+    dummy = dict(
+        settings.CACHES,
+        nodes={"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    )
+    with override_settings(CACHES=dummy):
+        uncached = run(client, items, args.reads, args.write_every)
+    before = cache_stats()
+    cached = run(client, items, args.reads, args.write_every)
+    after = cache_stats()
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+
+    print("{} units, {} requests".format(len(items), args.reads))
+    print("without cache: {:8.0f} requests/sec".format(uncached))
+    print("   with cache: {:8.0f} requests/sec".format(cached))
+    print("hit ratio: {:.2f}".format(hits / (hits + misses)))
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
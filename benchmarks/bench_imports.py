@@ -0,0 +1,78 @@
+"""
+Compares the set-based import engine with the old per-item import path.
+
+Usage:
+    python -m benchmarks.bench_imports --items 10000
+"""
+
+import argparse
+import uuid
+
+from .utils import make_catalog, setup_django, timer
+
+
+def legacy_import(items, date):
+    """
+    The per-item import loop ``ShopUnitCreateView.post`` used to run:
+    a lookup, a parent lookup, a save, a ``children.add()`` and a
+    statistics save for every item. The save skips the tree maintenance
+    of ``ShopUnit.save()``, which the old model didn't have.
+    """
+    from api.models import ShopUnit, ShopUnitStatisticUnit
+
+    for item in items:
+        shop_unit = ShopUnit.objects.filter(id=item["id"]).first()
+        parent = None
+        if item["parentId"] is not None:
+            parent = ShopUnit.objects.filter(id=item["parentId"]).first()
+        if shop_unit is None:
+            shop_unit = ShopUnit(id=item["id"], type=item["type"])
+        shop_unit.name = item["name"]
+        shop_unit.date = date
+        shop_unit.parentId = item["parentId"]
+        shop_unit.price = item.get("price")
+        super(ShopUnit, shop_unit).save()
+        if parent is not None:
+            parent.children.add(shop_unit)
+        ShopUnitStatisticUnit(
+            statid=uuid.uuid4(),
+            id=shop_unit.id,
+            name=shop_unit.name,
+            parentId=shop_unit.parentId,
+            type=shop_unit.type,
+            date=date,
+            price=shop_unit.price,
+        ).save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+
+    from django.db import transaction
+    from api.importer import import_items
+    from api.models import ShopUnit, ShopUnitStatisticUnit
+
+    date = "2022-05-20T23:12:01.000Z"
+    results = {}
+    for name, run in (("per-item", legacy_import), ("bulk", import_items)):
+        items = make_catalog(args.items)
+        with timer(results, name), transaction.atomic():
+            run(items, date)
+        print(
+            "{:>9}: {:>7} items in {:7.3f}s, {:>9.0f} items/sec".format(
+                name, len(items), results[name], len(items) / results[name]
+            )
+        )
+        ShopUnitStatisticUnit.objects.all().delete()
+        ShopUnit.objects.all().delete()
+
+    print("speedup: {:.1f}x".format(results["per-item"] / results["bulk"]))
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
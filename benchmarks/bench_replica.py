@@ -0,0 +1,174 @@
+"""
+Measures the memory and the lookup latency of the catalog replica.
+
+A catalog of ``--offers`` offers is generated with ``api.generator`` and
+loaded into a ``CatalogReplica`` directly, without a database, to report
+the memory taken per unit (traced by ``tracemalloc``, ids, names and
+dates included) and the latency of node, subtree and search lookups.
+With ``--db-offers``, a catalog of that size is also imported into a test
+database and the same endpoints are timed end to end through the test
+client, served from the database and from the replica.
+
+Usage:
+    python -m benchmarks.bench_replica --offers 1000000 --db-offers 20000
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+import uuid
+
+from .utils import setup_django
+
+DATE = "2022-05-01T00:00:00Z"
+
+
+def percentiles(run, arguments: list) -> tuple:
+    """
+    Calls ``run`` with every argument and returns p50 and p99 latency in
+    milliseconds.
+    """
+    latencies = []
+    for argument in arguments:
+        start = time.perf_counter()
+        run(argument)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    count = len(latencies)
+    return latencies[count // 2] * 1000, latencies[int(count * 0.99)] * 1000
+
+
+def lookups(items: list, count: int, seed: int) -> dict:
+    """
+    Builds random arguments of every kind of lookup.
+    """
+    rnd = random.Random(seed)
+    categories = [item for item in items if item["type"] == "CATEGORY"]
+    parents = {item["parentId"] for item in categories}
+    leaves = [item["id"] for item in categories if item["id"] not in parents]
+    offers = [item for item in items if item["type"] == "OFFER"]
+    prices = sorted(offer["price"] for offer in offers)
+
+    def price_range():
+        low = rnd.randrange(len(prices))
+        return prices[low], prices[min(len(prices) - 1, low + 100)]
+
+    return {
+        "node (offer)": [rnd.choice(offers)["id"] for _ in range(count)],
+        "subtree (leaf category)": [rnd.choice(leaves) for _ in range(count)],
+        "search (price)": [price_range() for _ in range(count)],
+        "search (subtree)": [rnd.choice(categories)["id"] for _ in range(count)],
+    }
+
+
+def bench_memory(offers: int, depth: int, fanout: int, count: int, seed: int) -> None:
+    from api.generator import generate_catalog
+    from api.replica import CatalogReplica
+
+    gc.collect()
+    tracemalloc.start()
+    items = generate_catalog(offers, depth, fanout, seed)
+    for item in items:
+        item["date"] = DATE
+    arguments = lookups(items, count, seed)
+
+    start = time.perf_counter()
+    replica = CatalogReplica()
+    replica.add_items(items)
+    elapsed = time.perf_counter() - start
+    size = len(items)
+    del items
+    gc.collect()
+    # the lookup arguments are small next to the replica
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("{} units ({} offers)".format(size, offers))
+    print("  {:<24} {:10.1f} s".format("load", elapsed))
+    print("  {:<24} {:10.0f} bytes per unit".format("memory", memory / size))
+
+    runs = {
+        "node (offer)": lambda unit_id: replica.subtree(unit_id),
+        "subtree (leaf category)": lambda unit_id: replica.subtree(unit_id),
+        "search (price)": lambda bounds: replica.serialize_units(
+            replica.search(("price", "id"), None, 100, *bounds, None, None)
+        ),
+        "search (subtree)": lambda parent_id: replica.serialize_units(
+            replica.search(("id",), None, 100, None, None, None, uuid.UUID(parent_id))
+        ),
+    }
+    for name, run in runs.items():
+        p50, p99 = percentiles(run, arguments[name])
+        print("  {:<24} p50 {:8.3f} ms p99 {:8.3f} ms".format(name, p50, p99))
+
+
+def bench_endpoints(offers: int, depth: int, fanout: int, count: int, seed: int):
+    from django.conf import settings
+    from django.test import Client, override_settings
+
+    from api.generator import generate_catalog
+    from api.importer import import_items
+    from api.replica import load_replica
+
+    items = generate_catalog(offers, depth, fanout, seed)
+    for i in range(0, len(items), 5000):
+        import_items(items[i : i + 5000], DATE)
+    arguments = lookups(items, count, seed)
+    urls = {
+        "node (offer)": "/api/nodes/{}",
+        "subtree (leaf category)": "/api/nodes/{}",
+        "search (price)": "/api/search?limit=100&priceFrom={}&priceTo={}",
+        "search (subtree)": "/api/search?limit=100&parentId={}",
+    }
+    client = Client()
+    caches = dict(
+        settings.CACHES,
+        nodes={"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    )
+
+    print("{} units in the database, node cache disabled".format(len(items)))
+    for replica in (False, True):
+        with override_settings(CATALOG_REPLICA=replica, CACHES=caches):
+            if replica:
+                load_replica()
+            for name, url in urls.items():
+
+                def run(argument):
+                    if not isinstance(argument, tuple):
+                        argument = (argument,)
+                    response = client.get(url.format(*argument))
+                    assert response.status_code == 200, response.content
+                    json.loads(response.content)
+
+                p50, p99 = percentiles(run, arguments[name])
+                print(
+                    "  {:<9} {:<24} p50 {:8.3f} ms p99 {:8.3f} ms".format(
+                        "replica" if replica else "database", name, p50, p99
+                    )
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offers", type=int, default=1000000)
+    parser.add_argument("--db-offers", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    bench_memory(args.offers, args.depth, args.fanout, args.lookups, args.seed)
+    if args.db_offers:
+        bench_endpoints(
+            args.db_offers, args.depth, args.fanout, args.lookups, args.seed
+        )
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
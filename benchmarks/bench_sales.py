@@ -0,0 +1,124 @@
+"""
+Measures /api/sales query latency over a large statistics history.
+
+The history is queried the old way (every row of the window, latest row
+per offer picked in Python) before and after the (type, date) and
+(id, date) indexes are created, and the new way (latest row per offer
+computed by the database, which relies on the indexes).
+
+``--days`` sets the span of the history. Spread over a year, the 24 hour
+window holds about one row per offer and both ways read the same rows,
+the old one is a little faster. The new one wins when offers change
+several times a day (e.g. ``--days 4``): only the latest row of every
+offer leaves the database instead of all rows of the window.
+
+Usage:
+    python -m benchmarks.bench_sales --rows 3000000
+    python -m benchmarks.bench_sales --rows 1000000 --days 4
+"""
+
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from .utils import setup_django
+
+START = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+def fill_history(rows: int, offers: int, days: int) -> None:
+    """
+    Inserts synthetic statistic rows spread over ``days`` days.
+    """
+    from django.db import connection, transaction
+    from api.models import ShopUnitStatisticUnit
+
+    table = ShopUnitStatisticUnit._meta.db_table
+    ids = [uuid.uuid4().hex for _ in range(offers)]
+    rnd = random.Random(0)
+    sql = (
+        "INSERT INTO {} (statid, id, name, type, date, parentId, price) "
+        "VALUES (%s, %s, %s, %s, %s, NULL, %s)".format(table)
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, rows, 50000):
+            batch = []
+            for _ in range(min(50000, rows - start)):
+                date = START + timedelta(seconds=rnd.randrange(days * 24 * 3600))
+                batch.append(
+                    (
+                        uuid.uuid4().hex,
+                        rnd.choice(ids),
+                        "Offer",
+                        "OFFER" if rnd.random() < 0.9 else "CATEGORY",
+                        date.strftime("%Y-%m-%d %H:%M:%S"),
+                        rnd.randrange(100, 10000),
+                    )
+                )
+            cursor.executemany(sql, batch)
+
+
+def measure(run, repeat: int) -> float:
+    """
+    Returns the median latency of ``run`` in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=3000000)
+    parser.add_argument("--offers", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+
+    from django.db import connection
+    from api.models import ShopUnitStatisticUnit, ShopUnitType
+
+    fill_history(args.rows, args.offers, args.days)
+    indexes = ShopUnitStatisticUnit._meta.indexes
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.remove_index(ShopUnitStatisticUnit, index)
+
+    date_end = START + timedelta(days=args.days / 2)
+    window = ShopUnitStatisticUnit.objects.filter(
+        date__range=[date_end - timedelta(hours=24), date_end],
+        type=ShopUnitType.OFFER,
+    )
+
+    def old_query():
+        latest = {}
+        for stat in window.all():
+            if stat.id not in latest or latest[stat.id].date < stat.date:
+                latest[stat.id] = stat
+        return latest
+
+    def new_query():
+        return list(window.latest_per_unit(date_end))
+
+    results = {"old query, no indexes": measure(old_query, args.repeat)}
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.add_index(ShopUnitStatisticUnit, index)
+    results["old query, with indexes"] = measure(old_query, args.repeat)
+    results["new query, with indexes"] = measure(new_query, args.repeat)
+
+    print("{} statistic rows, {} in the window".format(args.rows, window.count()))
+    for name, latency in results.items():
+        print("{:>24}: {:9.2f} ms".format(name, latency))
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
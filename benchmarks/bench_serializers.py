@@ -0,0 +1,87 @@
+"""
+Serialization of shop units and statistic rows with DRF serializers
+compared to the values() based fast path used by the read endpoints.
+
+Both sides include the queries, as the endpoints do.
+
+Usage:
+    python -m benchmarks.bench_serializers --offers 20000
+"""
+
+import argparse
+import json
+import time
+
+from .utils import make_catalog, setup_django
+
+DATE = "2022-05-20T23:12:01.000Z"
+
+
+def measure(serialize, count: int, repeat: int) -> float:
+    """
+    Returns the best number of objects per second out of ``repeat`` runs.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serialize()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offers", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+
+    from django.test import Client
+    from api.models import ShopUnit, ShopUnitStatisticUnit
+    from api.serializers import (
+        STATISTIC_FIELDS,
+        ShopUnitSerializer,
+        ShopUnitStatisticUnitSerializer,
+        serialize_statistics,
+        serialize_units,
+    )
+
+    items = make_catalog(args.offers)
+    Client().post(
+        "/api/imports",
+        json.dumps({"items": items, "updateDate": DATE}),
+        content_type="application/json",
+    )
+    units = ShopUnit.objects.all()
+    rows = ShopUnitStatisticUnit.objects.all()
+
+    cases = [
+        (
+            "units",
+            units.count(),
+            lambda: ShopUnitSerializer(
+                units.prefetch_related("children"), many=True
+            ).data,
+            lambda: serialize_units(units, complete=True),
+        ),
+        (
+            "statistics",
+            rows.count(),
+            lambda: ShopUnitStatisticUnitSerializer(rows.all(), many=True).data,
+            lambda: serialize_statistics(rows.values(*STATISTIC_FIELDS)),
+        ),
+    ]
+    for name, count, drf, fast in cases:
+        slow = measure(drf, count, args.repeat)
+        quick = measure(fast, count, args.repeat)
+        print("{} ({} objects)".format(name, count))
+        print("  DRF serializer: {:10.0f} objects/sec".format(slow))
+        print("       fast path: {:10.0f} objects/sec".format(quick))
+        print("         speedup: {:10.1f}x".format(quick / slow))
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
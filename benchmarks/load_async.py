@@ -0,0 +1,200 @@
+"""
+Load test of the read endpoints: the synchronous DRF views behind
+gunicorn's threaded WSGI worker against the async views behind its
+uvicorn ASGI worker, one worker process each.
+
+A throwaway SQLite database is filled with a generated catalog and a few
+rounds of price changes, then both servers get the same mix of
+``/api/nodes``, ``/api/node/<id>/statistic``, ``/api/sales`` and
+``/api/all`` requests from ``--concurrency`` client threads. The node
+cache is disabled unless ``--cache`` is given, so the database is hit.
+
+Usage:
+    python -m benchmarks.load_async --offers 5000 --requests 4000 --concurrency 32
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .utils import ROOT_DIR, make_catalog
+
+PORT = 8765
+DATES = ["2022-05-{}T12:00:00.000Z".format(day) for day in range(20, 25)]
+SERVERS = {
+    "sync": {
+        "GUNICORN_WORKER_CLASS": "gthread",
+        "GUNICORN_APP": "prices.wsgi:application",
+    },
+    "async": {
+        "GUNICORN_WORKER_CLASS": "uvicorn.workers.UvicornWorker",
+        "GUNICORN_APP": "prices.asgi:application",
+        "API_ASYNC_READS": "1",
+    },
+}
+
+
+def request(connection, method: str, url: str, body=None):
+    """
+    Sends a request over a kept-alive connection and returns its status.
+    """
+    headers = {"Content-Type": "application/json"} if body else {}
+    connection.request(method, url, body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def start_server(env: dict):
+    """
+    Starts gunicorn and waits until it answers.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--workers=1", "--access-logfile=/dev/null"],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            request(http.client.HTTPConnection("127.0.0.1", PORT), "GET", "/api/cache")
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("the server did not start")
+
+
+def fill(items: list, rounds: int) -> None:
+    """
+    Imports the catalog and reprices all offers ``rounds`` times.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=600)
+    offers = [item for item in items if item["type"] == "OFFER"]
+    batches = [items] + [
+        [dict(offer, price=offer["price"] + i) for offer in offers]
+        for i in range(1, rounds + 1)
+    ]
+    for batch, date in zip(batches, DATES):
+        body = json.dumps({"items": batch, "updateDate": date})
+        assert request(connection, "POST", "/api/imports", body) == 201
+
+
+def make_urls(items: list, count: int) -> list:
+    """
+    Builds the request mix.
+    """
+    rnd = random.Random(0)
+    categories = [item["id"] for item in items if item["type"] == "CATEGORY"][1:]
+    offers = [item["id"] for item in items if item["type"] == "OFFER"]
+    urls = []
+    for i in range(count):
+        kind = i % 10
+        if kind < 4:
+            urls.append("/api/nodes/" + rnd.choice(categories))
+        elif kind < 7:
+            urls.append("/api/node/{}/statistic".format(rnd.choice(offers)))
+        elif kind < 9:
+            urls.append("/api/sales?date=" + rnd.choice(DATES))
+        else:
+            urls.append("/api/all?limit=100")
+    return urls
+
+
+def load(urls: list, concurrency: int) -> dict:
+    """
+    Sends all requests from ``concurrency`` threads.
+
+    Returns:
+        dict: Requests per second and latency percentiles in milliseconds.
+    """
+    latencies, errors = [], []
+    position = iter(range(len(urls)))
+    lock = threading.Lock()
+
+    def worker():
+        connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=60)
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            if request(connection, "GET", urls[i]) != 200:
+                errors.append(urls[i])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": len(urls) / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offers", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=4, help="threads of gthread")
+    parser.add_argument("--cache", action="store_true", help="keep the node cache")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            BIND="127.0.0.1:{}".format(PORT),
+            DB_NAME=os.path.join(directory, "db.sqlite3"),
+            DJANGO_DEBUG="0",
+            DJANGO_ALLOWED_HOSTS="*",
+            GUNICORN_THREADS=str(args.threads),
+        )
+        if not args.cache:
+            env["NODE_CACHE_BACKEND"] = "django.core.cache.backends.dummy.DummyCache"
+        subprocess.run(
+            [sys.executable, "manage.py", "migrate", "--noinput"],
+            cwd=ROOT_DIR,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+        items = make_catalog(args.offers)
+        urls = make_urls(items, args.requests)
+        for i, (name, server_env) in enumerate(SERVERS.items()):
+            server = start_server(dict(env, **server_env))
+            try:
+                if i == 0:
+                    fill(items, args.rounds)
+                load(urls[: args.concurrency * 4], args.concurrency)  # warm up
+                result = load(urls, args.concurrency)
+            finally:
+                server.terminate()
+                server.wait()
+            print(
+                "{:>5}: {rps:7.0f} requests/sec, p50 {p50:7.1f} ms, "
+                "p99 {p99:7.1f} ms, {errors} errors".format(name, **result)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Benchmark suite of every endpoint at several catalog sizes.
+
+For every size in ``--sizes`` (number of offers) a catalog and its price
+history are generated with ``api.generator``, imported through
+``POST /api/imports`` and then every endpoint gets ``--requests``
+requests with random parameters through the Django test client. The
+throughput and the latency percentiles of every endpoint are printed
+and, with ``--output``, written as JSON together with the version of the
+code and the arguments, so runs can be compared over time.
+
+Usage:
+    python -m benchmarks.suite --sizes 1000,10000 --output results.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+
+from .utils import ROOT_DIR, setup_django
+
+START = datetime(2022, 5, 1, tzinfo=timezone.utc)
+
+
+def iso(date) -> str:
+    """
+    Formats a date like the examples of the API.
+    """
+    return date.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def summarize(latencies: list, elapsed: float, errors: int, **extra) -> dict:
+    """
+    Computes throughput and latency percentiles of a series of requests.
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return dict(
+        requests=count,
+        errors=errors,
+        rps=count / elapsed if elapsed else None,
+        p50_ms=latencies[count // 2] * 1000 if count else None,
+        p99_ms=latencies[min(count - 1, int(count * 0.99))] * 1000 if count else None,
+        mean_ms=sum(latencies) / count * 1000 if count else None,
+        **extra,
+    )
+
+
+def measure(client, requests: list) -> dict:
+    """
+    Sends ``(method, url, body)`` requests one after another.
+    """
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for method, url, body in requests:
+        began = time.perf_counter()
+        if method == "POST":
+            response = client.post(url, body, content_type="application/json")
+        else:
+            response = getattr(client, method.lower())(url)
+        latencies.append(time.perf_counter() - began)
+        if response.status_code >= 300:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def import_requests(items: list, history: list, batch_size: int, interval) -> list:
+    """
+    Builds the import requests of a catalog and its history.
+    """
+    bodies = [
+        json.dumps({"items": items[i : i + batch_size], "updateDate": iso(START)})
+        for i in range(0, len(items), batch_size)
+    ]
+    bodies += [
+        json.dumps({"items": batch, "updateDate": iso(START + i * interval)})
+        for i, batch in enumerate(history, 1)
+    ]
+    return [("POST", "/api/imports", body) for body in bodies]
+
+
+def read_requests(items: list, rounds: int, interval, count: int, seed: int) -> dict:
+    """
+    Builds ``count`` requests with random parameters for every read endpoint.
+    """
+    rnd = random.Random(seed)
+    categories = [item["id"] for item in items if item["type"] == "CATEGORY"]
+    tops = [item["id"] for item in items if item["parentId"] is None]
+    offers = [item for item in items if item["type"] == "OFFER"]
+    prices = sorted(offer["price"] for offer in offers)
+    dates = [START + i * interval for i in range(rounds + 1)]
+
+    def price_range():
+        low = rnd.randrange(len(prices))
+        high = min(len(prices) - 1, low + rnd.randrange(1, 50))
+        return "priceFrom={}&priceTo={}".format(prices[low], prices[high])
+
+    def offer_id():
+        return rnd.choice(offers)["id"]
+
+    builders = {
+        "GET /api/nodes/<id>": lambda: "/api/nodes/" + rnd.choice(categories),
+        "GET /api/nodes/<id> (offer)": lambda: "/api/nodes/" + offer_id(),
+        "GET /api/all?limit=100": lambda: "/api/all?limit=100",
+        "GET /api/node/<id>/statistic": lambda: "/api/node/{}/statistic".format(
+            offer_id()
+        ),
+        "GET /api/node/<id>/analytics": lambda: "/api/node/{}/analytics".format(
+            rnd.choice(tops)
+        ),
+        "GET /api/sales": lambda: "/api/sales?date=" + iso(rnd.choice(dates)),
+        "GET /api/search (price)": lambda: "/api/search?limit=100&" + price_range(),
+        "GET /api/search (name)": lambda: "/api/search?limit=100&name=Offer+{}".format(
+            rnd.randrange(100)
+        ),
+    }
+    requests = {
+        name: [("GET", build(), None) for _ in range(count)]
+        for name, build in builders.items()
+    }
+    # the whole catalog is heavy, a few requests are enough
+    requests["GET /api/all"] = [("GET", "/api/all", None)] * max(1, count // 20)
+    return requests
+
+
+def delete_requests(items: list, count: int, seed: int) -> dict:
+    """
+    Builds deletions of random offers and of random leaf categories with
+    their offers.
+    """
+    rnd = random.Random(seed)
+    categories = [item for item in items if item["type"] == "CATEGORY"]
+    inner = {item["parentId"] for item in categories}
+    leaves = [item["id"] for item in categories if item["id"] not in inner]
+    offers = [item["id"] for item in items if item["type"] == "OFFER"]
+    offers = rnd.sample(offers, min(count, len(offers)))
+    return {
+        "DELETE /api/delete/<offer>": [
+            ("DELETE", "/api/delete/" + unit_id, None) for unit_id in offers
+        ],
+        "DELETE /api/delete/<category>": [
+            ("DELETE", "/api/delete/" + unit_id, None)
+            for unit_id in rnd.sample(leaves, min(count, len(leaves)))
+        ],
+    }
+
+
+def code_version() -> str:
+    """
+    Returns the commit of the working tree, if it is a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def clear() -> None:
+    """
+    Removes all data between two sizes.
+    """
+    from api.cache import get_cache
+    from api.models import CatalogVersion, ShopUnit, ShopUnitStatisticUnit
+
+    ShopUnitStatisticUnit.objects.all().delete()
+    ShopUnit.children.through.objects.all().delete()
+    ShopUnit.objects.all().delete()
+    CatalogVersion.objects.all().delete()
+    get_cache().clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000", help="Offer counts")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--history", type=int, default=5, help="Price change batches")
+    parser.add_argument("--changes", type=float, default=0.1)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200, help="Per endpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-cache", action="store_true", help="Disable node cache")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    teardown = setup_django()
+
+    import django
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client, override_settings
+
+    from api.generator import generate_catalog, generate_history
+
+    caches = settings.CACHES
+    if args.no_cache:
+        dummy = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+        caches = dict(caches, nodes=dummy)
+
+    client = Client()
+    interval = timedelta(days=1)
+    results = []
+    with override_settings(CACHES=caches, METRICS_SLOW_REQUEST_SECONDS=float("inf")):
+        for size in [int(size) for size in args.sizes.split(",")]:
+            clear()
+            items = generate_catalog(size, args.depth, args.fanout, args.seed)
+            history = generate_history(
+                items, args.history, args.changes, seed=args.seed
+            )
+            groups = {
+                "POST /api/imports": import_requests(
+                    items, history, args.batch_size, interval
+                )
+            }
+            groups.update(
+                read_requests(items, args.history, interval, args.requests, args.seed)
+            )
+            groups.update(delete_requests(items, args.requests, args.seed))
+
+            print("{} offers, {} units".format(size, len(items)))
+            for endpoint, requests in groups.items():
+                result = dict(size=size, units=len(items), endpoint=endpoint)
+                result.update(measure(client, requests))
+                results.append(result)
+                print(
+                    "  {endpoint:<32} {requests:6} requests {rps:9.1f}/s "
+                    "p50 {p50_ms:9.2f} ms p99 {p99_ms:9.2f} ms "
+                    "{errors} errors".format(**result)
+                )
+
+    if args.output:
+        report = {
+            "meta": {
+                "version": code_version(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "arguments": vars(args),
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    teardown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks run against a throwaway test database (in-memory for SQLite),
+so they never touch the data of a real installation.
+"""
+
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    """
+    Configures Django and creates a fresh test database.
+
+    Returns:
+        Callable: A function that destroys the test database.
+    """
+    sys.path.insert(0, str(ROOT_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "prices.settings")
+
+    import django
+
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    # lets the test client through ALLOWED_HOSTS
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=0, serialize=False)
+    return lambda: connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def timer(results: dict, key: str):
+    """
+    Measures the wall time of a block.
+
+    Args:
+        results (dict): Where to store the result.
+        key (str): Name of the measurement.
+    """
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+
+def make_catalog(offers: int, fanout: int = 50):
+    """
+    Builds an import batch of ``offers`` offers spread over categories.
+
+    Args:
+        offers (int): Number of offers in the batch.
+        fanout (int): Number of offers per category.
+
+    Returns:
+        list: Items in the ``POST /api/imports`` format.
+    """
+    root_id = str(uuid.uuid4())
+    items = [{"id": root_id, "name": "Root", "parentId": None, "type": "CATEGORY"}]
+    category_id = root_id
+    for i in range(offers):
+        if i % fanout == 0:
+            category_id = str(uuid.uuid4())
+            items.append(
+                {
+                    "id": category_id,
+                    "name": "Category {}".format(i // fanout),
+                    "parentId": root_id,
+                    "type": "CATEGORY",
+                }
+            )
+        items.append(
+            {
+                "id": str(uuid.uuid4()),
+                "name": "Offer {}".format(i),
+                "parentId": category_id,
+                "price": 100 + i % 1000,
+                "type": "OFFER",
+            }
+        )
+    return items
@@ -0,0 +1,20 @@
+"""
+Production server settings, see https://docs.gunicorn.org/en/stable/settings.html
+
+Run with ``gunicorn`` from the project root. Every value can be overridden
+with the environment variables below.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+wsgi_app = os.environ.get("GUNICORN_APP", "prices.wsgi:application")
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# restart workers from time to time to bound memory growth
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -20,12 +21,17 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-ps#ohp7f-xqog&g5y@_2%ole1@ii@da4fzt@s3wf^rxbnq22n6'
+SECRET_KEY = os.environ.get(
+    'DJANGO_SECRET_KEY',
+    'django-insecure-ps#ohp7f-xqog&g5y@_2%ole1@ii@da4fzt@s3wf^rxbnq22n6',
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [
+    host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host
+]
 
 
 # Application definition
@@ -42,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,14 +81,78 @@ WSGI_APPLICATION = 'prices.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+#
+# DB_ENGINE selects the backend: 'sqlite' (default) for single node runs
+# or 'postgres'. Connections are kept open for DB_CONN_MAX_AGE seconds
+# instead of reconnecting on every request.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'prices'),
+            'USER': os.environ.get('DB_USER', 'prices'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            # set when connecting through a transaction pooler (pgbouncer)
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == '1',
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                # seconds to wait for a lock before "database is locked"
+                'timeout': int(os.environ.get('DB_BUSY_TIMEOUT', 20)),
+            },
+        }
+    }
+
+# Applied to every new SQLite connection, see api.db.set_sqlite_pragmas.
+# WAL lets readers work while an import is being written.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'temp_store': 'memory',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+NODE_CACHE_BACKEND = os.environ.get(
+    'NODE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+)
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # serialized node payloads, see api/cache.py
+    'nodes': {
+        'BACKEND': NODE_CACHE_BACKEND,
+        'LOCATION': os.environ.get('NODE_CACHE_LOCATION', 'nodes'),
+        'TIMEOUT': int(os.environ.get('NODE_CACHE_TIMEOUT', 300)),
+    },
 }
 
+if NODE_CACHE_BACKEND.endswith('LocMemCache'):
+    # least recently used payloads are dropped above this size
+    CACHES['nodes']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.environ.get('NODE_CACHE_MAX_ENTRIES', 10000)),
+    }
+
+NODE_CACHE_ALIAS = 'nodes'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -123,3 +194,56 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# API
+
+# Default and maximal number of items on a page of paginated responses
+API_PAGE_SIZE = 1000
+API_MAX_PAGE_SIZE = 10000
+
+# Number of rows fetched from the database at once by streaming responses
+API_STREAM_CHUNK_SIZE = 2000
+
+# Number of items applied in one transaction by POST /api/imports/stream
+IMPORT_STREAM_CHUNK_SIZE = int(os.environ.get('IMPORT_STREAM_CHUNK_SIZE', 5000))
+
+# Imports only write a statistic row when the name, parent or price of a
+# unit differs from its latest row
+STATISTICS_CHANGES_ONLY = os.environ.get('STATISTICS_CHANGES_ONLY', '1') == '1'
+# Horizon and interval of `python manage.py compact_statistics`
+STATISTICS_RETENTION_DAYS = int(os.environ.get('STATISTICS_RETENTION_DAYS', 30))
+STATISTICS_RETENTION_INTERVAL = os.environ.get('STATISTICS_RETENTION_INTERVAL', 'day')
+
+# Answer price range searches of /api/search from sorted arrays kept in
+# every server process instead of the database index
+SEARCH_PRICE_INDEX = os.environ.get('SEARCH_PRICE_INDEX') == '1'
+
+# Per-request metrics served by /metrics, see api/metrics.py, and the
+# latency above which a request is logged with its SQL
+API_METRICS = os.environ.get('API_METRICS', '1') == '1'
+METRICS_SLOW_REQUEST_SECONDS = float(os.environ.get('METRICS_SLOW_REQUEST_SECONDS', 1))
+
+# Longest wait for changes of GET /api/changes (long polling and event
+# streams), how often the change log is polled meanwhile and how long
+# `python manage.py prune_changes` keeps it
+CHANGES_MAX_WAIT = float(os.environ.get('CHANGES_MAX_WAIT', 30))
+CHANGES_POLL_INTERVAL = float(os.environ.get('CHANGES_POLL_INTERVAL', 0.5))
+CHANGES_RETENTION_DAYS = int(os.environ.get('CHANGES_RETENTION_DAYS', 7))
+
+# Serve /api/nodes/<id> and /api/search from a replica of the catalog kept
+# in every server process, see api/replica.py
+CATALOG_REPLICA = os.environ.get('CATALOG_REPLICA') == '1'
+
+# Route the read endpoints to the async views of api/async_views.py, for
+# running under ASGI (prices.asgi:application)
+API_ASYNC_READS = os.environ.get('API_ASYNC_READS') == '1'
+
+# Queued imports (POST /api/imports?async=1), see api/jobs.py. Every web
+# process starts a worker thread on demand unless IMPORT_WORKER_THREAD=0,
+# then run `python manage.py run_import_worker` instead.
+IMPORT_WORKER_THREAD = os.environ.get('IMPORT_WORKER_THREAD', '1') == '1'
+# Seconds between checks for jobs queued by other processes
+IMPORT_WORKER_POLL_INTERVAL = float(os.environ.get('IMPORT_WORKER_POLL_INTERVAL', 5))
+# Running jobs older than this many seconds are considered abandoned
+IMPORT_JOB_TIMEOUT = int(os.environ.get('IMPORT_JOB_TIMEOUT', 3600))
@@ -3,10 +3,12 @@ from django.urls import include, path
 from rest_framework import routers
 
 from api import urls as api_urls 
+from api.metrics import metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('api/', include(api_urls)),
+    path('metrics', metrics_view),
 ]
\ No newline at end of file
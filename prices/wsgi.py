@@ -14,3 +14,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'prices.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.CATALOG_REPLICA:
+    from api.replica import start_loading
+
+    start_loading()
+
+if settings.IMPORT_WORKER_THREAD:
+    from api.jobs import wake_worker
+
+    # jobs queued before the process started don't wait for another one
+    wake_worker()